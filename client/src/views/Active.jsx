@@ -43,6 +43,7 @@ const GET_ACTIVE_SLIPS_QUERY = gql`
                             category
                         }
                         actualValue
+                        liveValue
                         id
                         invalidated
                         player {
@@ -178,11 +179,15 @@ const Active = () => {
                                             )
                                                 .tz('America/Los_Angeles')
                                                 .format('h:mma z')}
-                                            {pick.subline.line.actualValue && (
+                                            {(pick.subline.line.actualValue ||
+                                                pick.subline.line
+                                                    .liveValue) && (
                                                 <div>
                                                     {`${parseInt(
                                                         pick.subline.line
-                                                            .actualValue
+                                                            .actualValue ||
+                                                            pick.subline.line
+                                                                .liveValue
                                                     )} ${pick.subline.line.category.category.toLowerCase()} scored`}
                                                 </div>
                                             )}
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
 from import_export.admin import ExportMixin
+from core import wallet
+from core.models import WalletTransaction
 from .models import User
 
 
@@ -18,5 +20,27 @@ class UserAdmin(ExportMixin, admin.ModelAdmin):
     ordering = ('-date_joined',)
     search_fields = ['first_name', 'last_name']
 
+    # The balance is the wallet ledger's running total, so an edit to it is
+    # posted to the ledger as an adjustment instead of saved over it
+    def save_model(self, request, obj, form, change):
+        balance = obj.wallet_balance
+        if change:
+            obj.save(
+                update_fields=[
+                    field.name
+                    for field in obj._meta.concrete_fields
+                    if not field.primary_key and field.name != "wallet_balance"
+                ]
+            )
+        else:
+            obj.wallet_balance = 0
+            obj.save()
+
+        if "wallet_balance" in form.changed_data:
+            wallet.set_balances(
+                User.objects.filter(id=obj.id), balance, WalletTransaction.ADJUSTMENT
+            )
+            obj.wallet_balance = balance
+
 
 admin.site.register(User, UserAdmin)
@@ -1,7 +1,8 @@
 import json
 from django.contrib import admin
 from django.conf import settings
-from django.db import models
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils.html import format_html
 from django.forms import widgets
 from django.db.models import JSONField
@@ -19,7 +20,6 @@ from import_export import resources
 
 import pytz
 import datetime
-from django.db.models import Sum
 
 
 from accounts.models import User
@@ -40,7 +40,12 @@ from .models import (
     LineCategory,
     Movement,
     SubMovement,
+    OutboundEmail,
+    WalletTransaction,
 )
+from . import lobby_events
+from .lobby import invalidate_lobby
+from .settlement import settle_lines
 
 
 class TeamAdmin(admin.ModelAdmin):
@@ -81,10 +86,14 @@ class SublineAdmin(admin.TabularInline):
 
 
 def make_sublines_invisible(modeladmin, request, queryset):
-    sublines = Subline.objects.filter(line__in=queryset)
-    for s in sublines:
-        s.visible = False
-        s.save()
+    hidden = list(
+        Subline.objects.filter(line__in=queryset, visible=True).values_list(
+            "id", flat=True
+        )
+    )
+    Subline.objects.filter(id__in=hidden).update(visible=False)
+    invalidate_lobby()
+    lobby_events.sublines_hidden(hidden)
 
 
 make_sublines_invisible.short_description = (
@@ -116,20 +125,115 @@ class LineAdmin(ExportMixin, admin.ModelAdmin):
         "player",
     ]
 
+    # Everything the row's __str__s read, plus whether any subline is still
+    # visible as an EXISTS subquery
     def get_queryset(self, request):
         qs = super(LineAdmin, self).get_queryset(request)
-        qs = qs.annotate(models.Count("game__datetime")).select_related(
-            "player", "player__team"
+        qs = qs.annotate(
+            has_visible_subline=Exists(
+                Subline.objects.filter(line=OuterRef("pk"), visible=True)
+            )
+        ).select_related(
+            "player__team__league",
+            "game__home_team",
+            "game__away_team",
+            "category__league",
         )
         return qs
 
+    # Rows edited from the changelist are collected by save_model and
+    # written together once the whole list has been saved
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "POST":
+            return super().changelist_view(request, extra_context)
+
+        request.edited_lines = []
+        with transaction.atomic():
+            response = super().changelist_view(request, extra_context)
+            self.save_edited_lines(request.edited_lines)
+        return response
+
+    def save_model(self, request, obj, form, change):
+        if hasattr(request, "edited_lines"):
+            request.edited_lines.append(obj)
+        else:
+            # Saving settles the line and resets what it was loaded with,
+            # so note whether it was invalidated first
+            was_invalidated = self.was_invalidated(obj)
+            super().save_model(request, obj, form, change)
+            self.publish_invalidations([(obj, was_invalidated)])
+
+    # One UPDATE for the rows, one settlement run for the lines whose result
+    # changed and one lobby invalidation, instead of one of each per row
+    def save_edited_lines(self, lines):
+        if not lines:
+            return
+
+        Line.objects.bulk_update(lines, self.list_editable)
+
+        graded = [line.id for line in lines if line.result_changed]
+        if graded:
+            settle_lines(graded)
+        self.publish_invalidations((line, self.was_invalidated(line)) for line in lines)
+        for line in lines:
+            line._loaded_result = (line.actual_value, line.invalidated)
+        invalidate_lobby()
+
+    # Whether the line was invalidated as it was loaded
+    def was_invalidated(self, line):
+        actual_value, invalidated = getattr(line, "_loaded_result", (None, False))
+        return invalidated
+
+    # Invalidated lines drop out of the lobby and restored ones come back,
+    # with whichever of their sublines are visible. Takes (line, whether it
+    # was invalidated before the save) pairs.
+    def publish_invalidations(self, lines):
+        invalidated, restored = [], []
+        for line, was_invalidated in lines:
+            if line.invalidated and not was_invalidated:
+                invalidated.append(line.id)
+            elif was_invalidated and not line.invalidated:
+                restored.append(line.id)
+
+        if invalidated:
+            lobby_events.sublines_hidden(
+                Subline.objects.filter(line__in=invalidated, visible=True).values_list(
+                    "id", flat=True
+                )
+            )
+        if restored:
+            lobby_events.sublines_added(Subline.objects.filter(line__in=restored))
+
+    # Subline edits from the inline change what the lobby shows directly
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is not Subline:
+            return
+
+        added = [subline.id for subline in formset.new_objects if subline.visible]
+        hidden, changed = [], []
+        for subline, fields in formset.changed_objects:
+            if "visible" in fields:
+                (added if subline.visible else hidden).append(subline.id)
+            elif "projected_value" in fields and subline.visible:
+                changed.append(subline)
+
+        if added or hidden or changed:
+            invalidate_lobby()
+        if added:
+            lobby_events.sublines_added(added)
+        lobby_events.sublines_hidden(hidden)
+        lobby_events.projections_changed(changed)
+
     def gametime(self, obj):
         return obj.game.datetime
 
     def has_subline_visible(self, obj):
-        return obj.subline_set.filter(visible=True).count() != 0
+        return obj.has_visible_subline
 
     gametime.admin_order_field = "game__datetime"
+    has_subline_visible.admin_order_field = "has_visible_subline"
+    has_subline_visible.boolean = True
 
 
 class GameAdmin(admin.ModelAdmin):
@@ -218,6 +322,19 @@ class PickTabularInline(admin.TabularInline):
     extra = 0
     can_delete = False
 
+    # Everything the subline's __str__ and Pick.won read
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .select_related(
+                "subline__line__player__team__league",
+                "subline__line__game__home_team",
+                "subline__line__game__away_team",
+                "subline__line__category",
+            )
+        )
+
 
 class SlipResource(resources.ModelResource):
     class Meta:
@@ -233,6 +350,10 @@ class SlipResource(resources.ModelResource):
             "free_to_play",
             "creator_code",
             "creator_slip",
+            "status",
+            "num_picks",
+            "num_picks_won",
+            "payout",
         )
         export_order = fields
 
@@ -245,61 +366,38 @@ class SlipAdmin(ExportMixin, admin.ModelAdmin):
     list_display.append("won")
     list_display.append("complete")
     list_display.append("invalidated")
-    list_display.append("status")
-    list_display.append("num_picks_total")
-    list_display.append("num_picks_won")
+    readonly_fields = (
+        "status",
+        "num_picks",
+        "num_picks_won",
+        "payout",
+        "paid_out",
+    )
     inlines = [
         PickTabularInline,
     ]
     ordering = ("-datetime_created",)
     change_list_template = "admin/underline/core/change_list.html"
 
+    # The status columns are denormalized onto the slip, so the owner is the
+    # only relation a row needs
+    list_select_related = ("owner",)
+
     def get_todays_slips(self):
         tz = pytz.timezone("America/Los_Angeles")
-        start = datetime.datetime.now().replace(
-            tzinfo=tz, hour=0, minute=0, second=0
-        ) - datetime.timedelta(days=0)
-        end = datetime.datetime.now().replace(
-            tzinfo=tz, hour=23, minute=59, second=59
-        ) - datetime.timedelta(days=0)
+        start = tz.localize(
+            datetime.datetime.combine(datetime.datetime.now(tz).date(), datetime.time())
+        )
+        end = start + datetime.timedelta(days=1)
 
         return Slip.objects.filter(
-            datetime_created__lte=end, datetime_created__gte=start, free_to_play=False
+            datetime_created__lt=end, datetime_created__gte=start, free_to_play=False
         )
 
     def changelist_view(self, request, extra_context=None):
-        slips = self.get_todays_slips()
-        my_context = {
-            "count": slips.count(),
-            "entry_volume": slips.aggregate(Sum("entry_amount"))["entry_amount__sum"],
-            "payout_volume": sum(s.payout_amount for s in slips),
-        }
+        my_context = self.get_todays_slips().summary()
         return super(SlipAdmin, self).changelist_view(request, extra_context=my_context)
 
-    def status(self, obj):
-        if obj.invalidated:
-            return "Invalidated"
-        elif not obj.complete:
-            return "Incomplete"
-        else:
-            if obj.won:
-                return "Won"
-            else:
-                return "Lost"
-
-    def num_picks_total(self, obj):
-        return obj.pick_set.count()
-
-    def num_picks_won(self, obj):
-        picks = obj.pick_set.all()
-        cnt = 0
-
-        for pick in picks:
-            if pick.won:
-                cnt = cnt + 1
-
-        return cnt
-
 
 class FreeToPlaySlipsAdmin(SlipAdmin):
     pass
@@ -316,6 +414,39 @@ class PickAdmin(admin.ModelAdmin):
         return False
 
 
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = [
+        "subject",
+        "to_email",
+        "status",
+        "attempts",
+        "send_after",
+        "datetime_sent",
+    ]
+    list_filter = ["status", "digest"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+# The ledger is append-only, so it can be read here but not edited
+class WalletTransactionAdmin(admin.ModelAdmin):
+    list_display = ["user", "kind", "amount", "slip", "datetime_created"]
+    list_filter = ["kind"]
+    list_select_related = ["user"]
+    raw_id_fields = ["user", "slip", "deposit"]
+    search_fields = ["user__email"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 class LineCategoryAdmin(admin.ModelAdmin):
     list_display = [
         field.name for field in LineCategory._meta.fields if field.name != "id"
@@ -368,3 +499,5 @@ admin.site.register(Player, PlayerAdmin)
 admin.site.register(Game, GameAdmin)
 admin.site.register(Deposit, DepositAdmin)
 admin.site.register(LineCategory, LineCategoryAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+admin.site.register(WalletTransaction, WalletTransactionAdmin)
@@ -0,0 +1,97 @@
+import threading
+import time
+import urllib.parse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+AIRTABLE_API_URL = "https://api.airtable.com/v0"
+
+# Airtable allows 5 requests per second per base and answers 429 past that
+REQUESTS_PER_SECOND = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Requests go through one keep-alive session, are spaced to stay under the
+# API rate limit, and are retried with exponential backoff on 429s and 5xx
+# responses (honouring Retry-After).
+class AirtableClient:
+    def __init__(
+        self,
+        api_key=None,
+        base_url=AIRTABLE_API_URL,
+        requests_per_second=REQUESTS_PER_SECOND,
+        retries=5,
+        backoff_factor=0.5,
+        timeout=30,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.min_interval = 1 / requests_per_second if requests_per_second else 0
+
+        self._lock = threading.Lock()
+        self._last_request = 0
+        self._clock = clock
+        self._sleep = sleep
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = (
+            f"Bearer {api_key or settings.AIRTABLE_API_KEY}"
+        )
+
+    def _throttle(self):
+        with self._lock:
+            wait = self._last_request + self.min_interval - self._clock()
+            if wait > 0:
+                self._sleep(wait)
+            self._last_request = self._clock()
+
+    def get(self, base_id, table, **params):
+        self._throttle()
+        r = self.session.get(
+            f"{self.base_url}/{base_id}/{urllib.parse.quote(table, safe='')}",
+            params=params,
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+        return r.json()
+
+    # Yield every record in a table, following Airtable's pagination
+    def iter_records(self, base_id, table, view="Grid view", formula=None):
+        params = {"view": view}
+        if formula:
+            params["filterByFormula"] = formula
+
+        while True:
+            data = self.get(base_id, table, **params)
+            yield from data["records"]
+
+            if "offset" not in data:
+                return
+            params["offset"] = data["offset"]
+
+
+_client = None
+
+
+# One client per process so every sync shares the connection pool and the
+# rate limit.
+def get_client():
+    global _client
+    if _client is None:
+        _client = AirtableClient()
+    return _client
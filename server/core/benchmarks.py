@@ -0,0 +1,291 @@
+import datetime
+import json
+import logging
+import statistics
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.test import RequestFactory
+
+from accounts.models import User
+from . import exposure, mail, settlement, stats, wallet
+from .lobby import lobby_key
+from .models import (
+    CurrentDate,
+    Game,
+    Line,
+    Pick,
+    Player,
+    Slip,
+    Subline,
+    WalletTransaction,
+)
+from .sync import count_queries
+
+logger = logging.getLogger(__name__)
+
+# A benchmark regresses when its median time grows by more than this
+# fraction of the baseline, or when it runs more queries than the baseline
+TOLERANCE = 0.25
+
+
+# One code path to time. setup() runs once before the timed runs and
+# before_each() before every one, neither of them timed. Everything runs in
+# a transaction that's rolled back, so benchmarks that write leave the
+# dataset as they found it.
+class Benchmark:
+    name = None
+
+    def setup(self):
+        pass
+
+    def before_each(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+
+def execute(query, user=None, **variables):
+    # Imported here so core doesn't load the schema at import time
+    from underline.schema import schema
+
+    request = RequestFactory().post("/graphql/")
+    request.user = user or AnonymousUser()
+    result = schema.execute(query, context_value=request, variables=variables)
+    if result.errors:
+        raise result.errors[0]
+    return result.data
+
+
+# Heaviest owner of slips in the given statuses
+def busiest_owner(**filters):
+    owner_id = (
+        Slip.objects.filter(**filters)
+        .values("owner")
+        .annotate(slips=Count("id"))
+        .order_by("-slips")
+        .values_list("owner", flat=True)
+        .first()
+    )
+    return User.objects.get(id=owner_id)
+
+
+class TodaysSublines(Benchmark):
+    name = "todays_sublines"
+    query = """{
+        todaysSublines {
+            id
+            projectedValue
+            line {
+                player { name headshotUrl team { abbreviation } }
+                game { datetime homeTeam { abbreviation } awayTeam { abbreviation } }
+                category { category }
+            }
+        }
+    }"""
+
+    # Time building the lobby, not serving the cached snapshot
+    def before_each(self):
+        cache.delete(lobby_key(CurrentDate.objects.first().date))
+
+    def run(self):
+        execute(self.query)
+
+
+class ActiveSlips(Benchmark):
+    name = "active_slips"
+    query = """{
+        activeSlips {
+            id
+            entryAmount
+            payoutAmount
+            picks {
+                under
+                won
+                subline { projectedValue line { player { name } } }
+            }
+        }
+    }"""
+
+    def setup(self):
+        self.user = busiest_owner(status=Slip.INCOMPLETE)
+
+    def run(self):
+        execute(self.query, self.user)
+
+
+class CreateSlip(Benchmark):
+    name = "create_slip"
+    query = """mutation ($picks: [PickType]!) {
+        createSlip(picks: $picks, entryAmount: 10, creatorCode: "") { success }
+    }"""
+
+    # A busy user's slip over three lobby sublines, their games moved after
+    # the current time so they can still be picked. The user has already
+    # placed a slip today, so their exposure counter exists.
+    def setup(self):
+        self.user = busiest_owner()
+        wallet.set_balances(
+            User.objects.filter(id=self.user.id), 1000, WalletTransaction.ADJUSTMENT
+        )
+        exposure.reserve(self.user.id, 0)
+        sublines = list(Subline.objects.lobby(CurrentDate.objects.first().date)[:3])
+        Game.objects.filter(line__subline__in=sublines).update(
+            datetime=CurrentDate.now() + datetime.timedelta(hours=1)
+        )
+        self.picks = [
+            {"id": subline.id, "under": i % 2 == 0}
+            for i, subline in enumerate(sublines)
+        ]
+
+    def run(self):
+        if not execute(self.query, self.user, picks=self.picks)["createSlip"][
+            "success"
+        ]:
+            raise ValueError("createSlip failed")
+
+
+# update_player_scores without the SportsData request: ingest a final stat
+# record for everyone playing on the system date and settle the lines it
+# changes
+class UpdatePlayerScores(Benchmark):
+    name = "update_player_scores"
+
+    def setup(self):
+        self.date = CurrentDate.objects.first().date
+        games = Game.objects.for_pst_date(self.date)
+        lines = Line.objects.filter(game__in=games).select_related("category")
+        averages = {}
+        for line in lines.prefetch_related("subline_set"):
+            for subline in line.subline_set.all():
+                averages[line.player_id, line.category.category] = float(
+                    subline.projected_value
+                )
+
+        self.records = []
+        for player in Player.objects.filter(line__game__in=games).distinct():
+            record = {"Name": player.name, "IsGameOver": True}
+            for category, field in stats.CATEGORY_STAT_FIELDS.items():
+                average = averages.get((player.id, category))
+                if average is not None:
+                    record[field] = round(average * (0.5 + player.id % 10 / 10), 1)
+            self.records.append(record)
+
+    def run(self):
+        line_ids, report = stats.ingest_player_stats(self.records, self.date)
+        settlement.settle_lines(line_ids)
+
+
+class DiscardingClient:
+    def send(self, message):
+        pass
+
+
+# The results emails the system date's noon run sends for the day before,
+# sent nowhere
+class SendSlipEmails(Benchmark):
+    name = "send_slip_emails"
+
+    def run(self):
+        today = CurrentDate.objects.first().date
+        mail.send_results_emails(today, client=DiscardingClient())
+
+
+class SlipAdminChangelist(Benchmark):
+    name = "slip_admin_changelist"
+
+    def setup(self):
+        self.user = User.objects.create_superuser("benchmark@example.com", "password")
+        self.model_admin = admin.site._registry[Slip]
+
+    def run(self):
+        request = RequestFactory().get("/admin/core/slip/")
+        request.user = self.user
+        self.model_admin.changelist_view(request).render()
+
+
+BENCHMARKS = [
+    TodaysSublines,
+    ActiveSlips,
+    CreateSlip,
+    UpdatePlayerScores,
+    SendSlipEmails,
+    SlipAdminChangelist,
+]
+
+
+# Time `benchmark` over `repeat` runs after one untimed warm-up run.
+# Returns the median and fastest seconds and the queries per run.
+def run_benchmark(benchmark, repeat=5):
+    timings = []
+    with transaction.atomic():
+        benchmark.setup()
+        for i in range(repeat + 1):
+            with transaction.atomic():
+                benchmark.before_each()
+                with count_queries() as counter:
+                    started = time.perf_counter()
+                    benchmark.run()
+                    seconds = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if i:
+                timings.append(seconds)
+        transaction.set_rollback(True)
+
+    result = {
+        "seconds": round(statistics.median(timings), 4),
+        "fastest": round(min(timings), 4),
+        "queries": counter["queries"],
+    }
+    logger.info("Benchmark %s: %s", benchmark.name, result)
+    return result
+
+
+def dataset_size():
+    return {
+        "games": Game.objects.count(),
+        "lines": Line.objects.count(),
+        "users": User.objects.count(),
+        "slips": Slip.objects.count(),
+        "picks": Pick.objects.count(),
+    }
+
+
+# Compare results with a baseline's. Returns {name: [reasons]} for every
+# benchmark that regressed.
+def regressions(results, baseline, tolerance=TOLERANCE):
+    regressed = {}
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+
+        reasons = []
+        if result["seconds"] > before["seconds"] * (1 + tolerance):
+            reasons.append(f"{before['seconds']}s -> {result['seconds']}s")
+        if result["queries"] > before["queries"]:
+            reasons.append(f"{before['queries']} -> {result['queries']} queries")
+        if reasons:
+            regressed[name] = reasons
+    return regressed
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(
+            {"dataset": dataset_size(), "results": results}, f, indent=2, sort_keys=True
+        )
+        f.write("\n")
@@ -0,0 +1,107 @@
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone as tz
+from pytz import timezone
+
+from .models import DailyExposure, Slip
+
+logger = logging.getLogger(__name__)
+
+PST = timezone("US/Pacific")
+
+# Most a user can stake on the slips they create in one PST day
+DAILY_CAP = 80
+
+# Counters are only read for the current day; older ones are kept this long
+# for reconciling, then pruned
+RETENTION = datetime.timedelta(days=2)
+
+
+def pst_date(now=None):
+    return (now or tz.now()).astimezone(PST).date()
+
+
+# The start and end of a PST day, localized so DST days are 23 or 25 hours
+def pst_day(date):
+    start = PST.localize(datetime.datetime.combine(date, datetime.time.min))
+    end = PST.localize(
+        datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min)
+    )
+    return start, end
+
+
+# {user id: total entry} of the slips created on a PST day
+def slip_totals(date, user_ids=None):
+    start, end = pst_day(date)
+    slips = Slip.objects.filter(datetime_created__gte=start, datetime_created__lt=end)
+    if user_ids is not None:
+        slips = slips.filter(owner__in=user_ids)
+    return dict(
+        slips.values_list("owner").annotate(total=Sum("entry_amount")).order_by()
+    )
+
+
+# Add `amount` to the user's exposure for today if it stays within
+# DAILY_CAP. Returns whether it was added. Call it in the transaction that
+# creates the slip: the counter moves with a single conditional UPDATE, whose
+# row lock makes the user's other slips wait until this one commits or rolls
+# back, and a rolled back slip takes its exposure with it. The first slip of
+# the day starts the counter from the slips already created that day, so
+# counters that were never written, or were pruned, catch up on their own.
+# If another slip created the counter first, the UPDATE is simply retried
+# against it.
+def reserve(user_id, amount, now=None):
+    if amount < 0 or amount > DAILY_CAP:
+        return False
+
+    date = pst_date(now)
+    counters = DailyExposure.objects.filter(
+        user_id=user_id, date=date, amount__lte=DAILY_CAP - amount
+    )
+    if counters.update(amount=F("amount") + amount):
+        return True
+
+    DailyExposure.objects.get_or_create(
+        user_id=user_id,
+        date=date,
+        defaults={"amount": lambda: slip_totals(date, [user_id]).get(user_id, 0)},
+    )
+    return bool(counters.update(amount=F("amount") + amount))
+
+
+# Rebuild a day's counters from the slips created on it, with the counters
+# locked so slips being created wait. Counters for users without slips that
+# day are left alone. Returns the corrections as
+# {user id: (counter, slip total)}.
+@transaction.atomic
+def reconcile_exposure(date):
+    counters = dict(
+        DailyExposure.objects.filter(date=date)
+        .select_for_update()
+        .values_list("user", "amount")
+    )
+    totals = slip_totals(date, counters.keys())
+    corrections = {
+        user_id: (amount, totals.get(user_id, 0))
+        for user_id, amount in counters.items()
+        if amount != totals.get(user_id, 0)
+    }
+    for user_id, (amount, total) in corrections.items():
+        DailyExposure.objects.filter(user_id=user_id, date=date).update(amount=total)
+        logger.warning(
+            "Daily exposure for user %s on %s was %s, slips say %s",
+            user_id,
+            date,
+            amount,
+            total,
+        )
+    return corrections
+
+
+def prune_exposure(now=None):
+    cutoff = pst_date(now) - RETENTION
+    deleted, _ = DailyExposure.objects.filter(date__lt=cutoff).delete()
+    return deleted
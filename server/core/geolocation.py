@@ -0,0 +1,173 @@
+import bisect
+import collections
+import csv
+import functools
+import ipaddress
+import json
+import logging
+import mmap
+import struct
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+Location = collections.namedtuple("Location", ["country_code", "region_name"])
+
+# Compiled IP range database:
+#   header   magic, range count, offset of the regions table
+#   ranges   (first ip, last ip, region index) as big-endian uint32s/uint16,
+#            sorted by first ip and non-overlapping
+#   regions  JSON list of [country code, region name]
+MAGIC = b"ULIP"
+HEADER = struct.Struct(">4sII")
+RANGE = struct.Struct(">IIH")
+
+
+# Turn an IP2Location-style CSV (ip_from, ip_to, country_code, country_name,
+# region_name, ...) into the compiled database at `path`. Returns the number
+# of ranges written.
+def build_database(csv_file, path):
+    regions, ranges = {}, []
+    for row in csv.reader(csv_file):
+        if not row or not row[0].isdigit():
+            continue
+        # "-" marks reserved and unallocated ranges
+        if row[2] == "-":
+            continue
+        region = regions.setdefault((row[2], row[4]), len(regions))
+        ranges.append((int(row[0]), int(row[1]), region))
+
+    ranges.sort()
+    regions_offset = HEADER.size + RANGE.size * len(ranges)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ranges), regions_offset))
+        for first, last, region in ranges:
+            f.write(RANGE.pack(first, last, region))
+        f.write(json.dumps(list(regions)).encode())
+
+    return len(ranges)
+
+
+# Read-only view of the compiled database, memory-mapped so every worker
+# process shares the same pages and nothing is parsed up front. Lookups
+# binary search the sorted ranges in place.
+class IPRangeDatabase:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, regions_offset = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an IP range database")
+        self._regions = [
+            Location(*region) for region in json.loads(self._map[regions_offset:])
+        ]
+
+    def __len__(self):
+        return self._count
+
+    # First address of the i-th range, so bisect can search the file directly
+    def __getitem__(self, i):
+        return RANGE.unpack_from(self._map, HEADER.size + i * RANGE.size)[0]
+
+    def lookup(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version != 4:
+            return None
+
+        address = int(address)
+        i = bisect.bisect_right(self, address) - 1
+        if i < 0:
+            return None
+
+        first, last, region = RANGE.unpack_from(self._map, HEADER.size + i * RANGE.size)
+        return self._regions[region] if address <= last else None
+
+
+# Resolves IPs to locations through an IPRangeDatabase, with an LRU cache in
+# front. Without a database every lookup comes back unknown.
+class Geolocator:
+    def __init__(self, database=None, cache_size=4096):
+        self.database = database
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip):
+        if self.database is None or not ip:
+            return None
+        return self.database.lookup(ip)
+
+
+_geolocator = None
+
+
+# Without a database every signup would quietly be free to play, so outside
+# DEBUG a missing or broken one is a configuration error. The WSGI module
+# loads it, so web workers refuse to boot rather than run without it.
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        try:
+            database = IPRangeDatabase(settings.GEOIP_DATABASE)
+        except (OSError, ValueError) as e:
+            if not settings.DEBUG:
+                raise ImproperlyConfigured(
+                    f"Can't open the IP range database: {e}"
+                ) from e
+            logger.warning("No IP range database, locations unknown: %s", e)
+            database = None
+        _geolocator = Geolocator(database, settings.GEOIP_CACHE_SIZE)
+    return _geolocator
+
+
+# The client's address. Heroku's router appends the address it saw to
+# X-Forwarded-For, so the last entry is the one we can trust.
+def client_ip(request):
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+    if forwarded_for:
+        return forwarded_for.split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR")
+
+
+# Where paid play is allowed
+class PayToPlayPolicy:
+    def __init__(self, country_code, regions):
+        self.country_code = country_code
+        self.regions = frozenset(regions)
+
+    def allows(self, location):
+        return (
+            location is not None
+            and location.country_code == self.country_code
+            and location.region_name in self.regions
+        )
+
+
+PAY_TO_PLAY = PayToPlayPolicy(
+    "US",
+    [
+        "Arkansas",
+        "California",
+        "District of Columbia",
+        "Florida",
+        "Georgia",
+        "Kansas",
+        "New Mexico",
+        "North Dakota",
+        "Oklahoma",
+        "Oregon",
+        "Rhode Island",
+        "South Carolina",
+        "South Dakota",
+        "Texas",
+        "Utah",
+        "West Virginia",
+        "Wyoming",
+        "Colorado",
+    ],
+)
@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Subline
+
+# The lobby snapshot is keyed by the system date and a version counter.
+# Anything that changes what the lobby shows bumps the version, which
+# orphans every cached snapshot at once; the stale entries age out on their
+# own timeout.
+LOBBY_VERSION_KEY = "lobby:version"
+LOBBY_CACHE_TIMEOUT = 60 * 60
+
+
+def lobby_version():
+    version = cache.get(LOBBY_VERSION_KEY)
+    if version is None:
+        cache.add(LOBBY_VERSION_KEY, 1, timeout=None)
+        version = cache.get(LOBBY_VERSION_KEY, 1)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(LOBBY_VERSION_KEY)
+    except ValueError:
+        # Key was evicted or never set
+        cache.add(LOBBY_VERSION_KEY, 1, timeout=None)
+
+
+# Bump once the surrounding transaction commits so a lobby read racing the
+# write can't cache the old rows under the new version.
+def invalidate_lobby():
+    transaction.on_commit(_bump)
+
+
+def lobby_key(date):
+    return f"lobby:{date.isoformat()}:{lobby_version()}"
+
+
+def get_lobby(date):
+    key = lobby_key(date)
+    sublines = cache.get(key)
+
+    if sublines is None:
+        sublines = list(Subline.objects.lobby(date))
+        cache.set(key, sublines, LOBBY_CACHE_TIMEOUT)
+
+    return sublines
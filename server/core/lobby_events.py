@@ -0,0 +1,213 @@
+import contextlib
+import decimal
+import json
+import logging
+import queue
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .models import CurrentDate, Subline
+
+logger = logging.getLogger(__name__)
+
+# Compact diffs of the lobby pushed to connected clients, so they can keep
+# todaysSublines current instead of polling it
+SUBLINE_HIDDEN = "subline_hidden"
+SUBLINE_ADDED = "subline_added"
+PROJECTION_CHANGED = "projection_changed"
+
+CHANNEL = "lobby:events"
+
+# Messages a listener can fall behind by before it's dropped and told to
+# refetch the lobby
+LISTENER_QUEUE_SIZE = 100
+RECONNECT_DELAY = 1
+
+
+# One connected client's queue of messages. A listener that overflowed, or
+# was listening while the hub lost Redis, has missed messages.
+class Listener:
+    def __init__(self, size):
+        self.queue = queue.Queue(size)
+        self.dropped = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# Fans lobby messages out to this process's listeners. With a Redis URL,
+# messages are published to a Redis channel and every process keeps one
+# subscription to it, started with its first listener, so each web worker
+# holds a single Redis connection however many clients it's streaming to.
+# Without one, messages only reach listeners in the publishing process.
+class LobbyHub:
+    def __init__(self, url=None):
+        self.url = url
+        self._listeners = set()
+        self._lock = threading.Lock()
+        self._redis = redis.Redis.from_url(url) if url else None
+        self._subscriber = None
+
+    def publish(self, message):
+        data = json.dumps(message, separators=(",", ":"))
+        if self._redis is None:
+            self._dispatch(data)
+            return
+
+        try:
+            self._redis.publish(CHANNEL, data)
+        except redis.RedisError:
+            # Clients that miss a diff catch up on their next refetch
+            logger.exception("Couldn't publish lobby message")
+
+    @contextlib.contextmanager
+    def listen(self):
+        listener = Listener(LISTENER_QUEUE_SIZE)
+        with self._lock:
+            self._listeners.add(listener)
+            if self._redis is not None and self._subscriber is None:
+                self._subscriber = threading.Thread(
+                    target=self._subscribe, name="lobby-events", daemon=True
+                )
+                self._subscriber.start()
+        try:
+            yield listener
+        finally:
+            with self._lock:
+                self._listeners.discard(listener)
+
+    def _dispatch(self, data):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener.queue.put_nowait(data)
+            except queue.Full:
+                self._drop(listener)
+
+    def _drop(self, listener):
+        listener.dropped = True
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def _subscribe(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    self._dispatch(message["data"].decode())
+            except Exception:
+                # Anything escaping here would end the thread, and with it
+                # every stream in the process, for good
+                logger.exception("Lost the lobby channel, resubscribing")
+                # Whatever was published in the meantime is lost
+                with self._lock:
+                    listeners = list(self._listeners)
+                for listener in listeners:
+                    self._drop(listener)
+                time.sleep(RECONNECT_DELAY)
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = LobbyHub(settings.LOBBY_EVENTS_REDIS_URL)
+    return _hub
+
+
+def publish(message):
+    get_hub().publish(message)
+
+
+# Projected values as todaysSublines sends them, to the cent
+def format_projection(value):
+    if value is None:
+        return None
+    return str(decimal.Decimal(value).quantize(decimal.Decimal("0.01")))
+
+
+# The fields of a subline the lobby renders, shaped like the todaysSublines
+# query so clients can merge it into their results
+def serialize_subline(subline):
+    line = subline.line
+    game = line.game
+    return {
+        "id": str(subline.id),
+        "projectedValue": format_projection(subline.projected_value),
+        "line": {
+            "id": str(line.id),
+            "category": {
+                "id": str(line.category_id),
+                "category": line.category.category,
+            },
+            "player": {
+                "id": str(line.player_id),
+                "name": line.player.name,
+                "headshotUrl": line.player.headshot_url,
+                "team": {"id": str(line.player.team_id)},
+            },
+            "game": {
+                "datetime": game.datetime.isoformat(),
+                "homeTeam": {"abbreviation": game.home_team.abbreviation},
+                "awayTeam": {"abbreviation": game.away_team.abbreviation},
+            },
+        },
+    }
+
+
+# The helpers below publish once the surrounding transaction commits, so
+# clients never hear about a change that's rolled back, and never before a
+# refetch would see it.
+
+
+# Sublines taken out of the lobby
+def sublines_hidden(subline_ids):
+    subline_ids = sorted(subline_ids)
+    if subline_ids:
+        transaction.on_commit(
+            lambda: publish(
+                {"type": SUBLINE_HIDDEN, "ids": list(map(str, subline_ids))}
+            )
+        )
+
+
+# Sublines put in the lobby, given as ids or a Subline queryset. Only the
+# ones in the system date's lobby once committed are sent, in one query.
+def sublines_added(sublines):
+    def send():
+        added = [
+            serialize_subline(subline)
+            for subline in Subline.objects.lobby(
+                CurrentDate.objects.first().date
+            ).filter(id__in=sublines)
+        ]
+        if added:
+            publish({"type": SUBLINE_ADDED, "sublines": added})
+
+    transaction.on_commit(send)
+
+
+# Sublines whose projected value changed, as saved Subline objects
+def projections_changed(sublines):
+    changes = [
+        {
+            "id": str(subline.id),
+            "projectedValue": format_projection(subline.projected_value),
+        }
+        for subline in sublines
+    ]
+    if changes:
+        transaction.on_commit(
+            lambda: publish({"type": PROJECTION_CHANGED, "sublines": changes})
+        )
@@ -0,0 +1,328 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection, EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
+from django.utils import dateformat, timezone
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+from python_http_client.exceptions import BadRequestsError
+from sendgrid import SendGridAPIClient
+from pytz import timezone as pytz_timezone
+from sendgrid.helpers.mail import Mail, Personalization, To
+
+from .models import Game, OutboundEmail, Slip, Subline, grade_slips
+
+logger = logging.getLogger(__name__)
+
+FROM_EMAIL = "support@underlinesports.com"
+ADMIN_EMAIL = "support@underlinesports.com"
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = datetime.timedelta(minutes=1)
+# How long a drain has to send a claimed batch before another may retry it
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+RESULTS_TEMPLATE_ID = "d-83f3ae1c712a4e45af4744e2818489a8"
+# SendGrid accepts at most 1000 personalizations per request
+PERSONALIZATIONS_PER_REQUEST = 1000
+
+_sendgrid_client = None
+
+
+# One SendGrid client per process
+def get_sendgrid_client():
+    global _sendgrid_client
+    if _sendgrid_client is None:
+        _sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
+    return _sendgrid_client
+
+
+# Providers. Each sends one OutboundEmail and raises on failure; the
+# drain picks the one named by settings.EMAIL_OUTBOX_BACKEND.
+class SendGridBackend:
+    def __init__(self):
+        self.client = get_sendgrid_client()
+
+    def send(self, email):
+        self.client.send(
+            Mail(
+                from_email=FROM_EMAIL,
+                to_emails=email.to_email,
+                subject=email.subject,
+                html_content=email.html_content,
+            )
+        )
+
+
+# Sends through Django's EMAIL_BACKEND (SMTP, file, locmem...), for local
+# development and tests.
+class DjangoMailBackend:
+    def __init__(self):
+        self.connection = get_connection()
+
+    def send(self, email):
+        message = EmailMultiAlternatives(
+            email.subject,
+            strip_tags(email.html_content),
+            FROM_EMAIL,
+            [email.to_email],
+            connection=self.connection,
+        )
+        message.attach_alternative(email.html_content, "text/html")
+        message.send()
+
+
+def get_backend():
+    return import_string(settings.EMAIL_OUTBOX_BACKEND)()
+
+
+# Queue an email. Call inside the transaction making the change the email
+# announces so the two commit (or roll back) together.
+def queue_email(to_email, subject, html_content, digest=False):
+    return OutboundEmail.objects.create(
+        to_email=to_email,
+        subject=subject,
+        html_content=html_content,
+        digest=digest,
+    )
+
+
+def queue_admin_email(subject, html_content):
+    return queue_email(ADMIN_EMAIL, subject, html_content, digest=True)
+
+
+# Send every due email, a batch at a time. Digest emails are left for
+# send_admin_digest when the digest is on. Each batch is claimed in a short
+# transaction with SKIP LOCKED, so concurrent drains don't send the same
+# email twice, and marked sending. The provider is called outside any
+# transaction so a slow send doesn't hold row locks, and the results are
+# written in a second one. A drain that dies mid-batch leaves its claim
+# behind; those emails are due again once the claim is CLAIM_TIMEOUT old.
+def drain_outbox(backend=None):
+    backend = backend or get_backend()
+    report = {"sent": 0, "retried": 0, "failed": 0}
+
+    while True:
+        emails = _claim_emails()
+        if not emails:
+            break
+
+        for email in emails:
+            try:
+                backend.send(email)
+            except Exception as e:
+                _record_failure(email, e)
+                report["failed" if email.status == email.FAILED else "retried"] += 1
+            else:
+                email.status = OutboundEmail.SENT
+                email.datetime_sent = timezone.now()
+                report["sent"] += 1
+
+        with transaction.atomic():
+            OutboundEmail.objects.bulk_update(
+                emails,
+                ["status", "attempts", "last_error", "send_after", "datetime_sent"],
+            )
+
+    if any(report.values()):
+        logger.info("Outbox drained: %s", report)
+    return report
+
+
+def _claim_emails():
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            _due_emails()
+            .select_for_update(skip_locked=True)
+            .order_by("id")[:BATCH_SIZE]
+        )
+        OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status=OutboundEmail.SENDING, claimed_at=now
+        )
+    for email in emails:
+        email.status = OutboundEmail.SENDING
+        email.claimed_at = now
+    return emails
+
+
+# Roll every pending digest email up into one message per recipient.
+def send_admin_digest(backend=None):
+    backend = backend or get_backend()
+    sent = 0
+
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.filter(status=OutboundEmail.PENDING, digest=True)
+            .select_for_update(skip_locked=True)
+            .order_by("id")
+        )
+
+        by_recipient = {}
+        for email in emails:
+            by_recipient.setdefault(email.to_email, []).append(email)
+
+        for to_email, batch in by_recipient.items():
+            digest = OutboundEmail(
+                to_email=to_email,
+                subject=f"[AUTOMATED DIGEST] {len(batch)} notifications",
+                html_content="<hr/>".join(
+                    f"<h3>{email.subject}</h3>{email.html_content}" for email in batch
+                ),
+            )
+            try:
+                backend.send(digest)
+            except Exception as e:
+                logger.warning("Admin digest to %s failed: %s", to_email, e)
+                continue
+
+            OutboundEmail.objects.filter(id__in=[email.id for email in batch]).update(
+                status=OutboundEmail.SENT, datetime_sent=timezone.now()
+            )
+            sent += len(batch)
+
+    return sent
+
+
+def _due_emails():
+    now = timezone.now()
+    emails = OutboundEmail.objects.filter(
+        Q(status=OutboundEmail.PENDING, send_after__lte=now)
+        | Q(status=OutboundEmail.SENDING, claimed_at__lte=now - CLAIM_TIMEOUT)
+    )
+    if settings.EMAIL_OUTBOX_ADMIN_DIGEST:
+        emails = emails.exclude(digest=True)
+    return emails
+
+
+# Back off exponentially between attempts and give up after MAX_ATTEMPTS
+def _record_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+        logger.error("Giving up on email %d: %s", email.id, error)
+    else:
+        email.status = OutboundEmail.PENDING
+        email.send_after = timezone.now() + RETRY_BACKOFF * 2 ** (email.attempts - 1)
+
+
+# Email everyone who had a slip on yesterday's games their results, along
+# with three of today's lines. Yesterday's slips and their owners come from
+# one query and are graded in memory from one more; the emails go out as
+# SendGrid personalizations of the results template, up to 1000 recipients
+# per request.
+def send_results_emails(today=None, client=None):
+    client = client or get_sendgrid_client()
+    started = time.monotonic()
+    today = today or timezone.now().astimezone(pytz_timezone("US/Pacific")).date()
+    yesterday = today - datetime.timedelta(days=1)
+
+    slips = list(
+        Slip.objects.filter(
+            pick__subline__line__game__in=Game.objects.for_pst_date(yesterday)
+        )
+        .distinct()
+        .select_related("owner")
+        .order_by("owner_id", "id")
+    )
+    grade_slips(slips)
+
+    slips_by_owner = {}
+    for slip in slips:
+        slips_by_owner.setdefault(slip.owner, []).append(slip)
+
+    today_lines = [
+        {
+            "src": subline.line.player.headshot_url,
+            "name": str(subline.line.player),
+            "game": str(subline.line.game),
+            "projection": f"{str(round(subline.projected_value, 1))} {subline.line.category.category}",
+        }
+        for subline in Subline.objects.lobby(today).order_by("?")[:3]
+    ]
+
+    yesterday_str = dateformat.format(yesterday, "F jS")
+    today_str = dateformat.format(today, "F jS")
+
+    personalizations = []
+    for owner, owner_slips in slips_by_owner.items():
+        ftp = " Free to Play " if owner.free_to_play else " "
+        personalization = Personalization()
+        personalization.add_to(To(owner.email))
+        personalization.dynamic_template_data = {
+            "subject": f"Underline{ftp}Results for {yesterday_str}",
+            "body": f"Hey {owner.first_name} - here are your{ftp}results for {yesterday_str}.",
+            "todayDate": today_str,
+            "slips": [
+                {
+                    "numPicks": slip.num_picks,
+                    "payoutAmount": f"${slip.payout_amount}",
+                    "outcome": "Won" if slip.won else "Lost",
+                }
+                for slip in owner_slips
+            ],
+            "todayLines": today_lines,
+        }
+        personalizations.append(personalization)
+
+    report = {
+        "recipients": len(personalizations),
+        "slips": len(slips),
+        "requests": 0,
+        "failed": 0,
+    }
+
+    for i in range(0, len(personalizations), PERSONALIZATIONS_PER_REQUEST):
+        batch = personalizations[i : i + PERSONALIZATIONS_PER_REQUEST]
+        _send_personalizations(client, batch, report)
+
+    report["seconds"] = round(time.monotonic() - started, 2)
+    report["per_second"] = round(
+        report["recipients"] / max(time.monotonic() - started, 0.001), 1
+    )
+    logger.info("Results emails for %s: %s", yesterday, report)
+    return report
+
+
+# Send one results request. SendGrid rejects the whole request when one
+# personalization is bad (a malformed or bounced-domain address), so on a
+# 400 the batch is split and each half retried, narrowing the failure down
+# to the recipients SendGrid won't take. Those, and whole batches lost to
+# other errors, are logged so they can be followed up by hand.
+def _send_personalizations(client, batch, report):
+    message = Mail(from_email=FROM_EMAIL)
+    message.template_id = RESULTS_TEMPLATE_ID
+    for index, personalization in enumerate(batch):
+        # add_personalization prepends unless given an index
+        message.add_personalization(personalization, index)
+
+    report["requests"] += 1
+    if settings.DEBUG:
+        return
+
+    try:
+        client.send(message)
+    except BadRequestsError as e:
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            _send_personalizations(client, batch[:middle], report)
+            _send_personalizations(client, batch[middle:], report)
+            return
+        _log_failed_results(batch, e, report)
+    except Exception as e:
+        _log_failed_results(batch, e, report)
+
+
+def _log_failed_results(batch, error, report):
+    report["failed"] += len(batch)
+    logger.error(
+        "Results email not sent to %s: %s",
+        ", ".join(p.tos[0]["email"] for p in batch),
+        error,
+    )
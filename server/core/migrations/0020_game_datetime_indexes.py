@@ -0,0 +1,22 @@
+# Generated by Django 3.1.6 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_auto_20210625_0749'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='datetime',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['league', 'datetime'], name='core_game_league__d6e9c1_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.6 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_game_datetime_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slip',
+            name='num_picks',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='slip',
+            name='num_picks_won',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='slip',
+            name='payout',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='slip',
+            name='status',
+            field=models.CharField(choices=[('incomplete', 'Incomplete'), ('won', 'Won'), ('lost', 'Lost'), ('invalidated', 'Invalidated')], default='incomplete', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='slip',
+            index=models.Index(fields=['owner', 'status', 'datetime_created'], name='core_slip_owner_i_31755f_idx'),
+        ),
+    ]
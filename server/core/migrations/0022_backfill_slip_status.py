@@ -0,0 +1,75 @@
+from django.db import migrations
+from django.db.models import Count, F, Q
+
+
+BATCH_SIZE = 1000
+PAYOUT_MULTIPLIERS = {2: 3, 3: 6, 4: 10, 5: 20}
+
+
+def backfill_slip_status(apps, schema_editor):
+    Slip = apps.get_model("core", "Slip")
+    Pick = apps.get_model("core", "Pick")
+
+    slip_ids = list(Slip.objects.order_by("id").values_list("id", flat=True))
+
+    for i in range(0, len(slip_ids), BATCH_SIZE):
+        slips = list(Slip.objects.filter(id__in=slip_ids[i : i + BATCH_SIZE]))
+        graded = {
+            row["slip"]: row
+            for row in Pick.objects.filter(slip__in=slips)
+            .values("slip")
+            .annotate(
+                total=Count("id"),
+                ungraded=Count("id", filter=Q(subline__line__actual_value=None)),
+                invalidated=Count("id", filter=Q(subline__line__invalidated=True)),
+                won=Count(
+                    "id",
+                    filter=Q(subline__line__invalidated=False)
+                    & (
+                        Q(
+                            under=True,
+                            subline__line__actual_value__lt=F(
+                                "subline__projected_value"
+                            ),
+                        )
+                        | Q(
+                            ~Q(under=True),
+                            subline__line__actual_value__gt=F(
+                                "subline__projected_value"
+                            ),
+                        )
+                    ),
+                ),
+            )
+            .order_by()
+        }
+
+        for slip in slips:
+            row = graded.get(slip.id)
+            slip.num_picks = row["total"] if row else 0
+            slip.num_picks_won = row["won"] if row else 0
+
+            if row and row["invalidated"]:
+                slip.status = "invalidated"
+            elif not row or row["ungraded"]:
+                slip.status = "incomplete"
+            elif slip.num_picks_won == slip.num_picks:
+                slip.status = "won"
+            else:
+                slip.status = "lost"
+
+            multiplier = PAYOUT_MULTIPLIERS.get(slip.num_picks, 0)
+            slip.payout = slip.entry_amount * multiplier if slip.status == "won" else 0
+
+        Slip.objects.bulk_update(slips, ["status", "num_picks", "num_picks_won", "payout"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_slip_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_slip_status, migrations.RunPython.noop),
+    ]
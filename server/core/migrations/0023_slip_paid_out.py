@@ -0,0 +1,27 @@
+# Generated by Django 3.1.6 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+# Winnings were never credited automatically before settlement existed, so
+# treat every historical payout as already handled rather than paying it
+# out the first time one of its lines is touched.
+def mark_existing_payouts_paid(apps, schema_editor):
+    Slip = apps.get_model("core", "Slip")
+    Slip.objects.update(paid_out=models.F("payout"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_backfill_slip_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slip',
+            name='paid_out',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_existing_payouts_paid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.6 on 2026-10-18 12:32
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+# Keep the first of each set of duplicate games, moving the lines of the
+# others onto it, so the unique constraint can be added
+def dedupe_games(apps, schema_editor):
+    Game = apps.get_model("core", "Game")
+    Line = apps.get_model("core", "Line")
+
+    # Check foreign keys as we go, so no trigger events are left pending on
+    # core_game when the constraint is added in the same transaction
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    duplicates = (
+        Game.objects.values("league", "home_team", "away_team", "datetime")
+        .annotate(kept=Min("id"), count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        others = Game.objects.filter(
+            league=row["league"],
+            home_team=row["home_team"],
+            away_team=row["away_team"],
+            datetime=row["datetime"],
+        ).exclude(id=row["kept"])
+        Line.objects.filter(game__in=others).update(game=row["kept"])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_slip_paid_out'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_games, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.UniqueConstraint(fields=('league', 'home_team', 'away_team', 'datetime'), name='unique_game'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Open every user's ledger with the balance they have now, so the ledger
+# and the balances agree from the start
+def open_ledgers(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    WalletTransaction = apps.get_model("core", "WalletTransaction")
+    WalletTransaction.objects.bulk_create(
+        (
+            WalletTransaction(user_id=user_id, kind="opening", amount=balance)
+            for user_id, balance in User.objects.exclude(wallet_balance=0)
+            .values_list("id", "wallet_balance")
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0025_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('entry', 'Slip entry'), ('payout', 'Slip payout'), ('deposit', 'Deposit'), ('top_off', 'Free to play top-off'), ('adjustment', 'Adjustment')], max_length=16)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+                ('deposit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.deposit')),
+                ('slip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.slip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('last_transaction_id', models.PositiveBigIntegerField(db_index=True)),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='wallettransaction',
+            index=models.Index(fields=['user', 'id'], name='core_wallet_user_id_74ee94_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletcheckpoint',
+            index=models.Index(fields=['user', 'last_transaction_id'], name='core_wallet_user_id_f40817_idx'),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0026_wallet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyExposure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyexposure',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_daily_exposure'),
+        ),
+    ]
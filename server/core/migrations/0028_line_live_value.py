@@ -0,0 +1,18 @@
+# Generated by Django 3.1.6 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_daily_exposure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='line',
+            name='live_value',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True),
+        ),
+    ]
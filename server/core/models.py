@@ -1,10 +1,15 @@
+import collections
+import datetime
+
 from django.db import models
+from django.db.models.functions import Coalesce
 from pytz import timezone, utc
 from django.utils import timezone as tz
 
 
 from accounts.models import User
 
+
 # US based date (PST - EST)
 class CurrentDate(models.Model):
     date = models.DateField()
@@ -16,6 +21,13 @@ class CurrentDate(models.Model):
     def __str__(self):
         return self.date.strftime("%m/%d/%Y")
 
+    # The current PST wall-clock time, on the system date
+    @classmethod
+    def now(cls):
+        pst = timezone("US/Pacific")
+        time = tz.now().astimezone(pst).time().replace(tzinfo=None)
+        return pst.localize(datetime.datetime.combine(cls.objects.first().date, time))
+
 
 class League(models.Model):
     acronym = models.CharField(max_length=16)
@@ -36,6 +48,27 @@ class Team(models.Model):
         return f"{self.name} ({self.league.acronym})"
 
 
+class GameQuerySet(models.QuerySet):
+    # Games whose PST tip-off falls on the given date. The PST day is
+    # converted to a [start, end) datetime range so the filter runs in the
+    # database against the datetime indexes instead of in Python.
+    def for_pst_date(self, date, league=None):
+        pst = timezone("US/Pacific")
+        start = pst.localize(datetime.datetime.combine(date, datetime.time.min))
+        end = pst.localize(
+            datetime.datetime.combine(
+                date + datetime.timedelta(days=1), datetime.time.min
+            )
+        )
+        qs = self.filter(datetime__gte=start, datetime__lt=end)
+        if league is not None:
+            qs = qs.filter(league=league)
+        return qs
+
+    def started(self, now):
+        return self.filter(datetime__lte=now)
+
+
 class Game(models.Model):
     league = models.ForeignKey(League, on_delete=models.CASCADE)
     home_team = models.ForeignKey(
@@ -44,7 +77,20 @@ class Game(models.Model):
     away_team = models.ForeignKey(
         Team, on_delete=models.CASCADE, related_name="away_games"
     )
-    datetime = models.DateTimeField()
+    datetime = models.DateTimeField(db_index=True)
+
+    objects = GameQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["league", "datetime"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["league", "home_team", "away_team", "datetime"],
+                name="unique_game",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.away_team.abbreviation} @ {self.home_team.abbreviation} ({self.pst_gametime.strftime('%m/%d/%y %-I:%M %p')} PST)"
@@ -99,6 +145,11 @@ class Line(models.Model):
     actual_value = models.DecimalField(
         max_digits=5, decimal_places=2, blank=True, null=True
     )
+    # The player's stat so far while the game is in progress. Only the
+    # final box score becomes the actual value that picks are graded on.
+    live_value = models.DecimalField(
+        max_digits=5, decimal_places=2, blank=True, null=True
+    )
     datetime_created = models.DateTimeField(auto_now_add=True)
 
     invalidated = models.BooleanField(default=False)
@@ -106,6 +157,21 @@ class Line(models.Model):
     def __str__(self):
         return f"{self.player.name} - {self.game} [{self.category.category}]"
 
+    # Remember the graded values as loaded so a save only regrades the
+    # attached slips when the result actually changed.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_result = (instance.actual_value, instance.invalidated)
+        return instance
+
+    @property
+    def result_changed(self):
+        return getattr(self, "_loaded_result", None) != (
+            self.actual_value,
+            self.invalidated,
+        )
+
     def game_date(self):
         return self.game.datetime
 
@@ -127,6 +193,28 @@ class SubMovement(models.Model):
     movement = models.ForeignKey(Movement, on_delete=models.CASCADE)
 
 
+class SublineQuerySet(models.QuerySet):
+    # Visible sublines for the lobby on the given PST date in one query:
+    # premier players first, then by tip-off. Every relation the lobby
+    # serializes is joined up front so resolving fields doesn't hit the db.
+    def lobby(self, date):
+        return (
+            self.filter(
+                line__game__in=Game.objects.for_pst_date(date),
+                line__invalidated=False,
+                visible=True,
+            )
+            .select_related(
+                "submovement",
+                "line__player__team",
+                "line__game__home_team",
+                "line__game__away_team",
+                "line__category__league",
+            )
+            .order_by("-line__player__premier", "line__game__datetime", "id")
+        )
+
+
 class Subline(models.Model):
     line = models.ForeignKey(Line, on_delete=models.CASCADE)
     projected_value = models.DecimalField(
@@ -138,11 +226,94 @@ class Subline(models.Model):
 
     submovement = models.ForeignKey(SubMovement, on_delete=models.CASCADE, null=True)
 
+    objects = SublineQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.line}"
 
 
+# Picks on a slip -> payout multiplier of the entry amount
+PAYOUT_MULTIPLIERS = {2: 3, 3: 6, 4: 10, 5: 20}
+
+
+def grade_pick(under, projected_value, actual_value, invalidated):
+    if actual_value is None:
+        return None
+    elif invalidated:
+        return False
+    elif under:
+        return actual_value < projected_value
+    else:
+        return actual_value > projected_value
+
+
+# Grade the given slips in memory from one query over their picks. The
+# slips are left with their status columns set, unsaved.
+def grade_slips(slips):
+    results = collections.defaultdict(list)
+
+    for slip_id, under, projected_value, actual_value, invalidated in (
+        Pick.objects.filter(slip__in=[slip.id for slip in slips])
+        .values_list(
+            "slip_id",
+            "under",
+            "subline__projected_value",
+            "subline__line__actual_value",
+            "subline__line__invalidated",
+        )
+        .order_by()
+    ):
+        results[slip_id].append(
+            (
+                invalidated,
+                grade_pick(under, projected_value, actual_value, invalidated),
+            )
+        )
+
+    for slip in slips:
+        slip.grade(results[slip.id])
+
+
+class SlipQuerySet(models.QuerySet):
+    # Recompute and persist the status columns. Winnings are credited
+    # separately by core.settlement.
+    def refresh_status(self):
+        slips = list(self)
+        grade_slips(slips)
+        Slip.objects.bulk_update(slips, Slip.GRADED_FIELDS)
+        return slips
+
+    # Slip count, entry volume and payout volume (what the slips pay out if
+    # they win, as Slip.payout_amount) in one aggregate query
+    def summary(self):
+        payout_amount = models.Case(
+            *[
+                models.When(num_picks=num_picks, then=models.F("entry_amount") * m)
+                for num_picks, m in PAYOUT_MULTIPLIERS.items()
+            ],
+            output_field=models.PositiveIntegerField(),
+        )
+        return self.aggregate(
+            count=models.Count("id"),
+            entry_volume=Coalesce(models.Sum("entry_amount"), 0),
+            payout_volume=Coalesce(models.Sum(payout_amount), 0),
+        )
+
+
 class Slip(models.Model):
+    INCOMPLETE = "incomplete"
+    WON = "won"
+    LOST = "lost"
+    INVALIDATED = "invalidated"
+    STATUS_CHOICES = [
+        (INCOMPLETE, "Incomplete"),
+        (WON, "Won"),
+        (LOST, "Lost"),
+        (INVALIDATED, "Invalidated"),
+    ]
+    SETTLED_STATUSES = [WON, LOST, INVALIDATED]
+    GRADED_FIELDS = ["status", "num_picks", "num_picks_won", "payout"]
+
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     entry_amount = models.PositiveIntegerField()
     datetime_created = models.DateTimeField(auto_now_add=True)
@@ -150,45 +321,67 @@ class Slip(models.Model):
     creator_code = models.CharField(max_length=128, blank=True, null=True)
     creator_slip = models.BooleanField(default=False)
 
-    # For every attached pick, find every attached subline.
-    # For every attached line, see if actual points filled out.
+    # Denormalized from the picks whenever one of their lines is graded or
+    # invalidated. See SlipQuerySet.refresh_status.
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=INCOMPLETE)
+    num_picks = models.PositiveSmallIntegerField(default=0)
+    num_picks_won = models.PositiveSmallIntegerField(default=0)
+    payout = models.PositiveIntegerField(default=0)
+    # How much of the payout has been credited to the owner's wallet
+    paid_out = models.PositiveIntegerField(default=0)
+
+    objects = SlipQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner", "status", "datetime_created"]),
+        ]
+
+    # Set the status columns from (invalidated, won) pairs, one per pick,
+    # where won is None until the pick's line is graded.
+    def grade(self, results):
+        self.num_picks = len(results)
+        self.num_picks_won = sum(1 for invalidated, won in results if won)
+
+        if any(invalidated for invalidated, won in results):
+            self.status = Slip.INVALIDATED
+        elif not results or any(won is None for invalidated, won in results):
+            self.status = Slip.INCOMPLETE
+        elif self.num_picks_won == self.num_picks:
+            self.status = Slip.WON
+        else:
+            self.status = Slip.LOST
+
+        self.payout = (self.payout_amount or 0) if self.status == Slip.WON else 0
+
+    def refresh_status(self):
+        slip = Slip.objects.filter(pk=self.pk).refresh_status()[0]
+        self.status = slip.status
+        self.num_picks = slip.num_picks
+        self.num_picks_won = slip.num_picks_won
+        self.payout = slip.payout
+
+    # Every attached line has its actual value filled out, or the slip
+    # has been invalidated
     @property
     def complete(self):
-        return (
-            Pick.objects.filter(slip=self, subline__line__actual_value=None).count()
-            == 0
-        )
+        return self.status != Slip.INCOMPLETE
 
-    # For every attached pick, find every attached subline.
-    # For every attached line, see if invalidated is true. If so,
-    # the entire slip is invalidated
+    # If any attached line is invalidated, the entire slip is invalidated
     @property
     def invalidated(self):
-        return (
-            Pick.objects.filter(slip=self, subline__line__invalidated=True).count() != 0
-        )
+        return self.status == Slip.INVALIDATED
 
     @property
     def payout_amount(self):
-        num_picks = self.pick_set.count()
+        multiplier = PAYOUT_MULTIPLIERS.get(self.num_picks)
 
-        if num_picks == 2:
-            return self.entry_amount * 3
-        elif num_picks == 3:
-            return self.entry_amount * 6
-        elif num_picks == 4:
-            return self.entry_amount * 10
-        elif num_picks == 5:
-            return self.entry_amount * 20
+        if multiplier:
+            return self.entry_amount * multiplier
 
     @property
     def won(self):
-        for pick in self.pick_set.all():
-            # None or false
-            if not pick.won:
-                return False
-
-        return True
+        return self.status == Slip.WON
 
 
 class FreeToPlaySlipManager(models.Manager):
@@ -226,13 +419,122 @@ class Pick(models.Model):
 
     @property
     def won(self):
-        actual_value = self.subline.line.actual_value
-
-        if actual_value == None:
-            return None
-        elif self.subline.line.invalidated:
-            return False
-        elif self.under:
-            return actual_value < self.subline.projected_value
-        elif not self.under:
-            return actual_value > self.subline.projected_value
+        return grade_pick(
+            self.under,
+            self.subline.projected_value,
+            self.subline.line.actual_value,
+            self.subline.line.invalidated,
+        )
+
+
+# Emails waiting to go out. Rows are written in the same transaction as the
+# change they announce and sent by the drain_outbox task, so a slow or down
+# provider never holds up (or fails) the request that queued them.
+class OutboundEmail(models.Model):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    html_content = models.TextField()
+
+    # Admin notifications that can be rolled up into the periodic digest
+    digest = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    send_after = models.DateTimeField(default=tz.now)
+    # When a drain claimed the email to send it
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "send_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email} ({self.status})"
+
+
+# The wallet ledger. Every change to a balance is appended here, in the same
+# transaction as the matching change to User.wallet_balance, which is the
+# running balance (projection) everything else reads. Rows are never
+# updated or deleted; a correction is another row.
+class WalletTransaction(models.Model):
+    OPENING = "opening"
+    ENTRY = "entry"
+    PAYOUT = "payout"
+    DEPOSIT = "deposit"
+    TOP_OFF = "top_off"
+    ADJUSTMENT = "adjustment"
+    KIND_CHOICES = [
+        (OPENING, "Opening balance"),
+        (ENTRY, "Slip entry"),
+        (PAYOUT, "Slip payout"),
+        (DEPOSIT, "Deposit"),
+        (TOP_OFF, "Free to play top-off"),
+        (ADJUSTMENT, "Adjustment"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # Credits are positive, debits negative
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    slip = models.ForeignKey(Slip, on_delete=models.SET_NULL, blank=True, null=True)
+    deposit = models.ForeignKey(
+        Deposit, on_delete=models.SET_NULL, blank=True, null=True
+    )
+    datetime_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.get_kind_display()} {self.amount}"
+
+
+# A user's balance as of a ledger transaction, so the ledger only has to be
+# summed from there on. See core.wallet.checkpoint_wallets.
+class WalletCheckpoint(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    # Every transaction up to and including this id is in the balance
+    last_transaction_id = models.PositiveBigIntegerField(db_index=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "last_transaction_id"]),
+        ]
+
+
+# How much a user has staked on slips created on a PST day, kept as a
+# counter so the daily cap is checked with one conditional UPDATE rather
+# than summing their slips. See core.exposure.
+class DailyExposure(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    amount = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "date"], name="unique_daily_exposure"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.date} {self.amount}"
@@ -0,0 +1,87 @@
+import collections
+import logging
+
+from django.db import transaction
+
+from . import wallet
+from .bulk import update_rows
+from .models import Pick, Slip, WalletTransaction, grade_slips
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+SETTLED_FIELDS = Slip.GRADED_FIELDS + ["paid_out"]
+
+
+# Regrade every slip with a pick on one of the given lines and credit any
+# change in payout to the owners' wallets.
+#
+# Each slip remembers how much it has already paid out, so running this
+# again for the same lines (or for lines whose result didn't change) is a
+# no-op, and a corrected result claws back or tops up the difference.
+@transaction.atomic
+def settle_lines(line_ids):
+    slip_ids = list(
+        Pick.objects.filter(subline__line__in=line_ids)
+        .values_list("slip_id", flat=True)
+        .distinct()
+        .order_by("slip_id")
+    )
+
+    report = collections.Counter()
+    for i in range(0, len(slip_ids), BATCH_SIZE):
+        report.update(settle_slips(slip_ids[i : i + BATCH_SIZE]))
+
+    logger.info(
+        "Settled %d lines: %d slips graded, %d changed, $%d credited",
+        len(line_ids),
+        report["slips"],
+        report["changed"],
+        report["credited"],
+    )
+    return dict(report)
+
+
+@transaction.atomic
+def settle_slips(slip_ids):
+    slips = list(
+        Slip.objects.filter(id__in=slip_ids).select_for_update().order_by("id")
+    )
+    before = {slip.id: _settled_values(slip) for slip in slips}
+    grade_slips(slips)
+
+    payouts = []
+    for slip in slips:
+        if slip.payout != slip.paid_out:
+            payouts.append(
+                WalletTransaction(
+                    user_id=slip.owner_id,
+                    kind=WalletTransaction.PAYOUT,
+                    amount=slip.payout - slip.paid_out,
+                    slip=slip,
+                )
+            )
+            slip.paid_out = slip.payout
+
+    # Only the slips whose grade moved are written, a batch at a time, so the
+    # query count doesn't depend on how many distinct stakes or payouts
+    # there are
+    changed = [
+        (slip.id, *_settled_values(slip))
+        for slip in slips
+        if _settled_values(slip) != before[slip.id]
+    ]
+    update_rows(Slip, SETTLED_FIELDS, changed)
+
+    # Each change in payout goes on the owner's ledger
+    wallet.post_many(payouts)
+
+    return {
+        "slips": len(slips),
+        "changed": len(changed),
+        "credited": sum(payout.amount for payout in payouts),
+    }
+
+
+def _settled_values(slip):
+    return tuple(getattr(slip, field) for field in SETTLED_FIELDS)
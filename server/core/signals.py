@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .lobby import invalidate_lobby
+from .models import Game, Line, Subline
+from .settlement import settle_lines
+from .tasks import schedule_game_locks
+
+
+# Line edits (invalidated, category...) and subline edits (visible,
+# projected_value) both change what the lobby shows.
+@receiver(post_save, sender=Line)
+@receiver(post_delete, sender=Line)
+@receiver(post_save, sender=Subline)
+@receiver(post_delete, sender=Subline)
+def invalidate_lobby_on_change(sender, **kwargs):
+    invalidate_lobby()
+
+
+# A line getting its actual value or being invalidated settles (or unsettles)
+# every slip with a pick on it.
+@receiver(post_save, sender=Line)
+def refresh_slips_on_result(sender, instance, created, **kwargs):
+    if created or not instance.result_changed:
+        return
+
+    settle_lines([instance.id])
+    instance._loaded_result = (instance.actual_value, instance.invalidated)
+
+
+# Lock a game's sublines at tip-off.
+@receiver(post_save, sender=Game)
+def schedule_game_lock(sender, instance, **kwargs):
+    schedule_game_locks([instance])
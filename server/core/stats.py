@@ -0,0 +1,118 @@
+import datetime
+import decimal
+import logging
+
+from django.utils import timezone
+
+from .models import Game, Line, Player
+
+logger = logging.getLogger(__name__)
+
+# Line category -> field in a SportsData PlayerGameStatsByDate record
+CATEGORY_STAT_FIELDS = {
+    "Points": "Points",
+    "Rebounds": "Rebounds",
+    "Assists": "Assists",
+    "Fantasy Points": "FantasyPoints",
+}
+
+
+# A game counts as live from tip-off until this long after, which leaves
+# room for stat corrections once the final buzzer has gone.
+LIVE_GAME_WINDOW = datetime.timedelta(hours=4)
+
+
+def games_in_progress(date, now=None):
+    now = now or timezone.now()
+    return Game.objects.for_pst_date(date).filter(
+        datetime__lte=now, datetime__gt=now - LIVE_GAME_WINDOW
+    )
+
+
+def stat_value(record, category):
+    value = record.get(CATEGORY_STAT_FIELDS[category])
+    if value is None:
+        return None
+    return decimal.Decimal(str(value)).quantize(decimal.Decimal("0.01"))
+
+
+# Write a day's SportsData stat records onto that day's lines: the live
+# value while a game is in progress, and the actual value as well once the
+# feed marks it over, so slips are only graded on final box scores. Players,
+# games and lines are loaded into dicts up front so the whole slate costs a
+# fixed number of queries. Each record is diffed against the values already
+# stored on its lines and only lines whose values changed are written, with
+# a single bulk_update. Returns the ids of the lines whose actual value
+# changed, for settling, and the per-run counts.
+def ingest_player_stats(records, date):
+    todays_games = Game.objects.for_pst_date(date)
+    players = {
+        player.name: player
+        for player in Player.objects.filter(name__in=[r["Name"] for r in records])
+    }
+    games_by_team = {}
+    for game in todays_games:
+        games_by_team[game.home_team_id] = game
+        games_by_team[game.away_team_id] = game
+    lines = {
+        (line.player_id, line.category.category): line
+        for line in Line.objects.filter(game__in=todays_games).select_related(
+            "category"
+        )
+    }
+
+    report = {
+        "records": len(records),
+        "matched": 0,
+        "unmatched": 0,
+        "in_progress": 0,
+        "unchanged": 0,
+        "updated": 0,
+    }
+    updated, graded = [], []
+
+    # Find player in our system. Find game they played in today.
+    # Find all lines connected to that. Update each line's actual value.
+    for record in records:
+        player = players.get(record["Name"])
+        if player is None or player.team_id not in games_by_team:
+            report["unmatched"] += 1
+            continue
+
+        report["matched"] += 1
+        final = bool(record.get("IsGameOver"))
+        if not final:
+            report["in_progress"] += 1
+
+        for category in CATEGORY_STAT_FIELDS:
+            line = lines.get((player.id, category))
+            if line is None:
+                continue
+
+            value = stat_value(record, category)
+            actual_value = value if final else line.actual_value
+            if (line.live_value, line.actual_value) == (value, actual_value):
+                report["unchanged"] += 1
+                continue
+
+            if line.actual_value != actual_value:
+                graded.append(line)
+            line.live_value = value
+            line.actual_value = actual_value
+            updated.append(line)
+
+    Line.objects.bulk_update(updated, ["live_value", "actual_value"], batch_size=500)
+    report["updated"] = len(updated)
+
+    logger.info(
+        "Player stats for %s: %d records, %d matched (%d in progress), "
+        "%d unmatched, %d lines unchanged, %d lines updated",
+        date,
+        report["records"],
+        report["matched"],
+        report["in_progress"],
+        report["unmatched"],
+        report["unchanged"],
+        report["updated"],
+    )
+    return [line.id for line in graded], report
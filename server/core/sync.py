@@ -0,0 +1,391 @@
+import contextlib
+import datetime
+import decimal
+import logging
+import time
+
+from django.db import connection, transaction
+from django.db.models import Q
+from pytz import timezone
+
+from . import lobby_events, tasks
+from .airtable import get_client
+from .lobby import invalidate_lobby
+from .models import (
+    League,
+    Team,
+    Position,
+    Player,
+    CurrentDate,
+    Line,
+    Game,
+    Subline,
+    LineCategory,
+)
+
+logger = logging.getLogger(__name__)
+
+# Airtable bases and tables the syncs read from
+PLAYERS_BASE, PLAYERS_TABLE = "appCCoXer81BO8Ltu", "All"
+GAMES_BASE, GAMES_TABLE = "appsIaaLtmzxMRopo", "Week 1 Games (12/22-28)"
+LINES_BASE, LINES_TABLE = "appugpzfLrIqV0Qfd", "master"
+
+
+def date_formula(date):
+    return f'SEARCH("{date.strftime("%Y-%m-%d")}",{{Date}})'
+
+
+@contextlib.contextmanager
+def count_queries():
+    counter = {"queries": 0}
+
+    def count(execute, sql, params, many, context):
+        counter["queries"] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        yield counter
+
+
+# Upsert every player in the Airtable player sheet. Teams, positions and
+# existing players are loaded into maps once; new players are inserted and
+# changed ones updated in bulk, and the positions through-table is rewritten
+# for the synced players in two statements.
+def sync_players(client=None):
+    client = client or get_client()
+    started = time.monotonic()
+
+    with count_queries() as counter:
+        teams = {team.abbreviation: team for team in Team.objects.all()}
+        positions = {position.acronym: position for position in Position.objects.all()}
+        existing = {player.name: player for player in Player.objects.all()}
+
+        to_create, to_update, positions_by_name = [], [], {}
+        report = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+
+        for record in client.iter_records(PLAYERS_BASE, PLAYERS_TABLE):
+            fields = record["fields"]
+            team = teams.get(fields["Team"].strip())
+            if team is None:
+                logger.warning("Unknown team for player: %s", fields["Name"])
+                report["skipped"] += 1
+                continue
+
+            values = {
+                "team": team,
+                "premier": "Premier Player" in fields,
+                "headshot_url": fields["Image"][0]["thumbnails"]["large"]["url"],
+            }
+            player = existing.get(fields["Name"])
+
+            if player is None:
+                player = Player(name=fields["Name"], **values)
+                existing[player.name] = player
+                to_create.append(player)
+            elif any(getattr(player, k) != v for k, v in values.items()):
+                for k, v in values.items():
+                    setattr(player, k, v)
+                to_update.append(player)
+            else:
+                report["unchanged"] += 1
+
+            positions_by_name[player.name] = []
+            for acronym in fields.get("Position", []):
+                position = positions.get(acronym)
+                if position is None:
+                    logger.warning(
+                        "Unknown position %s for player: %s", acronym, fields["Name"]
+                    )
+                else:
+                    positions_by_name[player.name].append(position)
+
+        with transaction.atomic():
+            Player.objects.bulk_create(to_create, batch_size=500)
+            Player.objects.bulk_update(
+                to_update, ["team", "premier", "headshot_url"], batch_size=500
+            )
+
+            # Not every backend sets pks on bulk_create, so read them back
+            ids = dict(
+                Player.objects.filter(name__in=positions_by_name).values_list(
+                    "name", "id"
+                )
+            )
+            PlayerPosition = Player.positions.through
+            PlayerPosition.objects.filter(player_id__in=ids.values()).delete()
+            PlayerPosition.objects.bulk_create(
+                (
+                    PlayerPosition(player_id=ids[name], position_id=position.id)
+                    for name, player_positions in positions_by_name.items()
+                    for position in player_positions
+                ),
+                batch_size=500,
+            )
+
+    invalidate_lobby()
+
+    report["created"] = len(to_create)
+    report["updated"] = len(to_update)
+    report["queries"] = counter["queries"]
+    report["seconds"] = round(time.monotonic() - started, 2)
+    logger.info("Player sync: %s", report)
+    return report
+
+
+def parse_game_time(fields):
+    gt = fields["Time"].rstrip(" EST").rstrip(" PST")
+    date_time_obj = datetime.datetime.strptime(
+        f'{fields["Date"]} {gt}',
+        "%Y-%m-%d %I:%M %p",
+    )
+
+    if "EST" in fields["Time"]:
+        localtz = timezone("America/New_York")
+        date_time_obj = localtz.localize(date_time_obj)
+    elif "PST" in fields["Time"]:
+        localtz = timezone("America/Los_Angeles")
+        date_time_obj = localtz.localize(date_time_obj)
+
+    return date_time_obj
+
+
+# Sync every game, or only the games on `date`. Games are matched on their
+# natural key (home team, away team, tip-off), which the unique constraint
+# on Game backs up, so only games we don't already have are inserted, in
+# one bulk_create.
+def sync_games(date=None, client=None):
+    client = client or get_client()
+    started = time.monotonic()
+    formula = date_formula(date) if date else None
+
+    with count_queries() as counter:
+        nba = League.objects.get(acronym="NBA")
+        teams = {team.abbreviation: team for team in Team.objects.filter(league=nba)}
+        existing = set(
+            Game.objects.filter(league=nba).values_list(
+                "home_team_id", "away_team_id", "datetime"
+            )
+        )
+
+        to_create = []
+        report = {"created": 0, "existing": 0, "skipped": 0}
+
+        for record in client.iter_records(GAMES_BASE, GAMES_TABLE, formula=formula):
+            fields = record["fields"]
+            home_team = teams.get(fields["Home Team"].strip())
+            away_team = teams.get(fields["Away Team"].strip())
+            if home_team is None or away_team is None:
+                logger.warning("Unknown team for game: %s", record["id"])
+                report["skipped"] += 1
+                continue
+
+            key = (home_team.id, away_team.id, parse_game_time(fields))
+            if key in existing:
+                report["existing"] += 1
+                continue
+
+            existing.add(key)
+            to_create.append(
+                Game(
+                    league=nba,
+                    home_team=home_team,
+                    away_team=away_team,
+                    datetime=key[2],
+                )
+            )
+
+        with transaction.atomic():
+            Game.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+
+            # bulk_create skips post_save (and doesn't set pks on every
+            # backend), so read the new games back to schedule their locks
+            new_keys = {
+                (game.home_team_id, game.away_team_id, game.datetime)
+                for game in to_create
+            }
+            tasks.schedule_game_locks(
+                game
+                for game in Game.objects.filter(
+                    league=nba, datetime__in={key[2] for key in new_keys}
+                )
+                if (game.home_team_id, game.away_team_id, game.datetime) in new_keys
+            )
+
+    invalidate_lobby()
+
+    report["created"] = len(to_create)
+    report["queries"] = counter["queries"]
+    report["seconds"] = round(time.monotonic() - started, 2)
+    logger.info("Game sync: %s", report)
+    return report
+
+
+# Line category -> projection field in the Airtable lines sheet
+CATEGORY_PROJECTION_FIELDS = {
+    "Points": "Projected points",
+    "Rebounds": "Projected rebounds",
+    "Assists": "Projected assists",
+    "Fantasy Points": "Projected fantasy points",
+}
+
+
+def projected_value(value):
+    return decimal.Decimal(str(value)).quantize(decimal.Decimal("0.01"))
+
+
+# Create or update the line and base subline (the one without a movement)
+# for every projection on `date`. Players, categories, the day's games and
+# their existing lines and sublines are loaded into maps once, every row is
+# built in memory, and the writes are a few bulk statements. Records for
+# players we don't have, who aren't playing that day, or whose game has
+# already started are skipped.
+def sync_lines_for_date(date, client=None):
+    client = client or get_client()
+    started = time.monotonic()
+    report = {"records": 0, "created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+
+    with count_queries() as counter:
+        nba = League.objects.get(acronym="NBA")
+        todays_games = list(Game.objects.for_pst_date(date, league=nba))
+        if not todays_games:
+            logger.info("No games on %s", date)
+            return report
+
+        records = list(
+            client.iter_records(LINES_BASE, LINES_TABLE, formula=date_formula(date))
+        )
+        report["records"] = len(records)
+
+        now = CurrentDate.now()
+        games_by_team = {}
+        for game in todays_games:
+            games_by_team[game.home_team_id] = game
+            games_by_team[game.away_team_id] = game
+        players = {
+            player.name: player
+            for player in Player.objects.filter(
+                name__in={r["fields"]["Player name"].strip() for r in records}
+            )
+        }
+        categories = {
+            category.category: category
+            for category in LineCategory.objects.filter(
+                league=nba, category__in=CATEGORY_PROJECTION_FIELDS
+            )
+        }
+        lines = {
+            (line.player_id, line.game_id, line.category_id): line
+            for line in Line.objects.filter(game__in=todays_games)
+        }
+        # The lobby subline of each line: not one with a movement, nor a
+        # hidden clone a creator slip picked. Lowest id first if a line
+        # somehow has several.
+        sublines = {}
+        for subline in (
+            Subline.objects.filter(line__game__in=todays_games, submovement=None)
+            .exclude(pick__slip__creator_slip=True)
+            .order_by("id")
+        ):
+            sublines.setdefault(subline.line_id, subline)
+
+        new_lines, new_sublines, to_update, restored = {}, {}, [], []
+
+        for record in records:
+            name = record["fields"]["Player name"].strip()
+            player = players.get(name)
+            game = games_by_team.get(player.team_id) if player else None
+            if game is None or game.datetime <= now:
+                logger.info("Not syncing lines for %s", name)
+                report["skipped"] += 1
+                continue
+
+            for category_name, field in CATEGORY_PROJECTION_FIELDS.items():
+                category = categories.get(category_name)
+                if field not in record["fields"] or category is None:
+                    continue
+
+                key = (player.id, game.id, category.id)
+                value = projected_value(record["fields"][field])
+                line = lines.get(key)
+                subline = sublines.get(line.id) if line else None
+
+                if line is None:
+                    new_lines[key] = Line(player=player, game=game, category=category)
+                    new_sublines[key] = value
+                elif subline is None:
+                    new_sublines[key] = value
+                elif subline.projected_value != value or not subline.visible:
+                    if not subline.visible:
+                        restored.append(subline.id)
+                    subline.projected_value = value
+                    subline.visible = True
+                    to_update.append(subline)
+                else:
+                    report["unchanged"] += 1
+
+        with transaction.atomic():
+            Line.objects.bulk_create(new_lines.values(), batch_size=500)
+
+            # Not every backend sets pks on bulk_create, so read the new
+            # lines back
+            if new_lines:
+                lines.update(
+                    ((line.player_id, line.game_id, line.category_id), line)
+                    for line in Line.objects.filter(
+                        game__in=todays_games,
+                        player__in={key[0] for key in new_lines},
+                    )
+                )
+
+            Subline.objects.bulk_create(
+                (
+                    Subline(line=lines[key], projected_value=value, visible=True)
+                    for key, value in new_sublines.items()
+                ),
+                batch_size=500,
+            )
+            Subline.objects.bulk_update(
+                to_update, ["projected_value", "visible"], batch_size=500
+            )
+
+    invalidate_lobby()
+    if new_sublines or restored:
+        lobby_events.sublines_added(
+            Subline.objects.filter(
+                Q(id__in=restored)
+                | Q(line__in=[lines[key] for key in new_sublines], submovement=None)
+            )
+        )
+    lobby_events.projections_changed(
+        subline for subline in to_update if subline.id not in restored
+    )
+
+    report["created"] = len(new_sublines)
+    report["updated"] = len(to_update)
+    report["queries"] = counter["queries"]
+    report["seconds"] = round(time.monotonic() - started, 2)
+    logger.info("Line sync for %s: %s", date, report)
+    return report
+
+
+# Lines for the system date, for the admin's line sync
+def sync_lines(client=None):
+    return sync_lines_for_date(CurrentDate.objects.first().date, client=client)
+
+
+# 1) Change system date to current date
+# 2) Sync games from airtable for current date
+# 3) Sync lines from airtable for current date
+def run_whole_shebang(client=None):
+    client = client or get_client()
+
+    # (1)
+    cd = CurrentDate.objects.first()
+    cd.date = datetime.datetime.now(timezone("US/Pacific")).date()
+    cd.save()
+
+    # (2)
+    sync_games(cd.date, client=client)
+
+    # (3)
+    sync_lines_for_date(cd.date, client=client)
@@ -0,0 +1,381 @@
+import contextlib
+import datetime
+import decimal
+import logging
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from pytz import timezone
+
+from accounts.models import User
+from .models import (
+    CurrentDate,
+    Game,
+    League,
+    Line,
+    LineCategory,
+    Pick,
+    Player,
+    Slip,
+    Subline,
+    Team,
+    WalletTransaction,
+    grade_pick,
+)
+
+logger = logging.getLogger(__name__)
+
+PST = timezone("US/Pacific")
+BATCH_SIZE = 1000
+TEAMS = 30
+SEASON_START = datetime.date(2021, 10, 19)
+SEASON_DAYS = 170
+
+# Category -> (display order, range of a player's average)
+CATEGORIES = {
+    "Points": (1, (4, 32)),
+    "Fantasy Points": (2, (10, 55)),
+    "Assists": (3, (1, 11)),
+    "Rebounds": (4, (2, 14)),
+}
+ENTRY_AMOUNTS = [5, 10, 20]
+INVALIDATED_RATE = 0.002
+FREE_TO_PLAY_RATE = 0.3
+
+
+# Lines, slips and picks are inserted with their timestamps from the
+# simulated season rather than now
+@contextlib.contextmanager
+def _keep_timestamps(*models):
+    fields = [model._meta.get_field("datetime_created") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _next_id(model):
+    last = model.objects.order_by("-id").values_list("id", flat=True).first()
+    return (last or 0) + 1
+
+
+def _reset_sequences(*models):
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def _decimal(value):
+    return decimal.Decimal(value).quantize(decimal.Decimal("0.01"))
+
+
+# Bulk-generate a season-scale dataset into an empty database: NBA teams and
+# rosters, every game of `seasons` regular seasons with a line and subline
+# per player and category, `users` users and `slips` slips of 2-5 picks.
+# The system date is set to `today` (the middle of the last season by
+# default). Games before it are graded and their slips settled; later games
+# are in the lobby. Rows get explicit ids so nothing has to be read back
+# after inserting, and are written in batches as they're generated, so
+# memory stays flat however many slips are asked for.
+def generate_dataset(
+    seasons=1,
+    users=100_000,
+    slips=1_000_000,
+    players_per_team=13,
+    games_per_team=82,
+    today=None,
+    seed=0,
+):
+    if Game.objects.exists() or Slip.objects.exists():
+        raise ValueError("Generate into a database without games or slips")
+
+    started = time.monotonic()
+    rng = random.Random(seed)
+    last_season = SEASON_START.replace(year=SEASON_START.year + seasons - 1)
+    today = today or last_season + datetime.timedelta(days=SEASON_DAYS // 2)
+
+    with transaction.atomic():
+        nba, teams, categories = _reference_data()
+        players = _players(rng, teams, players_per_team)
+        owners = _users(rng, users)
+        CurrentDate.objects.all().delete()
+        CurrentDate.objects.create(date=today)
+
+    report = {
+        "teams": len(teams),
+        "players": len(players),
+        "users": len(owners),
+        "games": 0,
+        "lines": 0,
+        "slips": 0,
+        "picks": 0,
+    }
+    schedule = []
+    for season in range(seasons):
+        season_start = SEASON_START.replace(year=SEASON_START.year + season)
+        schedule.extend(
+            (season_start + offset, matchups)
+            for offset, matchups in _season_days(rng, teams, games_per_team)
+        )
+    game_days = [date for date, matchups in schedule if date <= today]
+    slips_per_day = slips / max(len(game_days), 1)
+
+    roster = {}
+    for player in players:
+        roster.setdefault(player.team_id, []).append(player)
+
+    ids = {model: _next_id(model) for model in (Game, Line, Subline, Slip)}
+    owed_slips = 0
+
+    with _keep_timestamps(Line, Slip, Pick):
+        for date, matchups in schedule:
+            with transaction.atomic():
+                sublines = _game_day(
+                    rng, ids, nba, date, today, matchups, roster, categories, report
+                )
+                if date <= today:
+                    owed_slips += slips_per_day
+                    count = min(int(owed_slips), slips - report["slips"])
+                    if date == game_days[-1]:
+                        count = slips - report["slips"]
+                    owed_slips -= count
+                    _slips(rng, ids, date, sublines, owners, count, report)
+
+            logger.info("Generated through %s: %s", date, report)
+
+    _reset_sequences(User, Player, Game, Line, Subline, Slip)
+
+    report["seconds"] = round(time.monotonic() - started, 2)
+    logger.info("Generated dataset: %s", report)
+    return report
+
+
+def _reference_data():
+    nba, created = League.objects.get_or_create(
+        acronym="NBA", defaults={"long_name": "National Basketball Association"}
+    )
+    teams = list(Team.objects.filter(league=nba).order_by("id")[:TEAMS])
+    for i in range(len(teams), TEAMS):
+        teams.append(
+            Team.objects.create(
+                name=f"Team {i + 1}",
+                abbreviation=f"T{i + 1:02}",
+                location=f"City {i + 1}",
+                logo_url="",
+                league=nba,
+            )
+        )
+
+    categories = {}
+    for name, (display_order, averages) in CATEGORIES.items():
+        categories[name], created = LineCategory.objects.get_or_create(
+            league=nba, category=name, defaults={"display_order": display_order}
+        )
+    return nba, teams, categories
+
+
+def _players(rng, teams, players_per_team):
+    next_id = _next_id(Player)
+    players = [
+        Player(
+            id=next_id + i * players_per_team + n,
+            name=f"{team.abbreviation} Player {n + 1}",
+            team=team,
+            premier=n < 2,
+            headshot_url="",
+        )
+        for i, team in enumerate(teams)
+        for n in range(players_per_team)
+    ]
+    Player.objects.bulk_create(players, batch_size=BATCH_SIZE)
+
+    # Every player keeps a season average per category for lines to
+    # scatter around
+    for player in players:
+        player.averages = {
+            name: rng.uniform(*averages)
+            for name, (display_order, averages) in CATEGORIES.items()
+        }
+    return players
+
+
+def _users(rng, count):
+    # Hashing is deliberately slow, so every user shares one password hash
+    password = make_password("password")
+    next_id = _next_id(User)
+    users, owners = [], []
+    for i in range(next_id, next_id + count):
+        owners.append((i, rng.random() < FREE_TO_PLAY_RATE))
+        users.append(
+            User(
+                id=i,
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                first_name="User",
+                last_name=str(i),
+                password=password,
+                wallet_balance=rng.randrange(1, 500),
+                free_to_play=owners[-1][1],
+            )
+        )
+        if len(users) == BATCH_SIZE * 10:
+            _write_users(users)
+            users = []
+    _write_users(users)
+
+    return owners
+
+
+# Users with their ledgers opened at their balances
+def _write_users(users):
+    User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+    WalletTransaction.objects.bulk_create(
+        (
+            WalletTransaction(
+                user_id=user.id,
+                kind=WalletTransaction.OPENING,
+                amount=user.wallet_balance,
+            )
+            for user in users
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+# The days of one season as (day offset, [(home, away), ...]), with each
+# team playing at most once a day and `games_per_team` games in all
+def _season_days(rng, teams, games_per_team):
+    games_left = len(teams) * games_per_team // 2
+    for offset in range(SEASON_DAYS):
+        days_left = SEASON_DAYS - offset
+        count = min(round(games_left / days_left), len(teams) // 2)
+        if count:
+            playing = rng.sample(teams, count * 2)
+            yield datetime.timedelta(days=offset), list(
+                zip(playing[::2], playing[1::2])
+            )
+            games_left -= count
+
+
+# Insert one day's games with a line and subline per player and category.
+# Games before `today` are graded and hidden from the lobby. Returns the
+# day's sublines as (id, projected value, actual value, invalidated).
+def _game_day(rng, ids, nba, date, today, matchups, roster, categories, report):
+    games, lines, sublines, picked = [], [], [], []
+    for i, (home_team, away_team) in enumerate(matchups):
+        tip_off = PST.localize(
+            datetime.datetime.combine(date, datetime.time(16 + i % 8 // 2, i % 2 * 30))
+        )
+        game = Game(
+            id=ids[Game],
+            league=nba,
+            home_team=home_team,
+            away_team=away_team,
+            datetime=tip_off,
+        )
+        ids[Game] += 1
+        games.append(game)
+        graded = date < today
+
+        for player in roster[home_team.id] + roster[away_team.id]:
+            for name, category in categories.items():
+                average = player.averages[name]
+                projected_value = _decimal(round(rng.gauss(average, 2) * 2) / 2)
+                actual_value = (
+                    _decimal(max(rng.gauss(average, average / 3), 0))
+                    if graded
+                    else None
+                )
+                invalidated = graded and rng.random() < INVALIDATED_RATE
+                lines.append(
+                    Line(
+                        id=ids[Line],
+                        player=player,
+                        game=game,
+                        category=category,
+                        actual_value=actual_value,
+                        invalidated=invalidated,
+                        datetime_created=tip_off - datetime.timedelta(hours=8),
+                    )
+                )
+                sublines.append(
+                    Subline(
+                        id=ids[Subline],
+                        line_id=ids[Line],
+                        projected_value=projected_value,
+                        visible=not graded,
+                    )
+                )
+                picked.append(
+                    (ids[Subline], projected_value, actual_value, invalidated)
+                )
+                ids[Line] += 1
+                ids[Subline] += 1
+
+    Game.objects.bulk_create(games, batch_size=BATCH_SIZE)
+    Line.objects.bulk_create(lines, batch_size=BATCH_SIZE)
+    Subline.objects.bulk_create(sublines, batch_size=BATCH_SIZE)
+    report["games"] += len(games)
+    report["lines"] += len(lines)
+    return picked
+
+
+# Insert `count` slips on `date` over its sublines, graded and paid out as
+# settlement would have left them
+def _slips(rng, ids, date, sublines, owners, count, report):
+    opens = PST.localize(datetime.datetime.combine(date, datetime.time(9)))
+    slips, picks = [], []
+
+    for i in range(count):
+        owner_id, free_to_play = rng.choice(owners)
+        created = opens + datetime.timedelta(seconds=rng.randrange(7 * 60 * 60))
+        slip = Slip(
+            id=ids[Slip],
+            owner_id=owner_id,
+            entry_amount=rng.choice(ENTRY_AMOUNTS),
+            free_to_play=free_to_play,
+            datetime_created=created,
+        )
+        ids[Slip] += 1
+
+        results = []
+        for subline_id, projected_value, actual_value, invalidated in rng.sample(
+            sublines, rng.randint(2, 5)
+        ):
+            under = rng.random() < 0.5
+            picks.append(
+                Pick(
+                    slip_id=slip.id,
+                    subline_id=subline_id,
+                    under=under,
+                    datetime_created=created,
+                )
+            )
+            results.append(
+                (
+                    invalidated,
+                    grade_pick(under, projected_value, actual_value, invalidated),
+                )
+            )
+        slip.grade(results)
+        slip.paid_out = slip.payout
+        slips.append(slip)
+
+        if len(picks) >= BATCH_SIZE * 10:
+            _write_slips(slips, picks, report)
+            slips, picks = [], []
+
+    _write_slips(slips, picks, report)
+
+
+def _write_slips(slips, picks, report):
+    Slip.objects.bulk_create(slips, batch_size=BATCH_SIZE)
+    Pick.objects.bulk_create(picks, batch_size=BATCH_SIZE)
+    report["slips"] += len(slips)
+    report["picks"] += len(picks)
@@ -3,55 +3,147 @@ import requests
 from celery import Celery
 from celery import shared_task
 from django.conf import settings
-from datetime import datetime, timedelta
-from pytz import timezone, utc
-from random import randint
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone as tz
+from datetime import timedelta
 
 from accounts.models import User
-from .models import CurrentDate, Game, Player, Line, Pick, Subline
-from sendgrid.helpers.mail import Mail
-from sendgrid import SendGridAPIClient
-from django.utils import dateformat
+from .models import CurrentDate, Game, Subline, WalletTransaction
+from .lobby import invalidate_lobby
+from . import exposure, lobby_events, mail, settlement, stats, sync, wallet
 
 app = Celery()
 
-# Every half hour, pull up all games that are happening now.
-# For each game, for each attached line, make every attached
-# subline invisible.
+LAST_STATS_POLL_KEY = "stats:last_poll"
+IDLE_STATS_POLL_INTERVAL = timedelta(hours=1)
+# How far ahead lock_game runs are queued. The Redis broker redelivers a task
+# whose ETA is further off than its visibility timeout (an hour by default)
+# to another worker, so later games are scheduled by the sweep as they come
+# into range.
+LOCK_SCHEDULE_WINDOW = timedelta(minutes=10)
+
+
+# Hide every subline of a game once it tips off. Scheduled with an ETA of
+# the game's start when the game is saved or comes within
+# LOCK_SCHEDULE_WINDOW of starting. The ETA is on the real clock but
+# tip-off is judged on the system clock, as everywhere else in the lobby, so a
+# run that fires before the system clock reaches tip-off (the system date is
+# behind, or the game has moved later) runs again when it does, or is left to
+# the sweep if that's further off than LOCK_SCHEDULE_WINDOW.
+@shared_task
+def lock_game(game_id):
+    game = Game.objects.filter(id=game_id).first()
+    if game is None:
+        return 0
+
+    remaining = game.datetime - CurrentDate.now()
+    if remaining > timedelta(0):
+        if remaining <= LOCK_SCHEDULE_WINDOW:
+            lock_game.apply_async((game.id,), countdown=remaining.total_seconds())
+        return 0
+
+    return hide_sublines(Subline.objects.filter(line__game=game, visible=True))
+
+
+# Queue a lock_game run at tip-off for each game starting within
+# LOCK_SCHEDULE_WINDOW, once the surrounding transaction commits. Games that
+# have already started, or start later, are left to the
+# remove_lines_when_game_starts sweep.
+def schedule_game_locks(games):
+    now = tz.now()
+    for game in games:
+        if now < game.datetime <= now + LOCK_SCHEDULE_WINDOW:
+            transaction.on_commit(
+                lambda game=game: lock_game.apply_async((game.id,), eta=game.datetime)
+            )
+
+
+# Every few minutes, hide the sublines of any game on the system date that
+# has already started, in case its lock_game run was missed (worker down,
+# game saved through a bulk path), and queue the lock_game runs of games
+# coming into LOCK_SCHEDULE_WINDOW. A game may be queued by more than one
+# sweep; lock_game only hides sublines that are still visible.
 @shared_task
 def remove_lines_when_game_starts():
-    # Add current PST time to the system date
-    cd = CurrentDate.objects.first().date
-    date = datetime.now(tz=utc)
-    time = date.astimezone(timezone("US/Pacific")).time()
-    dt = datetime.combine(cd, time)
-
-    # For debugging
-    # dt = dt.replace(hour=19, minute=0)
-
-    for game in Game.objects.all():
-        # Check m/d/y & h:m
-        if (
-            game.pst_gametime.date() == dt.date()
-            and game.pst_gametime.hour == dt.hour
-            and game.pst_gametime.minute == dt.minute
-        ):
-            for line in game.line_set.all():
-                line.subline_set.all().update(visible=False)
+    upcoming = tz.now()
+    schedule_game_locks(
+        Game.objects.filter(
+            datetime__gt=upcoming, datetime__lte=upcoming + LOCK_SCHEDULE_WINDOW
+        )
+    )
+
+    now = CurrentDate.now()
+    started = Game.objects.for_pst_date(now.date()).started(now)
+
+    return hide_sublines(Subline.objects.filter(line__game__in=started, visible=True))
+
+
+# Take sublines out of the lobby and tell connected clients which ones
+def hide_sublines(sublines):
+    hidden = list(sublines.values_list("id", flat=True))
+    if hidden:
+        Subline.objects.filter(id__in=hidden).update(visible=False)
+        invalidate_lobby()
+        lobby_events.sublines_hidden(hidden)
+    return len(hidden)
+
+
+# Grade every slip with a pick on the given lines and pay out winnings.
+# Safe to run more than once for the same lines.
+@shared_task
+def settle_lines(line_ids):
+    return settlement.settle_lines(line_ids)
+
+
+# Airtable syncs, queued from the admin sync views
+@shared_task
+def sync_players():
+    sync.sync_players()
+
+
+@shared_task
+def sync_games():
+    sync.sync_games()
+
+
+@shared_task
+def sync_lines():
+    sync.sync_lines()
+
+
+@shared_task
+def run_whole_shebang():
+    sync.run_whole_shebang()
 
 
 # Every midnight PST, set balance of free to play users to $100
 @shared_task
 def top_off_free_to_play_user_balances():
-    User.objects.filter(free_to_play=True).update(wallet_balance=100)
+    return wallet.set_balances(
+        User.objects.filter(free_to_play=True),
+        wallet.FREE_TO_PLAY_BALANCE,
+        WalletTransaction.TOP_OFF,
+    )
 
 
-# every hour, get the players' scores and save them.
-# TODO - just run once
+# Every couple of minutes while a game on the system date is in progress,
+# get the players' scores and save the ones that changed. Lines are settled,
+# along with every slip riding on them, once their game is final. With
+# nothing live, back off to one poll an hour.
 @shared_task
-def update_player_scores():
-    headers = {"Ocp-Apim-Subscription-Key": f"{settings.FANTASY_DATA_API_KEY}"}
+def update_player_scores(force=False):
     cd = CurrentDate.objects.first()
+    now = tz.now()
+
+    if not force and not stats.games_in_progress(cd.date, now).exists():
+        last_poll = cache.get(LAST_STATS_POLL_KEY)
+        if last_poll and now - last_poll < IDLE_STATS_POLL_INTERVAL:
+            return None
+
+    cache.set(LAST_STATS_POLL_KEY, now, None)
+
+    headers = {"Ocp-Apim-Subscription-Key": f"{settings.FANTASY_DATA_API_KEY}"}
     formatted_date = cd.date.strftime("%Y-%m-%d")
 
     r = requests.get(
@@ -60,44 +152,11 @@ def update_player_scores():
     )
     data = r.json()
 
-    todays_games = []
-    for game in Game.objects.all():
-        if game.pst_gametime.date() == cd.date:
-            todays_games.append(game)
-
-    # Find player in our system. Find game they played in today.
-    # Find all lines connected to that. Update each subline's actual pts
-    for record in data:
-        try:
-            player = Player.objects.get(name=record["Name"])
-
-            todays_game = None
-            for game in todays_games:
-                if player.team == game.home_team or player.team == game.away_team:
-                    todays_game = game
-                    break
-
-            if not todays_game:
-                raise Exception()
-
-            lines = Line.objects.filter(player=player, game=game)
-            for line in lines:
-                if line.category.category == "Points":
-                    line.actual_value = record["Points"]
-                    line.save()
-                elif line.category.category == "Rebounds":
-                    line.actual_value = record["Rebounds"]
-                    line.save()
-                elif line.category.category == "Assists":
-                    line.actual_value = record["Assists"]
-                    line.save()
-                elif line.category.category == "Fantasy Points":
-                    line.actual_value = record["FantasyPoints"]
-                    line.save()
-
-        except Exception as e:
-            print(e)
-            print("Error with updating player score OR player didn't play today")
+    line_ids, report = stats.ingest_player_stats(data, cd.date)
+    if line_ids:
+        settlement.settle_lines(line_ids)
+
+    return report
 
 
 # This runs at noon PST everyday
@@ -105,102 +164,41 @@ def update_player_scores():
 # In each email, send outcome of the slip and if new lines exist for today, a preview of those
 @shared_task
 def send_slip_emails():
-    today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-
-    # Find all the games for yesterday. Find all the lines that roll up those
-    # games. Find all the slips attached to those lines.
-    games = Game.objects.filter(datetime__date=yesterday)
-    yesterdays_picks = Pick.objects.filter(
-        subline__line__game__datetime__date=yesterday
-    )
+    return mail.send_results_emails()
 
-    yesterdays_slips = []
-    for pick in yesterdays_picks:
-        if pick.slip not in yesterdays_slips:
-            yesterdays_slips.append(pick.slip)
 
-    users_with_slips_yesterday = {}
-    for slip in yesterdays_slips:
-        if slip.owner.id not in users_with_slips_yesterday:
-            users_with_slips_yesterday[slip.owner.id] = []
-        users_with_slips_yesterday[slip.owner.id].append(slip)
+# Send queued emails. Failed sends are retried with backoff by later runs.
+@shared_task
+def drain_outbox():
+    return mail.drain_outbox()
 
-    # Find all the sub lines for today
-    today_sublines = Subline.objects.filter(
-        line__game__datetime__date=today, visible=True
-    )
 
-    today_lines = []
-    if today_sublines.count():
-        first_subline = today_sublines[randint(0, today_sublines.count() - 1)]
-        second_subline = today_sublines[randint(0, today_sublines.count() - 1)]
-        third_subline = today_sublines[randint(0, today_sublines.count() - 1)]
-
-        today_lines = [
-            {
-                "src": first_subline.line.player.headshot_url,
-                "name": str(first_subline.line.player),
-                "game": str(first_subline.line.game),
-                "projection": f"{str(round(first_subline.projected_value, 1))} {first_subline.line.category.category}",
-            },
-            {
-                "src": second_subline.line.player.headshot_url,
-                "name": str(second_subline.line.player),
-                "game": str(second_subline.line.game),
-                "projection": f"{str(round(second_subline.projected_value, 1))} {second_subline.line.category.category}",
-            },
-            {
-                "src": third_subline.line.player.headshot_url,
-                "name": str(third_subline.line.player),
-                "game": str(third_subline.line.game),
-                "projection": f"{str(round(third_subline.projected_value, 1))} {third_subline.line.category.category}",
-            },
-        ]
-
-    for user_id in users_with_slips_yesterday:
-        u = User.objects.get(id=user_id)
-
-        slips = users_with_slips_yesterday[user_id]
-        slips_sg = []
-
-        for slip in slips:
-            slips_sg.append(
-                {
-                    "numPicks": slip.pick_set.count(),
-                    "payoutAmount": f"${slip.payout_amount}",
-                    "outcome": "Won" if slip.won else "Lost",
-                }
-            )
+@shared_task
+def send_admin_digest():
+    if settings.EMAIL_OUTBOX_ADMIN_DIGEST:
+        return mail.send_admin_digest()
 
-        message = Mail(
-            from_email="support@underlinesports.com",
-            to_emails="arithmetic@gmail.com" if settings.DEBUG else slip.owner.email,
-        )
 
-        ftp = " Free to Play " if u.free_to_play else " "
-        yesterday_str = dateformat.format(yesterday, "F jS")
-        today_str = dateformat.format(today, "F jS")
-        subject = f"Underline{ftp}Results for {yesterday_str}"
-        body = f"Hey {u.first_name} - here are your{ftp}results for {yesterday_str}."
-
-        # pass custom values for our HTML placeholders
-        payload = {
-            "subject": subject,
-            "body": body,
-            "todayDate": today_str,
-            "slips": slips_sg,
-            "todayLines": today_lines,
-        }
-
-        message.dynamic_template_data = payload
-        message.template_id = "d-83f3ae1c712a4e45af4744e2818489a8"
-
-        sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-        if not settings.DEBUG:
-            response = sg.send(message)
-        code, body, headers = (
-            response.status_code,
-            response.body,
-            response.headers,
-        )
+# Checkpoint the wallets whose ledgers have moved, so reconciling only has
+# to sum the transactions since
+@shared_task
+def checkpoint_wallets():
+    return wallet.checkpoint_wallets()
+
+
+# Check every balance against the ledger. Mismatches are logged as errors.
+@shared_task
+def reconcile_wallets():
+    report = wallet.reconcile_wallets()
+    return {"users": report["users"], "mismatches": len(report["mismatches"])}
+
+
+# Check yesterday's and today's daily exposure counters against the slips,
+# correcting any that disagree, and drop counters too old to be needed
+@shared_task
+def reconcile_daily_exposure():
+    today = exposure.pst_date()
+    corrections = 0
+    for date in (today - timedelta(days=1), today):
+        corrections += len(exposure.reconcile_exposure(date))
+    return {"corrections": corrections, "pruned": exposure.prune_exposure()}
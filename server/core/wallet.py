@@ -0,0 +1,212 @@
+import collections
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from accounts.models import User
+from .bulk import update_rows
+from .models import WalletCheckpoint, WalletTransaction
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+# What free to play wallets start at and are topped back up to
+FREE_TO_PLAY_BALANCE = 100
+
+# Checkpoints leave out the most recent transactions, so one whose id was
+# allocated by a transaction that hasn't committed yet isn't skipped over
+CHECKPOINT_LAG = datetime.timedelta(minutes=5)
+
+
+# Append a transaction to a user's ledger and apply it to their balance in
+# the same database transaction. The balance is moved with a single UPDATE
+# ... SET wallet_balance = wallet_balance + amount, so concurrent postings
+# never lose each other's changes. With require_funds, a debit only goes
+# through if it leaves the balance non-negative. Returns whether it was
+# posted.
+@transaction.atomic
+def post(user_id, kind, amount, slip=None, deposit=None, require_funds=False):
+    users = User.objects.filter(id=user_id)
+    if require_funds:
+        users = users.filter(wallet_balance__gte=-amount)
+    if not users.update(wallet_balance=F("wallet_balance") + amount):
+        return False
+
+    WalletTransaction.objects.create(
+        user_id=user_id, kind=kind, amount=amount, slip=slip, deposit=deposit
+    )
+    return True
+
+
+# Post many unsaved WalletTransactions at once. Each batch of users has
+# what they're owed added to their balances with one UPDATE, and the ledger
+# rows go in with a bulk insert.
+@transaction.atomic
+def post_many(transactions):
+    totals = collections.Counter()
+    for wallet_transaction in transactions:
+        totals[wallet_transaction.user_id] += wallet_transaction.amount
+
+    update_rows(
+        User,
+        ["wallet_balance"],
+        [(user_id, total) for user_id, total in totals.items() if total],
+        increment=True,
+        batch_size=BATCH_SIZE,
+    )
+    WalletTransaction.objects.bulk_create(transactions, batch_size=BATCH_SIZE)
+
+
+# Bring every matching user's balance to `balance`, posting the difference
+# as a `kind` transaction for each. The users are locked while their
+# differences are worked out.
+@transaction.atomic
+def set_balances(users, balance, kind):
+    current = list(
+        users.exclude(wallet_balance=balance)
+        .select_for_update()
+        .values_list("id", "wallet_balance")
+    )
+    for i in range(0, len(current), BATCH_SIZE):
+        batch = current[i : i + BATCH_SIZE]
+        User.objects.filter(id__in=[user_id for user_id, _ in batch]).update(
+            wallet_balance=balance
+        )
+        WalletTransaction.objects.bulk_create(
+            WalletTransaction(user_id=user_id, kind=kind, amount=balance - previous)
+            for user_id, previous in batch
+        )
+    return len(current)
+
+
+# Every transaction up to this id is covered by the users' latest
+# checkpoints
+def checkpoint_watermark():
+    return (
+        WalletCheckpoint.objects.aggregate(watermark=Max("last_transaction_id"))[
+            "watermark"
+        ]
+        or 0
+    )
+
+
+# Checkpoint the balance of every user whose ledger has moved since the last
+# run, as of the newest transaction older than CHECKPOINT_LAG. Each run only
+# reads the transactions since the previous one.
+@transaction.atomic
+def checkpoint_wallets(now=None):
+    now = now or timezone.now()
+    watermark = checkpoint_watermark()
+    last_id = WalletTransaction.objects.filter(
+        id__gt=watermark, datetime_created__lte=now - CHECKPOINT_LAG
+    ).aggregate(last_id=Max("id"))["last_id"]
+    if last_id is None:
+        return {"users": 0, "last_transaction_id": watermark}
+
+    totals = dict(
+        WalletTransaction.objects.filter(id__gt=watermark, id__lte=last_id)
+        .values_list("user")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    previous = _latest_checkpoints(totals)
+    WalletCheckpoint.objects.bulk_create(
+        (
+            WalletCheckpoint(
+                user_id=user_id,
+                balance=previous.get(user_id, 0) + total,
+                last_transaction_id=last_id,
+            )
+            for user_id, total in totals.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    report = {"users": len(totals), "last_transaction_id": last_id}
+    logger.info("Wallet checkpoint: %s", report)
+    return report
+
+
+# {user id: balance} from the users' latest checkpoints
+def _latest_checkpoints(user_ids):
+    latest = []
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), BATCH_SIZE):
+        latest.extend(
+            WalletCheckpoint.objects.filter(user__in=user_ids[i : i + BATCH_SIZE])
+            .values("user")
+            .annotate(latest=Max("id"))
+            .values_list("latest", flat=True)
+        )
+
+    balances = {}
+    for i in range(0, len(latest), BATCH_SIZE):
+        balances.update(
+            WalletCheckpoint.objects.filter(
+                id__in=latest[i : i + BATCH_SIZE]
+            ).values_list("user", "balance")
+        )
+    return balances
+
+
+# {user id: balance} per the ledger: the users' latest checkpoints plus the
+# transactions since the watermark
+def ledger_balances(user_ids):
+    balances = collections.defaultdict(int, _latest_checkpoints(user_ids))
+    for user_id, total in (
+        WalletTransaction.objects.filter(
+            user__in=user_ids, id__gt=checkpoint_watermark()
+        )
+        .values_list("user")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    ):
+        balances[user_id] += total
+    return {user_id: balances[user_id] for user_id in user_ids}
+
+
+# Compare every balance with the ledger. Users whose balance and ledger
+# disagree are checked again with their rows locked, since a posting can land
+# between reading the balance and reading the ledger. Returns the confirmed mismatches as
+# {user id: (balance, ledger balance)}.
+def reconcile_wallets():
+    mismatches = {}
+    user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+
+    for i in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[i : i + BATCH_SIZE]
+        balances = dict(
+            User.objects.filter(id__in=batch).values_list("id", "wallet_balance")
+        )
+        ledger = ledger_balances(batch)
+        suspects = [
+            user_id for user_id in batch if balances[user_id] != ledger[user_id]
+        ]
+        if not suspects:
+            continue
+
+        with transaction.atomic():
+            balances = dict(
+                User.objects.filter(id__in=suspects)
+                .select_for_update()
+                .values_list("id", "wallet_balance")
+            )
+            ledger = ledger_balances(suspects)
+            mismatches.update(
+                (user_id, (balances[user_id], ledger[user_id]))
+                for user_id in suspects
+                if balances[user_id] != ledger[user_id]
+            )
+
+    for user_id, (balance, ledger_balance) in mismatches.items():
+        logger.error(
+            "Wallet balance for user %s is %s, ledger says %s",
+            user_id,
+            balance,
+            ledger_balance,
+        )
+    return {"users": len(user_ids), "mismatches": mismatches}
@@ -0,0 +1,177 @@
+"""Admin changelist tests."""
+
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import Line, LineCategory, Slip
+from core.settlement import settle_lines
+from tests.utils import BaseDataMixin, pst
+
+
+class AdminTestMixin(BaseDataMixin):
+    """Logged in as a superuser."""
+
+    def login(self):
+        """Log a superuser in to the admin."""
+        self.admin = self.create_user(
+            email="admin@example.com", is_superuser=True, is_staff=True
+        )
+        self.client.force_login(self.admin, "django.contrib.auth.backends.ModelBackend")
+
+    def get(self, url, **params):
+        """GET an admin page, returning the response and its query count."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+
+# The manifest storage used in production needs collectstatic to have run
+PLAIN_STATIC = override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+
+
+@PLAIN_STATIC
+class SlipAdminTestCase(AdminTestMixin, TestCase):
+    """SlipAdmin test cases."""
+
+    def setUp(self):
+        """Create a graded two pick subline pair."""
+        self.create_base_data()
+        self.login()
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.under = self.create_subline(game, "Under", points, projected_value=20)
+        self.over = self.create_subline(game, "Over", points, projected_value=5)
+        self.grade(self.under, 10)
+        self.grade(self.over, 10)
+
+    def create_slips(self, start, stop):
+        """Create a winning slip for each of a range of users."""
+        for i in range(start, stop):
+            owner = self.create_user(email=f"user{i}@example.com")
+            self.create_slip(owner, [(self.under, True), (self.over, False)])
+
+    def test_changelist_query_count_is_constant(self):
+        """Test the changelist costs the same queries for 2 or 20 slips."""
+        url = reverse("admin:core_slip_changelist")
+        self.create_slips(0, 2)
+        self.get(url)
+        response, few = self.get(url)
+        self.assertEqual(response.context["count"], 2)
+
+        self.create_slips(2, 20)
+        response, many = self.get(url)
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context["cl"].result_list), 20)
+
+    def test_summary(self):
+        """Test today's pay to play totals come from one aggregate."""
+        self.create_slips(0, 3)
+        free = self.create_slip(self.admin, [(self.under, True), (self.over, False)])
+        Slip.objects.filter(id=free.id).update(free_to_play=True)
+
+        with self.assertNumQueries(1):
+            summary = Slip.objects.filter(free_to_play=False).summary()
+
+        self.assertEqual(summary, {"count": 3, "entry_volume": 30, "payout_volume": 90})
+        self.assertEqual(
+            Slip.objects.filter(entry_amount=999).summary(),
+            {"count": 0, "entry_volume": 0, "payout_volume": 0},
+        )
+
+    def test_change_page_query_count_is_constant(self):
+        """Test the pick inline doesn't query per pick."""
+        owner = self.create_user(email="owner@example.com")
+        two = self.create_slip(owner, [(self.under, True), (self.over, False)])
+        four = self.create_slip(owner, [(self.under, True), (self.over, False)] * 2)
+
+        # Warm the per-process caches (content types) first
+        self.get(reverse("admin:core_slip_change", args=[two.id]))
+
+        response, two_picks = self.get(reverse("admin:core_slip_change", args=[two.id]))
+        response, four_picks = self.get(
+            reverse("admin:core_slip_change", args=[four.id])
+        )
+
+        self.assertEqual(two_picks, four_picks)
+
+
+@PLAIN_STATIC
+class LineAdminTestCase(AdminTestMixin, TestCase):
+    """LineAdmin test cases."""
+
+    def setUp(self):
+        """Create a game with a points category."""
+        self.create_base_data()
+        self.login()
+        self.points = LineCategory.objects.create(league=self.nba, category="Points")
+        self.game = self.create_game(pst(2021, 6, 16, 19))
+        self.url = reverse("admin:core_line_changelist")
+
+    def create_sublines(self, start, stop):
+        """Create a subline for each of a range of players."""
+        return [
+            self.create_subline(self.game, f"Player {i}", self.points)
+            for i in range(start, stop)
+        ]
+
+    def test_changelist_query_count_is_constant(self):
+        """Test the changelist costs the same queries for 2 or 20 lines."""
+        hidden = self.create_sublines(0, 2)[0]
+        hidden.visible = False
+        hidden.save()
+        self.get(self.url)
+        response, few = self.get(self.url)
+
+        self.create_sublines(2, 20)
+        response, many = self.get(self.url)
+
+        self.assertEqual(few, many)
+        visible = {
+            line.id: line.has_visible_subline
+            for line in response.context["cl"].result_list
+        }
+        self.assertEqual(len(visible), 20)
+        self.assertFalse(visible[hidden.line_id])
+        self.assertEqual(sum(visible.values()), 19)
+
+    def test_list_editable_saves_in_bulk(self):
+        """Test list edits are written, settled and invalidated once."""
+        under, over, untouched = self.create_sublines(0, 3)
+        owner = self.create_user(email="owner@example.com")
+        slip = self.create_slip(owner, [(under, True), (over, False)])
+        lines = [Line.objects.get(id=s.line_id) for s in (under, over, untouched)]
+
+        data = {
+            "form-TOTAL_FORMS": "3",
+            "form-INITIAL_FORMS": "3",
+            "form-MIN_NUM_FORMS": "0",
+            "form-MAX_NUM_FORMS": "1000",
+            "_save": "Save",
+        }
+        for i, (line, actual_value) in enumerate(zip(lines, ("5", "15", ""))):
+            data[f"form-{i}-id"] = str(line.id)
+            data[f"form-{i}-actual_value"] = actual_value
+
+        with mock.patch(
+            "core.admin.settle_lines", wraps=settle_lines
+        ) as settle, mock.patch("core.admin.invalidate_lobby") as invalidate:
+            response = self.client.post(self.url, data, secure=True)
+
+        self.assertEqual(response.status_code, 302)
+        settle.assert_called_once_with([lines[0].id, lines[1].id])
+        invalidate.assert_called_once_with()
+        self.assertEqual(
+            list(Line.objects.order_by("id").values_list("actual_value", flat=True)),
+            [5, 15, None],
+        )
+        slip.refresh_from_db()
+        owner.refresh_from_db()
+        self.assertEqual((slip.status, owner.wallet_balance), (Slip.WON, 30))
@@ -0,0 +1,512 @@
+"""Airtable client and sync tests, run against a local stub server."""
+
+import datetime
+from decimal import Decimal
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, unquote, urlparse
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.airtable import AirtableClient
+from core.models import (
+    CurrentDate,
+    Game,
+    Line,
+    LineCategory,
+    Pick,
+    Player,
+    Position,
+    Slip,
+    Subline,
+)
+from core.sync import (
+    GAMES_BASE,
+    GAMES_TABLE,
+    LINES_BASE,
+    LINES_TABLE,
+    PLAYERS_BASE,
+    PLAYERS_TABLE,
+    sync_games,
+    sync_lines,
+    sync_lines_for_date,
+    sync_players,
+)
+from tests.utils import BaseDataMixin, pst
+
+
+class StubAirtable(BaseHTTPRequestHandler):
+    """Serves `tables` in pages of `page_size`, after `failures` errors."""
+
+    tables = {}
+    page_size = 2
+    failures = []
+    requests = []
+
+    def do_GET(self):
+        """Answer with the next queued failure or a page of records."""
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = unquote(url.path)
+        self.requests.append((time.monotonic(), path, params))
+
+        if self.failures:
+            self.respond(self.failures.pop(0), {"error": "stub"})
+            return
+
+        records = self.tables[path]
+        offset = int(params.get("offset", ["0"])[0])
+        page = {"records": records[offset : offset + self.page_size]}
+        if offset + self.page_size < len(records):
+            page["offset"] = str(offset + self.page_size)
+        self.respond(200, page)
+
+    def respond(self, status, body):
+        """Write a JSON response."""
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        """Keep test output quiet."""
+
+
+class StubAirtableMixin:
+    """Runs a stub Airtable server for the duration of each test."""
+
+    def start_stub(self, tables, failures=()):
+        """Start serving `tables` and return a client pointed at it."""
+        StubAirtable.tables = tables
+        StubAirtable.failures = list(failures)
+        StubAirtable.requests = []
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubAirtable)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return AirtableClient(
+            api_key="test",
+            base_url=f"http://127.0.0.1:{server.server_port}",
+            requests_per_second=0,
+            backoff_factor=0,
+        )
+
+
+def records(count):
+    """Build `count` Airtable records."""
+    return [{"id": f"rec{i}", "fields": {"Name": f"Player {i}"}} for i in range(count)]
+
+
+class AirtableClientTestCase(StubAirtableMixin, TestCase):
+    """AirtableClient test cases."""
+
+    def test_iter_records_follows_offsets(self):
+        """Test every page is streamed in order."""
+        client = self.start_stub({"/base/All": records(5)})
+
+        names = [r["fields"]["Name"] for r in client.iter_records("base", "All")]
+
+        self.assertEqual(names, [f"Player {i}" for i in range(5)])
+        self.assertEqual(len(StubAirtable.requests), 3)
+        self.assertEqual(StubAirtable.requests[0][2]["view"], ["Grid view"])
+
+    def test_retries_rate_limit_and_server_errors(self):
+        """Test 429s and 5xxs are retried."""
+        client = self.start_stub({"/base/All": records(1)}, failures=[429, 503])
+
+        self.assertEqual(len(list(client.iter_records("base", "All"))), 1)
+        self.assertEqual(len(StubAirtable.requests), 3)
+
+    def test_rate_limit(self):
+        """Test requests are spaced to the configured rate."""
+        client = self.start_stub({"/base/All": records(4)})
+        client.min_interval = 0.05
+
+        # A clock that only moves when the client sleeps
+        now = [100.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        client._clock = lambda: now[0]
+        client._sleep = sleep
+
+        list(client.iter_records("base", "All"))
+
+        self.assertEqual(len(waits), len(StubAirtable.requests) - 1)
+        self.assertTrue(waits)
+        for wait in waits:
+            self.assertAlmostEqual(wait, 0.05)
+
+
+class SyncGamesTestCase(StubAirtableMixin, BaseDataMixin, TestCase):
+    """sync_games against the stub server."""
+
+    def test_sync_games(self):
+        """Test games are created from every page with their timezone."""
+        self.create_base_data()
+        table = f"/{GAMES_BASE}/{GAMES_TABLE}"
+        game = {"Home Team": "LAL", "Away Team": "BOS", "Date": "2021-06-16"}
+        client = self.start_stub(
+            {
+                table: [
+                    {"id": "rec1", "fields": dict(game, Time="7:00 PM PST")},
+                    {"id": "rec2", "fields": dict(game, Time="7:00 PM EST")},
+                    {"id": "rec3", "fields": dict(game, Time="7:00 PM PST")},
+                ]
+            }
+        )
+
+        with mock.patch("core.tasks.schedule_game_locks") as schedule:
+            report = sync_games(client=client)
+
+        self.assertEqual(
+            sorted(Game.objects.values_list("datetime", flat=True)),
+            [pst(2021, 6, 16, 16), pst(2021, 6, 16, 19)],
+        )
+        self.assertEqual(
+            (report["created"], report["existing"], report["skipped"]), (2, 1, 0)
+        )
+        self.assertEqual(
+            sorted(game.datetime for game in schedule.call_args[0][0]),
+            [pst(2021, 6, 16, 16), pst(2021, 6, 16, 19)],
+        )
+
+        report = sync_games(client=client)
+        self.assertEqual(
+            (report["created"], report["existing"], report["skipped"]), (0, 3, 0)
+        )
+        self.assertEqual(Game.objects.count(), 2)
+
+        sync_games(datetime.date(2021, 6, 16), client=client)
+        self.assertEqual(
+            StubAirtable.requests[-1][2]["filterByFormula"],
+            ['SEARCH("2021-06-16",{Date})'],
+        )
+
+    def test_query_count_is_constant(self):
+        """Test a full schedule costs the same queries as a single game."""
+        self.create_base_data()
+        table = f"/{GAMES_BASE}/{GAMES_TABLE}"
+        StubAirtable.page_size = 500
+        self.addCleanup(setattr, StubAirtable, "page_size", 2)
+
+        counts = []
+        for days in (1, 200):
+            Game.objects.all().delete()
+            start = datetime.date(2021, 1, 1)
+            client = self.start_stub(
+                {
+                    table: [
+                        {
+                            "id": f"rec{i}",
+                            "fields": {
+                                "Home Team": "LAL",
+                                "Away Team": "BOS",
+                                "Date": str(start + datetime.timedelta(days=i)),
+                                "Time": "7:00 PM PST",
+                            },
+                        }
+                        for i in range(days)
+                    ]
+                }
+            )
+            counts.append(sync_games(client=client)["queries"])
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Game.objects.count(), 200)
+
+
+def player_record(name, team, positions, premier=False):
+    """Build an Airtable player record."""
+    fields = {
+        "Name": name,
+        "Team": team,
+        "Position": positions,
+        "Image": [{"thumbnails": {"large": {"url": f"https://img/{name}.png"}}}],
+    }
+    if premier:
+        fields["Premier Player"] = True
+    return {"id": f"rec{name}", "fields": fields}
+
+
+class SyncPlayersTestCase(StubAirtableMixin, BaseDataMixin, TestCase):
+    """sync_players against the stub server."""
+
+    def setUp(self):
+        self.create_base_data()
+        for acronym in ("PG", "SG", "C"):
+            Position.objects.create(league=self.nba, name=acronym, acronym=acronym)
+        self.table = f"/{PLAYERS_BASE}/{PLAYERS_TABLE}"
+
+    def test_sync_players(self):
+        """Test players are inserted, updated and left alone in bulk."""
+        client = self.start_stub(
+            {
+                self.table: [
+                    player_record("LeBron James", "LAL", ["SG"], premier=True),
+                    player_record("Jayson Tatum", "BOS ", ["PG", "SG"]),
+                    player_record("Nobody", "XXX", ["C"]),
+                ]
+            }
+        )
+
+        report = sync_players(client=client)
+
+        self.assertEqual(
+            {k: report[k] for k in ("created", "updated", "unchanged", "skipped")},
+            {"created": 2, "updated": 0, "unchanged": 0, "skipped": 1},
+        )
+        tatum = Player.objects.get(name="Jayson Tatum")
+        self.assertEqual(tatum.team, self.celtics)
+        self.assertEqual(
+            sorted(tatum.positions.values_list("acronym", flat=True)), ["PG", "SG"]
+        )
+        self.assertTrue(Player.objects.get(name="LeBron James").premier)
+
+        StubAirtable.tables[self.table] = [
+            player_record("LeBron James", "LAL", ["SG"], premier=True),
+            player_record("Jayson Tatum", "LAL", ["C"]),
+        ]
+        report = sync_players(client=client)
+
+        self.assertEqual(
+            {k: report[k] for k in ("created", "updated", "unchanged", "skipped")},
+            {"created": 0, "updated": 1, "unchanged": 1, "skipped": 0},
+        )
+        tatum.refresh_from_db()
+        self.assertEqual(tatum.team, self.lakers)
+        self.assertEqual(list(tatum.positions.values_list("acronym", flat=True)), ["C"])
+        self.assertEqual(Player.objects.count(), 2)
+
+    def test_unknown_positions_are_skipped(self):
+        """Test a position we don't have is left off without failing the sync."""
+        client = self.start_stub(
+            {
+                self.table: [
+                    player_record("LeBron James", "LAL", ["SG", "XX"]),
+                    player_record("Jayson Tatum", "BOS", ["PG"]),
+                ]
+            }
+        )
+
+        with self.assertLogs("core.sync", "WARNING"):
+            report = sync_players(client=client)
+
+        self.assertEqual(report["created"], 2)
+        lebron = Player.objects.get(name="LeBron James")
+        self.assertEqual(
+            list(lebron.positions.values_list("acronym", flat=True)), ["SG"]
+        )
+
+    def test_query_count_is_constant(self):
+        """Test the sync costs the same number of queries for any roster size."""
+        counts = []
+        for size in (2, 40):
+            Player.objects.all().delete()
+            client = self.start_stub(
+                {
+                    self.table: [
+                        player_record(f"Player {i}", "LAL", ["PG", "C"])
+                        for i in range(size)
+                    ]
+                }
+            )
+            StubAirtable.page_size = 100
+            self.addCleanup(setattr, StubAirtable, "page_size", 2)
+            counts.append(sync_players(client=client)["queries"])
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Player.objects.count(), 40)
+
+
+def line_record(name, **projections):
+    """Build an Airtable projection record."""
+    fields = {"Player name": name, "Date": "2021-06-16"}
+    fields.update(
+        (f"Projected {category.replace('_', ' ')}", value)
+        for category, value in projections.items()
+    )
+    return {"id": f"rec{name}", "fields": fields}
+
+
+class SyncLinesTestCase(StubAirtableMixin, BaseDataMixin, TestCase):
+    """sync_lines_for_date against the stub server."""
+
+    def setUp(self):
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        for category in ("Points", "Rebounds", "Assists", "Fantasy Points"):
+            LineCategory.objects.create(league=self.nba, category=category)
+        self.game = self.create_game(pst(2021, 6, 16, 19))
+        self.lebron = Player.objects.create(name="LeBron James", team=self.lakers)
+        self.tatum = Player.objects.create(name="Jayson Tatum", team=self.celtics)
+        self.table = f"/{LINES_BASE}/{LINES_TABLE}"
+        self.clock = mock.patch("core.models.tz.now", return_value=pst(2021, 6, 16, 12))
+        self.clock.start()
+        self.addCleanup(self.clock.stop)
+
+    def sync(self, records):
+        """Sync `records` as the lines for the day."""
+        client = self.start_stub({self.table: records})
+        return sync_lines_for_date(datetime.date(2021, 6, 16), client=client)
+
+    def projections(self):
+        """Return {(player, category): (projected value, visible)}."""
+        return {
+            (s.line.player.name, s.line.category.category): (
+                s.projected_value,
+                s.visible,
+            )
+            for s in Subline.objects.select_related("line__player", "line__category")
+        }
+
+    def test_sync_lines(self):
+        """Test lines are created, updated, left alone and skipped."""
+        report = self.sync(
+            [
+                line_record("LeBron James", points=25.5, rebounds=7),
+                line_record("Jayson Tatum ", assists=4.5),
+                line_record("Nobody", points=10),
+            ]
+        )
+
+        self.assertEqual(
+            {k: report[k] for k in ("records", "created", "updated", "unchanged")},
+            {"records": 3, "created": 3, "updated": 0, "unchanged": 0},
+        )
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(
+            self.projections(),
+            {
+                ("LeBron James", "Points"): (Decimal("25.50"), True),
+                ("LeBron James", "Rebounds"): (Decimal("7.00"), True),
+                ("Jayson Tatum", "Assists"): (Decimal("4.50"), True),
+            },
+        )
+
+        Subline.objects.filter(line__category__category="Rebounds").update(
+            visible=False
+        )
+        report = self.sync(
+            [
+                line_record("LeBron James", points=26.5, rebounds=7),
+                line_record("Jayson Tatum", assists=4.5, fantasy_points=30),
+            ]
+        )
+
+        self.assertEqual(
+            {k: report[k] for k in ("created", "updated", "unchanged", "skipped")},
+            {"created": 1, "updated": 2, "unchanged": 1, "skipped": 0},
+        )
+        self.assertEqual(
+            self.projections(),
+            {
+                ("LeBron James", "Points"): (Decimal("26.50"), True),
+                ("LeBron James", "Rebounds"): (Decimal("7.00"), True),
+                ("Jayson Tatum", "Assists"): (Decimal("4.50"), True),
+                ("Jayson Tatum", "Fantasy Points"): (Decimal("30.00"), True),
+            },
+        )
+        self.assertEqual(Line.objects.count(), 4)
+
+    def test_creator_clones_are_left_alone(self):
+        """Test a creator slip's hidden clone isn't synced in the subline's place."""
+        self.sync([line_record("LeBron James", points=25.5)])
+        subline = Subline.objects.get()
+        clone = Subline.objects.create(
+            line=subline.line, projected_value=20, visible=False
+        )
+        slip = Slip.objects.create(
+            owner=self.create_user(), entry_amount=0, creator_slip=True
+        )
+        Pick.objects.create(slip=slip, subline=clone, under=True)
+
+        report = self.sync([line_record("LeBron James", points=27)])
+
+        self.assertEqual(report["updated"], 1)
+        subline.refresh_from_db()
+        clone.refresh_from_db()
+        self.assertEqual((subline.projected_value, subline.visible), (27, True))
+        self.assertEqual((clone.projected_value, clone.visible), (20, False))
+
+    def test_started_games_are_skipped(self):
+        """Test a started game's locked sublines aren't shown again."""
+        self.sync([line_record("LeBron James", points=25.5)])
+        Subline.objects.update(visible=False)
+
+        self.clock.stop()
+        with mock.patch("core.models.tz.now", return_value=pst(2021, 6, 16, 19, 5)):
+            report = self.sync([line_record("LeBron James", points=30)])
+        self.clock.start()
+
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(
+            self.projections(), {("LeBron James", "Points"): (Decimal("25.50"), False)}
+        )
+
+    def test_sync_lines_for_system_date(self):
+        """Test the admin's line sync syncs the system date's lines."""
+        client = self.start_stub({self.table: [line_record("LeBron James", points=25)]})
+
+        report = sync_lines(client=client)
+
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(
+            self.projections(), {("LeBron James", "Points"): (Decimal("25.00"), True)}
+        )
+
+    def test_query_count_is_constant(self):
+        """Test a full slate costs the same queries as a single player."""
+        StubAirtable.page_size = 500
+        self.addCleanup(setattr, StubAirtable, "page_size", 2)
+        players = [
+            Player.objects.create(name=f"Player {i}", team=self.lakers)
+            for i in range(25)
+        ]
+
+        small = self.sync([line_record("LeBron James", points=20, assists=5)])
+        large = self.sync(
+            [
+                line_record(p.name, points=20, rebounds=8, assists=5, fantasy_points=40)
+                for p in players
+            ]
+        )
+
+        self.assertEqual(small["queries"], large["queries"])
+        self.assertEqual(large["created"], 100)
+
+
+class SyncViewsTestCase(BaseDataMixin, TestCase):
+    """The sync views queue their work instead of running it."""
+
+    def test_views_queue_tasks(self):
+        """Test each view queues its task and redirects to the admin."""
+        admin = self.create_user(is_superuser=True, is_staff=True)
+        self.client.force_login(admin, "django.contrib.auth.backends.ModelBackend")
+
+        for name, task in (
+            ("sync_players", "sync_players"),
+            ("sync_games", "sync_games"),
+            ("sync_lines", "sync_lines"),
+            ("run_whole_shebang", "run_whole_shebang"),
+        ):
+            with mock.patch(f"core.tasks.{task}.delay") as delay:
+                response = self.client.get(reverse(name), secure=True)
+            delay.assert_called_once_with()
+            self.assertRedirects(
+                response, reverse("admin:index"), fetch_redirect_response=False
+            )
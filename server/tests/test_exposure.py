@@ -0,0 +1,168 @@
+"""Daily exposure cap tests."""
+
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+
+from accounts.models import User
+from core import exposure, tasks
+from core.models import (
+    CurrentDate,
+    DailyExposure,
+    LineCategory,
+    Slip,
+    WalletTransaction,
+)
+from tests.test_slips import CREATE_SLIP_MUTATION
+from tests.utils import BaseDataMixin, graphql_context, pst
+from underline.schema import schema
+
+TODAY = datetime.date(2021, 6, 16)
+
+
+class ExposureTestCase(BaseDataMixin, TestCase):
+    """Daily exposure counter test cases."""
+
+    def setUp(self):
+        """Create two sublines on tonight's game, at noon PST."""
+        self.create_base_data()
+        CurrentDate.objects.create(date=TODAY)
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.sublines = [
+            self.create_subline(game, f"Player {i}", points) for i in range(2)
+        ]
+        self.user = self.create_user(wallet_balance=200)
+
+        self.clock = mock.patch(
+            "core.models.tz.now", return_value=pst(2021, 6, 16, 12)
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def create_slip_mutation(self, entry_amount):
+        """Submit a slip on both sublines."""
+        result = schema.execute(
+            CREATE_SLIP_MUTATION,
+            variables={
+                "picks": [{"id": s.id, "under": True} for s in self.sublines],
+                "entryAmount": entry_amount,
+            },
+            context=graphql_context(self.user),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["createSlip"]["success"]
+
+    def create_slip_at(self, when, entry_amount):
+        """Create a slip as if it had been submitted at `when`."""
+        slip = self.create_slip(self.user, [], entry_amount=entry_amount)
+        Slip.objects.filter(id=slip.id).update(datetime_created=when)
+        return slip
+
+    def assertExposure(self, amount, date=TODAY):
+        """Assert the user's exposure counter for the date."""
+        self.assertEqual(
+            DailyExposure.objects.get(user=self.user, date=date).amount, amount
+        )
+
+    def test_cap(self):
+        """Test slips are accepted up to the cap and rejected past it."""
+        self.assertTrue(self.create_slip_mutation(50))
+        self.assertTrue(self.create_slip_mutation(30))
+        self.assertFalse(self.create_slip_mutation(10))
+
+        self.assertEqual(Slip.objects.count(), 2)
+        self.assertEqual(
+            WalletTransaction.objects.filter(kind=WalletTransaction.ENTRY).count(), 2
+        )
+        self.assertExposure(80)
+
+    def test_cap_costs_one_query(self):
+        """Test a slip within the cap is checked and counted in one query."""
+        self.assertTrue(exposure.reserve(self.user.id, 10))
+        with self.assertNumQueries(1):
+            self.assertTrue(exposure.reserve(self.user.id, 10))
+        self.assertFalse(exposure.reserve(self.user.id, 61))
+        self.assertExposure(20)
+
+    def test_counter_created_by_another_slip(self):
+        """Test a slip that loses the race to start the counter still fits."""
+        get_or_create = DailyExposure.objects.get_or_create
+
+        def race(**kwargs):
+            # Another slip starts today's counter first
+            get_or_create(user=self.user, date=TODAY)
+            DailyExposure.objects.filter(user=self.user).update(amount=30)
+            return get_or_create(**kwargs)
+
+        with mock.patch.object(
+            DailyExposure.objects, "get_or_create", side_effect=race
+        ):
+            self.assertTrue(exposure.reserve(self.user.id, 50))
+        self.assertExposure(80)
+
+        DailyExposure.objects.all().delete()
+        with mock.patch.object(
+            DailyExposure.objects, "get_or_create", side_effect=race
+        ):
+            self.assertFalse(exposure.reserve(self.user.id, 60))
+        self.assertExposure(30)
+
+    def test_rejected_slip_releases_exposure(self):
+        """Test a slip rolled back for lack of funds leaves no exposure."""
+        self.assertTrue(self.create_slip_mutation(10))
+        User.objects.filter(id=self.user.id).update(wallet_balance=5)
+
+        self.assertFalse(self.create_slip_mutation(20))
+        self.assertExposure(10)
+
+    def test_counter_starts_from_the_days_slips(self):
+        """Test a missing counter starts from the slips of the PST day only."""
+        self.create_slip_at(pst(2021, 6, 16, 0, 30), 40)
+        self.create_slip_at(pst(2021, 6, 16, 11), 30)
+        self.create_slip_at(pst(2021, 6, 15, 23, 59), 50)
+
+        self.assertFalse(exposure.reserve(self.user.id, 20))
+        self.assertTrue(exposure.reserve(self.user.id, 10))
+        self.assertExposure(80)
+
+    def test_new_day(self):
+        """Test the counter starts over at PST midnight."""
+        DailyExposure.objects.create(user=self.user, date=TODAY, amount=80)
+        self.assertFalse(exposure.reserve(self.user.id, 10))
+
+        self.clock.return_value = pst(2021, 6, 17, 0, 1)
+        self.assertTrue(exposure.reserve(self.user.id, 10))
+        self.assertExposure(10, datetime.date(2021, 6, 17))
+
+    def test_pst_day_across_dst(self):
+        """Test the PST day a clock change falls on is 23 hours long."""
+        start, end = exposure.pst_day(datetime.date(2021, 3, 14))
+        self.assertEqual(end - start, datetime.timedelta(hours=23))
+        self.assertEqual(start, pst(2021, 3, 14))
+
+    def test_reconcile(self):
+        """Test reconciling corrects counters that disagree with the slips."""
+        self.create_slip_at(pst(2021, 6, 16, 9), 30)
+        DailyExposure.objects.create(user=self.user, date=TODAY, amount=50)
+        other = self.create_user("other@example.com")
+        DailyExposure.objects.create(user=other, date=TODAY, amount=0)
+
+        self.assertEqual(exposure.reconcile_exposure(TODAY), {self.user.id: (50, 30)})
+        self.assertExposure(30)
+        self.assertEqual(exposure.reconcile_exposure(TODAY), {})
+
+    def test_reconcile_task_prunes(self):
+        """Test the task drops counters older than the retention period."""
+        DailyExposure.objects.create(user=self.user, date=TODAY, amount=10)
+        DailyExposure.objects.create(
+            user=self.user, date=datetime.date(2021, 6, 13), amount=10
+        )
+        self.create_slip_at(pst(2021, 6, 16, 9), 10)
+
+        self.assertEqual(
+            tasks.reconcile_daily_exposure(), {"corrections": 0, "pruned": 1}
+        )
+        self.assertEqual(
+            list(DailyExposure.objects.values_list("date", flat=True)), [TODAY]
+        )
@@ -0,0 +1,63 @@
+"""Game lookup tests."""
+
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+
+from core.models import League, Game
+from tests.utils import BaseDataMixin, pst
+
+
+class GameForPstDateTestCase(BaseDataMixin, TestCase):
+    """Game.objects.for_pst_date test cases."""
+
+    def setUp(self):
+        """Create base data."""
+        self.create_base_data()
+
+    def test_boundaries_are_pst(self):
+        """Test games are bucketed by their PST date."""
+        first = self.create_game(pst(2021, 6, 16, 0, 0))
+        last = self.create_game(pst(2021, 6, 16, 23, 59))
+        self.create_game(pst(2021, 6, 15, 23, 59))
+        self.create_game(pst(2021, 6, 17, 0, 0))
+
+        # 9:30 PM PST is already the next day in UTC
+        late = self.create_game(pst(2021, 6, 16, 21, 30))
+
+        games = Game.objects.for_pst_date(datetime.date(2021, 6, 16))
+        self.assertEqual(set(games), {first, last, late})
+
+    def test_league_filter(self):
+        """Test games can be narrowed to one league."""
+        game = self.create_game(pst(2021, 6, 16, 19, 0))
+        other = League.objects.create(acronym="NFL", long_name="NFL")
+        day = datetime.date(2021, 6, 16)
+
+        self.assertEqual(list(Game.objects.for_pst_date(day, league=self.nba)), [game])
+        self.assertFalse(Game.objects.for_pst_date(day, league=other).exists())
+
+
+class GameForPstDateQueryPlanTestCase(BaseDataMixin, TestCase):
+    """The slate lookup shouldn't scan the historical games."""
+
+    def test_uses_datetime_index(self):
+        """Test the lookup is one query that searches a datetime index."""
+        self.create_base_data()
+        day = datetime.date(2021, 6, 16)
+        for hour in (16, 18, 19):
+            self.create_game(pst(2021, 6, 16, hour))
+
+        games = Game.objects.for_pst_date(day)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(games)), 3)
+
+        if connection.vendor == "postgresql":
+            # With a handful of rows a sequential scan is cheapest, so ask
+            # for the plan the index would give
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = games.explain()
+        self.assertRegex(plan, r"(?i)index")
+        self.assertNotRegex(plan, r"(?i)\bscan (table )?core_game\b")
@@ -0,0 +1,160 @@
+"""Signup geolocation tests."""
+
+import io
+import ipaddress
+import os
+import tempfile
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, TestCase, override_settings
+
+from accounts.models import User
+from core.geolocation import (
+    PAY_TO_PLAY,
+    Geolocator,
+    IPRangeDatabase,
+    Location,
+    build_database,
+    client_ip,
+    get_geolocator,
+)
+from underline.schema import schema
+
+
+def ip(address):
+    """Integer form of an IPv4 address."""
+    return int(ipaddress.ip_address(address))
+
+
+CSV = "\n".join(
+    f'"{ip(first)}","{ip(last)}","{country}","{country_name}","{region}","-"'
+    for first, last, country, country_name, region in (
+        ("8.8.8.0", "8.8.8.255", "US", "United States", "California"),
+        ("1.0.0.0", "1.0.0.255", "AU", "Australia", "Queensland"),
+        ("9.0.0.0", "9.0.0.255", "US", "United States", "New York"),
+        ("10.0.0.0", "10.255.255.255", "-", "-", "-"),
+        ("11.0.0.0", "11.0.0.255", "US", "United States", "California"),
+    )
+)
+
+CREATE_USER_MUTATION = """
+    mutation {
+        createUser(
+            firstName: "First"
+            lastName: "Last"
+            username: "player"
+            phoneNumber: "5555555555"
+            birthDate: "1990-01-01"
+            emailAddress: "Player@Example.com"
+            password: "password"
+        ) {
+            success
+            freeToPlay
+        }
+    }
+"""
+
+
+class GeolocationTestMixin:
+    """Compiles CSV into a temporary database."""
+
+    def create_database(self):
+        """Build the test database and return it opened."""
+        handle, path = tempfile.mkstemp(suffix=".bin")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.assertEqual(build_database(io.StringIO(CSV), path), 4)
+        return IPRangeDatabase(path)
+
+
+class IPRangeDatabaseTestCase(GeolocationTestMixin, TestCase):
+    """IPRangeDatabase and Geolocator test cases."""
+
+    def test_lookup(self):
+        """Test addresses resolve to the range containing them."""
+        database = self.create_database()
+        california = Location("US", "California")
+
+        self.assertEqual(len(database), 4)
+        self.assertEqual(database.lookup("8.8.8.0"), california)
+        self.assertEqual(database.lookup("8.8.8.8"), california)
+        self.assertEqual(database.lookup("8.8.8.255"), california)
+        self.assertEqual(database.lookup("11.0.0.1"), california)
+        self.assertEqual(database.lookup("1.0.0.7"), Location("AU", "Queensland"))
+        self.assertEqual(database.lookup("9.0.0.1"), Location("US", "New York"))
+
+        for address in ("0.0.0.1", "8.8.9.0", "10.1.1.1", "255.0.0.1", "::1", "junk"):
+            self.assertIsNone(database.lookup(address), address)
+
+    def test_lookups_are_cached(self):
+        """Test repeat lookups are served from the LRU."""
+        geolocator = Geolocator(self.create_database(), cache_size=2)
+
+        for address in ("8.8.8.8", "8.8.8.8", "9.0.0.1", "8.8.8.8"):
+            geolocator.lookup(address)
+
+        self.assertEqual(geolocator.lookup.cache_info().hits, 2)
+        self.assertIsNone(Geolocator().lookup("8.8.8.8"))
+
+    @override_settings(GEOIP_DATABASE="/nonexistent/ip-regions.bin")
+    def test_missing_database(self):
+        """Test a missing database only falls back to unknown under DEBUG."""
+        with mock.patch("core.geolocation._geolocator", None):
+            with self.settings(DEBUG=False), self.assertRaises(ImproperlyConfigured):
+                get_geolocator()
+
+            with self.settings(DEBUG=True), self.assertLogs("core.geolocation"):
+                self.assertIsNone(get_geolocator().lookup("8.8.8.8"))
+
+    def test_policy(self):
+        """Test only approved US states allow paid play."""
+        self.assertTrue(PAY_TO_PLAY.allows(Location("US", "California")))
+        self.assertFalse(PAY_TO_PLAY.allows(Location("US", "New York")))
+        self.assertFalse(PAY_TO_PLAY.allows(Location("AU", "Georgia")))
+        self.assertFalse(PAY_TO_PLAY.allows(None))
+
+    def test_client_ip(self):
+        """Test the last forwarded address wins, falling back to the peer."""
+        factory = RequestFactory()
+        request = factory.post("/", HTTP_X_FORWARDED_FOR="1.1.1.1, 8.8.8.8")
+        self.assertEqual(client_ip(request), "8.8.8.8")
+        self.assertEqual(client_ip(factory.post("/")), "127.0.0.1")
+
+
+class CreateUserTestCase(GeolocationTestMixin, TestCase):
+    """createUser mutation test cases."""
+
+    def setUp(self):
+        """Resolve signups against the test database."""
+        patcher = mock.patch(
+            "underline.graphql.schema.get_geolocator",
+            return_value=Geolocator(self.create_database()),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_user(self, **meta):
+        """Sign up from a request with the given META."""
+        request = RequestFactory().post("/graphql/", **meta)
+        result = schema.execute(CREATE_USER_MUTATION, context=request)
+        self.assertIsNone(result.errors)
+        return result.data["createUser"], User.objects.get()
+
+    def test_approved_state(self):
+        """Test a signup from an approved state is pay to play."""
+        data, user = self.create_user(HTTP_X_FORWARDED_FOR="1.1.1.1, 8.8.8.8")
+        self.assertEqual(data, {"success": True, "freeToPlay": False})
+        self.assertEqual((user.free_to_play, user.wallet_balance), (False, 0))
+        self.assertEqual(user.email, "player@example.com")
+
+    def test_other_state(self):
+        """Test a signup from anywhere else is free to play."""
+        data, user = self.create_user(HTTP_X_FORWARDED_FOR="9.0.0.1")
+        self.assertEqual(data, {"success": True, "freeToPlay": True})
+        self.assertEqual((user.free_to_play, user.wallet_balance), (True, 100))
+
+    def test_missing_forwarded_for(self):
+        """Test a request without X-Forwarded-For falls back to the peer."""
+        data, user = self.create_user(REMOTE_ADDR="8.8.8.8")
+        self.assertEqual(data, {"success": True, "freeToPlay": False})
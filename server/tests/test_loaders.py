@@ -0,0 +1,82 @@
+"""GraphQL DataLoader tests."""
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.models import LineCategory, Team
+from tests.utils import BaseDataMixin, graphql_context, pst
+from underline.schema import schema
+
+
+SLIPS_QUERY = """
+    query {
+        activeSlips {
+            id
+            picks {
+                won
+                subline {
+                    projectedValue
+                    line {
+                        player { name team { abbreviation } }
+                        game { homeTeam { name } awayTeam { name } }
+                        category { category league { acronym } }
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+class LoadersTestCase(BaseDataMixin, TestCase):
+    """Relations are batched and memoized per request."""
+
+    def setUp(self):
+        """Create a category and a user."""
+        self.create_base_data()
+        self.points = LineCategory.objects.create(league=self.nba, category="Points")
+        self.user = self.create_user()
+
+    def create_slips(self, count):
+        """Create `count` slips, each with two picks on its own game."""
+        for i in range(count):
+            away = Team.objects.create(
+                name=f"Team {i}",
+                abbreviation=f"T{i}",
+                location="",
+                logo_url="",
+                league=self.nba,
+            )
+            game = self.create_game(pst(2021, 6, 16, 19))
+            game.away_team = away
+            game.save()
+            picks = [
+                (self.create_subline(game, f"Player {i}-{j}", self.points), j == 0)
+                for j in range(2)
+            ]
+            self.create_slip(self.user, picks)
+
+    def execute(self):
+        """Run the slips query, returning the data and the query count."""
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(SLIPS_QUERY, context=graphql_context(self.user))
+        self.assertIsNone(result.errors)
+        return result.data, len(queries)
+
+    def test_query_count_is_constant(self):
+        """Test nested relations cost the same queries for one slip or five."""
+        self.create_slips(1)
+        data, one = self.execute()
+        self.assertEqual(len(data["activeSlips"][0]["picks"]), 2)
+
+        self.create_slips(4)
+        data, five = self.execute()
+
+        self.assertEqual(len(data["activeSlips"]), 5)
+        self.assertEqual(one, five)
+        pick = data["activeSlips"][0]["picks"][0]
+        self.assertEqual(
+            pick["subline"]["line"]["player"]["team"]["abbreviation"], "LAL"
+        )
+        self.assertIsNone(pick["won"])
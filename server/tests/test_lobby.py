@@ -0,0 +1,155 @@
+"""Lobby (todays_sublines) tests."""
+
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core.lobby import invalidate_lobby
+from core.models import CurrentDate, LineCategory, Line, Subline
+from tests.utils import BaseDataMixin, pst
+from underline.schema import schema
+
+
+LOBBY_QUERY = """
+    query {
+        todaysSublines {
+            id
+            projectedValue
+            line {
+                id
+                category {
+                    id
+                    category
+                }
+                player {
+                    id
+                    name
+                    headshotUrl
+                    team {
+                        id
+                    }
+                }
+                game {
+                    datetime
+                    homeTeam {
+                        abbreviation
+                    }
+                    awayTeam {
+                        abbreviation
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+class LobbyTestMixin(BaseDataMixin):
+    """Sets up a two game slate on the system date."""
+
+    def create_slate(self):
+        """Create the system date, a category and two games on it."""
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        self.points = LineCategory.objects.create(league=self.nba, category="Points")
+        self.early = self.create_game(pst(2021, 6, 16, 16))
+        self.late = self.create_game(pst(2021, 6, 16, 19))
+
+    def execute(self):
+        """Run the lobby query and return the subline ids in order."""
+        result = schema.execute(LOBBY_QUERY)
+        self.assertIsNone(result.errors)
+        return [int(s["id"]) for s in result.data["todaysSublines"]]
+
+
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+@override_settings(CACHES=NO_CACHE)
+class TodaysSublinesTestCase(LobbyTestMixin, TestCase):
+    """todays_sublines resolver test cases, bypassing the lobby cache."""
+
+    def setUp(self):
+        """Create the slate."""
+        self.create_slate()
+
+    def test_premier_first_then_by_gametime(self):
+        """Test ordering and filtering of the lobby."""
+        regular_late = self.create_subline(self.late, "Regular Late", self.points)
+        premier_late = self.create_subline(
+            self.late, "Premier Late", self.points, premier=True
+        )
+        regular_early = self.create_subline(self.early, "Regular Early", self.points)
+        premier_early = self.create_subline(
+            self.early, "Premier Early", self.points, premier=True
+        )
+        hidden = self.create_subline(self.early, "Hidden", self.points)
+        hidden.visible = False
+        hidden.save()
+        invalidated = self.create_subline(self.early, "Invalidated", self.points)
+        Line.objects.filter(subline=invalidated).update(invalidated=True)
+        self.create_subline(
+            self.create_game(pst(2021, 6, 17, 16)), "Tomorrow", self.points
+        )
+
+        self.assertEqual(
+            self.execute(),
+            [premier_early.id, premier_late.id, regular_early.id, regular_late.id],
+        )
+
+    def test_query_count_is_constant(self):
+        """Test the lobby costs the same number of queries for any slate size."""
+        for i in range(3):
+            self.create_subline(self.early, f"Player {i}", self.points)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.execute()), 3)
+
+        for i in range(3, 30):
+            game = self.early if i % 2 else self.late
+            self.create_subline(game, f"Player {i}", self.points, premier=i % 3 == 0)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.execute()), 30)
+
+
+class LobbyCacheTestCase(LobbyTestMixin, TransactionTestCase):
+    """Lobby snapshot cache test cases.
+
+    Invalidation runs on commit, so these run outside a test transaction.
+    """
+
+    def setUp(self):
+        """Create the slate and start from an empty cache."""
+        cache.clear()
+        self.create_slate()
+        self.subline = self.create_subline(self.early, "Player", self.points)
+
+    def test_cached_read_skips_lobby_query(self):
+        """Test a warm cache only costs the system date lookup."""
+        self.assertEqual(self.execute(), [self.subline.id])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.execute(), [self.subline.id])
+
+    def test_save_invalidates(self):
+        """Test saving a subline drops the cached snapshot."""
+        self.execute()
+        self.subline.visible = False
+        self.subline.save()
+        self.assertEqual(self.execute(), [])
+
+    def test_queryset_update_invalidates(self):
+        """Test bulk updates invalidate through invalidate_lobby."""
+        self.execute()
+        Subline.objects.update(visible=False)
+        self.assertEqual(self.execute(), [self.subline.id])
+
+        invalidate_lobby()
+        self.assertEqual(self.execute(), [])
+
+    def test_system_date_change(self):
+        """Test a new system date reads a fresh snapshot."""
+        self.execute()
+        CurrentDate.objects.update(date=datetime.date(2021, 6, 17))
+        self.assertEqual(self.execute(), [])
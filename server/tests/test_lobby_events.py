@@ -0,0 +1,414 @@
+"""Lobby diff push tests."""
+
+import contextlib
+import datetime
+import json
+import threading
+import time
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.urls import reverse
+
+from core import lobby_events
+from core.models import (
+    CurrentDate,
+    Line,
+    LineCategory,
+    Movement,
+    SubMovement,
+    Subline,
+)
+from core.sync import sync_lines_for_date
+from core.tasks import lock_game, remove_lines_when_game_starts
+from tests.test_admin import PLAIN_STATIC, AdminTestMixin
+from tests.test_airtable import line_record
+from tests.utils import pst
+from underline import views
+
+
+@contextlib.contextmanager
+def run_on_commit():
+    """Run the on_commit callbacks registered inside the block."""
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for savepoint_ids, callback in callbacks:
+        callback()
+
+
+class StubLines:
+    """An Airtable client serving the given line records."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def iter_records(self, base, table, formula=None):
+        return iter(self.records)
+
+
+class LobbyEventsTestMixin(AdminTestMixin):
+    """Two sublines on a 7 PM game, with a listener on a local hub."""
+
+    def create_lobby(self):
+        """Create the game and its sublines and start listening."""
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        self.points = LineCategory.objects.create(league=self.nba, category="Points")
+        self.game = self.create_game(pst(2021, 6, 16, 19))
+        self.sublines = [
+            self.create_subline(self.game, name, self.points)
+            for name in ("LeBron James", "Anthony Davis")
+        ]
+
+        self.hub = lobby_events.LobbyHub()
+        hub = mock.patch("core.lobby_events._hub", self.hub)
+        hub.start()
+        self.addCleanup(hub.stop)
+        listening = self.hub.listen()
+        self.listener = listening.__enter__()
+        self.addCleanup(listening.__exit__, None, None, None)
+
+        clock = mock.patch("core.models.tz.now", return_value=pst(2021, 6, 16, 12))
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+
+    def messages(self):
+        """Return the messages published so far."""
+        messages = []
+        while not self.listener.queue.empty():
+            messages.append(json.loads(self.listener.queue.get()))
+        return messages
+
+    def ids(self, *sublines):
+        """Return the sublines' ids as sent to clients."""
+        return [str(subline.id) for subline in sublines]
+
+
+class LobbyEventsTestCase(LobbyEventsTestMixin, TestCase):
+    """Diffs published by the tasks and syncs that change sublines."""
+
+    def setUp(self):
+        self.create_lobby()
+
+    def test_fan_out(self):
+        """Test every listener gets each message and a slow one is dropped."""
+        with self.hub.listen() as other:
+            self.hub.publish({"type": "test"})
+            self.assertEqual(json.loads(other.get(timeout=0)), {"type": "test"})
+
+            with mock.patch("core.lobby_events.LISTENER_QUEUE_SIZE", 1):
+                with self.hub.listen() as slow:
+                    self.hub.publish({"type": "test"})
+                    self.hub.publish({"type": "test"})
+                    self.assertTrue(slow.dropped)
+
+        self.assertEqual(self.messages(), [{"type": "test"}] * 3)
+        self.assertFalse(self.listener.dropped)
+
+    def test_lock_game(self):
+        """Test locking a game sends the sublines it hid."""
+        self.clock.return_value = pst(2021, 6, 16, 19, 1)
+        with run_on_commit():
+            self.assertEqual(lock_game(self.game.id), 2)
+            self.assertEqual(remove_lines_when_game_starts(), 0)
+
+        self.assertEqual(
+            self.messages(),
+            [{"type": "subline_hidden", "ids": self.ids(*self.sublines)}],
+        )
+
+    def test_rolled_back_changes_are_not_sent(self):
+        """Test nothing is sent for a change that's rolled back."""
+        self.clock.return_value = pst(2021, 6, 16, 19, 1)
+        with run_on_commit():
+            with transaction.atomic():
+                remove_lines_when_game_starts()
+                transaction.set_rollback(True)
+
+        self.assertEqual(self.messages(), [])
+
+    def test_sync_lines(self):
+        """Test a sync sends new and shown-again sublines and new projections."""
+        self.sublines[1].visible = False
+        self.sublines[1].save()
+
+        with run_on_commit():
+            sync_lines_for_date(
+                datetime.date(2021, 6, 16),
+                client=StubLines(
+                    [
+                        line_record("LeBron James", points=25.5),
+                        line_record("Anthony Davis", points=10),
+                    ]
+                ),
+            )
+        self.assertEqual(
+            self.messages(),
+            [
+                {
+                    "type": "subline_added",
+                    "sublines": [
+                        {
+                            "id": str(self.sublines[1].id),
+                            "projectedValue": "10.00",
+                            "line": {
+                                "id": str(self.sublines[1].line_id),
+                                "category": {
+                                    "id": str(self.points.id),
+                                    "category": "Points",
+                                },
+                                "player": {
+                                    "id": str(self.sublines[1].line.player_id),
+                                    "name": "Anthony Davis",
+                                    "headshotUrl": None,
+                                    "team": {"id": str(self.lakers.id)},
+                                },
+                                "game": {
+                                    "datetime": "2021-06-17T02:00:00+00:00",
+                                    "homeTeam": {"abbreviation": "LAL"},
+                                    "awayTeam": {"abbreviation": "BOS"},
+                                },
+                            },
+                        }
+                    ],
+                },
+                {
+                    "type": "projection_changed",
+                    "sublines": [
+                        {"id": str(self.sublines[0].id), "projectedValue": "25.50"}
+                    ],
+                },
+            ],
+        )
+
+        LineCategory.objects.create(league=self.nba, category="Assists")
+        with run_on_commit():
+            sync_lines_for_date(
+                datetime.date(2021, 6, 16),
+                client=StubLines([line_record("LeBron James", points=25.5, assists=7)]),
+            )
+        added = Subline.objects.get(line__category__category="Assists")
+        [message] = self.messages()
+        self.assertEqual(message["type"], "subline_added")
+        self.assertEqual(
+            [subline["id"] for subline in message["sublines"]], self.ids(added)
+        )
+
+
+@PLAIN_STATIC
+class LineAdminEventsTestCase(LobbyEventsTestMixin, TestCase):
+    """Diffs published by LineAdmin edits."""
+
+    def setUp(self):
+        self.create_lobby()
+        self.login()
+
+    def test_invalidate_from_changelist(self):
+        """Test invalidating a line hides its sublines, and restoring adds them."""
+        line = self.sublines[0].line
+        data = {
+            "form-TOTAL_FORMS": "1",
+            "form-INITIAL_FORMS": "1",
+            "form-MIN_NUM_FORMS": "0",
+            "form-MAX_NUM_FORMS": "1000",
+            "form-0-id": str(line.id),
+            "form-0-actual_value": "",
+            "_save": "Save",
+        }
+        url = reverse("admin:core_line_changelist")
+
+        with run_on_commit():
+            data["form-0-invalidated"] = "on"
+            self.client.post(url, data, secure=True)
+        self.assertEqual(
+            self.messages(),
+            [{"type": "subline_hidden", "ids": self.ids(self.sublines[0])}],
+        )
+
+        with run_on_commit():
+            del data["form-0-invalidated"]
+            self.client.post(url, data, secure=True)
+        [message] = self.messages()
+        self.assertEqual(
+            (message["type"], [subline["id"] for subline in message["sublines"]]),
+            ("subline_added", self.ids(self.sublines[0])),
+        )
+
+    def test_invalidate_from_change_form(self):
+        """Test invalidating and restoring a line on its page sends diffs."""
+        line = self.sublines[0].line
+        data = {
+            "player": str(line.player_id),
+            "game": str(line.game_id),
+            "category": str(line.category_id),
+            "actual_value": "",
+            "subline_set-TOTAL_FORMS": "0",
+            "subline_set-INITIAL_FORMS": "0",
+            "subline_set-MIN_NUM_FORMS": "0",
+            "subline_set-MAX_NUM_FORMS": "1000",
+            "_save": "Save",
+        }
+        url = reverse("admin:core_line_change", args=[line.id])
+
+        with run_on_commit():
+            data["invalidated"] = "on"
+            response = self.client.post(url, data, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            self.messages(),
+            [{"type": "subline_hidden", "ids": self.ids(self.sublines[0])}],
+        )
+
+        with run_on_commit():
+            del data["invalidated"]
+            self.client.post(url, data, secure=True)
+        [message] = self.messages()
+        self.assertEqual(
+            (message["type"], [subline["id"] for subline in message["sublines"]]),
+            ("subline_added", self.ids(self.sublines[0])),
+        )
+
+    def test_make_sublines_invisible(self):
+        """Test the bulk action sends the sublines it hid."""
+        lines = Line.objects.filter(subline__in=self.sublines)
+        with run_on_commit():
+            self.client.post(
+                reverse("admin:core_line_changelist"),
+                {
+                    "action": "make_sublines_invisible",
+                    "_selected_action": [line.id for line in lines],
+                },
+                secure=True,
+            )
+
+        self.assertEqual(
+            self.messages(),
+            [{"type": "subline_hidden", "ids": self.ids(*self.sublines)}],
+        )
+
+    def test_inline_edit(self):
+        """Test editing a subline inline sends its new projection."""
+        subline = self.sublines[0]
+        line = subline.line
+        # The inline form requires a submovement
+        movement = Movement.objects.create(
+            date=datetime.date(2021, 6, 16), cap=0, creator=self.admin
+        )
+        subline.submovement = SubMovement.objects.create(
+            category=self.points, movement=movement
+        )
+        subline.save()
+        data = {
+            "player": str(line.player_id),
+            "game": str(line.game_id),
+            "category": str(line.category_id),
+            "actual_value": "",
+            "subline_set-TOTAL_FORMS": "1",
+            "subline_set-INITIAL_FORMS": "1",
+            "subline_set-MIN_NUM_FORMS": "0",
+            "subline_set-MAX_NUM_FORMS": "1000",
+            "subline_set-0-id": str(subline.id),
+            "subline_set-0-line": str(line.id),
+            "subline_set-0-projected_value": "12.5",
+            "subline_set-0-visible": "on",
+            "subline_set-0-submovement": str(subline.submovement_id),
+            "_save": "Save",
+        }
+
+        with run_on_commit():
+            response = self.client.post(
+                reverse("admin:core_line_change", args=[line.id]), data, secure=True
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            self.messages(),
+            [
+                {
+                    "type": "projection_changed",
+                    "sublines": [{"id": str(subline.id), "projectedValue": "12.50"}],
+                }
+            ],
+        )
+
+
+class LobbyHubTestCase(TestCase):
+    """The Redis subscriber behind a hub."""
+
+    def test_subscriber_survives_errors(self):
+        """Test the subscriber resubscribes after any error."""
+        hub = lobby_events.LobbyHub()
+        hub._redis = mock.Mock()
+        resubscribed = threading.Event()
+
+        def messages():
+            resubscribed.wait(5)
+            yield {"data": b'{"type":"test"}'}
+            # Hold the subscription open for the rest of the run
+            threading.Event().wait()
+
+        hub._redis.pubsub.return_value.listen.side_effect = [
+            ValueError("Unexpected"),
+            messages(),
+        ]
+
+        with mock.patch("core.lobby_events.RECONNECT_DELAY", 0), self.assertLogs(
+            "core.lobby_events", "ERROR"
+        ):
+            with hub.listen() as first:
+                deadline = time.monotonic() + 5
+                while not first.dropped and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertTrue(first.dropped)
+
+            with hub.listen() as second:
+                resubscribed.set()
+                self.assertEqual(second.get(timeout=5), '{"type":"test"}')
+
+
+class LobbyStreamTestCase(LobbyEventsTestMixin, TestCase):
+    """The server-sent events endpoint."""
+
+    def setUp(self):
+        self.create_lobby()
+
+    def test_stream(self):
+        """Test the stream relays messages, keeps alive and resets when behind."""
+        response = self.client.get("/lobby/events", secure=True)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertEqual(next(stream), b"retry: 3000\n\n")
+
+        self.hub.publish({"type": "subline_hidden", "ids": ["1"]})
+        self.assertEqual(
+            next(stream),
+            b'event: lobby\ndata: {"type":"subline_hidden","ids":["1"]}\n\n',
+        )
+
+        with mock.patch.object(views, "LOBBY_KEEPALIVE_SECONDS", 0):
+            self.assertEqual(next(stream), b": keepalive\n\n")
+
+            for i in range(lobby_events.LISTENER_QUEUE_SIZE + 1):
+                self.hub.publish({"type": "test"})
+            self.assertEqual(next(stream), b"event: reset\ndata: {}\n\n")
+        with self.assertRaises(StopIteration):
+            next(stream)
+        response.close()
+
+    def test_stream_cap(self):
+        """Test streams past the cap are turned away until one closes."""
+        with mock.patch.object(views, "_lobby_stream_slots", threading.Semaphore(1)):
+            first = self.client.get("/lobby/events", secure=True)
+            self.assertEqual(first.status_code, 200)
+
+            response = self.client.get("/lobby/events", secure=True)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "3")
+
+            first.close()
+            response = self.client.get("/lobby/events", secure=True)
+            self.assertEqual(response.status_code, 200)
+            response.close()
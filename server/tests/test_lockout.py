@@ -0,0 +1,146 @@
+"""Line lockout tests."""
+
+import datetime
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from core.models import CurrentDate, LineCategory, Subline, Slip
+from core.tasks import lock_game, remove_lines_when_game_starts
+from tests.utils import BaseDataMixin, graphql_context, pst
+from underline.schema import schema
+
+
+CREATE_SLIP_MUTATION = """
+    mutation createSlip($picks: [PickType]!) {
+        createSlip(picks: $picks, entryAmount: 10, creatorCode: "") {
+            success
+        }
+    }
+"""
+
+
+def at(now):
+    """Freeze the clock used for the system time."""
+    return mock.patch("core.models.tz.now", return_value=now)
+
+
+class LockoutTestMixin(BaseDataMixin):
+    """Two games on the system date, one line each."""
+
+    def create_slate(self):
+        """Create a 4 PM and a 7 PM game with a subline each."""
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        self.early = self.create_game(pst(2021, 6, 16, 16, 15))
+        self.late = self.create_game(pst(2021, 6, 16, 19))
+        self.early_subline = self.create_subline(self.early, "Early", points)
+        self.late_subline = self.create_subline(self.late, "Late", points)
+
+    def visible(self):
+        """Return the ids of the visible sublines."""
+        return set(Subline.objects.filter(visible=True).values_list("id", flat=True))
+
+
+class LockGameTestCase(LockoutTestMixin, TestCase):
+    """lock_game and reconciliation test cases."""
+
+    def setUp(self):
+        """Create the slate."""
+        self.create_slate()
+
+    def test_lock_game_at_tip_off(self):
+        """Test a game is only locked once it has started."""
+        with at(pst(2021, 6, 16, 16, 14)), mock.patch(
+            "core.tasks.lock_game.apply_async"
+        ) as apply_async:
+            self.assertEqual(lock_game(self.early.id), 0)
+        apply_async.assert_called_once_with((self.early.id,), countdown=60)
+
+        with at(pst(2021, 6, 16, 16, 15)):
+            self.assertEqual(lock_game(self.early.id), 1)
+        self.assertEqual(self.visible(), {self.late_subline.id})
+
+    def test_lock_game_on_the_system_clock(self):
+        """Test a lock firing at real tip-off waits for the system clock."""
+        tomorrow = self.create_game(pst(2021, 6, 17, 19))
+        self.create_subline(tomorrow, "Tomorrow", self.early_subline.line.category)
+
+        # The real clock reaches tip-off a day before the system clock does
+        with at(pst(2021, 6, 17, 19)), mock.patch(
+            "core.tasks.lock_game.apply_async"
+        ) as apply_async:
+            self.assertEqual(lock_game(tomorrow.id), 0)
+        # A day off is beyond what the broker can hold, so the sweep has it
+        apply_async.assert_not_called()
+
+        # The system date is ahead of the real one
+        CurrentDate.objects.update(date=datetime.date(2021, 6, 17))
+        with at(pst(2021, 6, 16, 19)):
+            self.assertEqual(lock_game(tomorrow.id), 1)
+
+    def test_reconciliation(self):
+        """Test the sweep locks every started game off the beat tick."""
+        with at(pst(2021, 6, 16, 16, 17)), self.assertNumQueries(4):
+            self.assertEqual(remove_lines_when_game_starts(), 1)
+        self.assertEqual(self.visible(), {self.late_subline.id})
+
+        with at(pst(2021, 6, 16, 23)):
+            remove_lines_when_game_starts()
+        self.assertEqual(self.visible(), set())
+
+    def test_create_slip_rejects_started_games(self):
+        """Test picks on a started game are rejected."""
+        user = self.create_user(wallet_balance=100)
+        picks = [
+            {"id": self.early_subline.id, "under": True},
+            {"id": self.late_subline.id, "under": False},
+        ]
+
+        with at(pst(2021, 6, 16, 16, 30)):
+            result = schema.execute(
+                CREATE_SLIP_MUTATION,
+                variables={"picks": picks},
+                context=graphql_context(user),
+            )
+            self.assertFalse(result.data["createSlip"]["success"])
+            self.assertFalse(Slip.objects.exists())
+
+            result = schema.execute(
+                CREATE_SLIP_MUTATION,
+                variables={"picks": picks[1:]},
+                context=graphql_context(user),
+            )
+            self.assertTrue(result.data["createSlip"]["success"])
+
+
+class ScheduleGameLockTestCase(LockoutTestMixin, TransactionTestCase):
+    """Saving a game schedules its lockout once the transaction commits."""
+
+    def test_schedules_upcoming_games(self):
+        """Test only games starting within the schedule window are scheduled."""
+        self.create_base_data()
+        with at(pst(2021, 6, 16, 18, 55)), mock.patch(
+            "core.tasks.lock_game.apply_async"
+        ) as apply_async:
+            upcoming = self.create_game(pst(2021, 6, 16, 19))
+            self.create_game(pst(2021, 6, 16, 18))
+            self.create_game(pst(2021, 6, 16, 22))
+
+        apply_async.assert_called_once_with((upcoming.id,), eta=upcoming.datetime)
+
+    def test_sweep_schedules_later_games(self):
+        """Test the sweep queues a game's lock as it comes into the window."""
+        self.create_slate()
+        with mock.patch("core.tasks.lock_game.apply_async") as apply_async:
+            with at(pst(2021, 6, 16, 16, 10)):
+                remove_lines_when_game_starts()
+            apply_async.assert_called_once_with(
+                (self.early.id,), eta=self.early.datetime
+            )
+
+            apply_async.reset_mock()
+            with at(pst(2021, 6, 16, 18, 50)):
+                remove_lines_when_game_starts()
+            apply_async.assert_called_once_with((self.late.id,), eta=self.late.datetime)
@@ -0,0 +1,228 @@
+"""Email outbox tests."""
+
+import datetime
+from unittest import mock
+
+from django.core import mail as django_mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from python_http_client.exceptions import BadRequestsError
+
+from core import mail
+from core.models import LineCategory, OutboundEmail
+from tests.utils import BaseDataMixin, pst
+
+
+class FailingBackend:
+    """A provider that's down."""
+
+    def send(self, email):
+        """Fail every send."""
+        raise ConnectionError("provider down")
+
+
+class RecordingBackend:
+    """A provider that records what the outbox looked like during each send."""
+
+    def __init__(self):
+        self.sends = []
+
+    def send(self, email):
+        """Record the stored email and how deep in transactions the send ran."""
+        self.sends.append(
+            (OutboundEmail.objects.get(id=email.id), len(connection.savepoint_ids))
+        )
+
+
+@override_settings(
+    EMAIL_OUTBOX_BACKEND="core.mail.DjangoMailBackend",
+    EMAIL_OUTBOX_ADMIN_DIGEST=False,
+)
+class OutboxTestCase(TestCase):
+    """drain_outbox and send_admin_digest test cases."""
+
+    def test_drain_outbox(self):
+        """Test every pending email is sent in batches and marked sent."""
+        for i in range(mail.BATCH_SIZE + 5):
+            mail.queue_email(f"user{i}@example.com", f"Hi {i}", "<p>Hello</p>")
+
+        report = mail.drain_outbox()
+
+        self.assertEqual(
+            report, {"sent": mail.BATCH_SIZE + 5, "retried": 0, "failed": 0}
+        )
+        self.assertEqual(len(django_mail.outbox), mail.BATCH_SIZE + 5)
+        self.assertEqual(django_mail.outbox[0].body, "Hello")
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT))
+
+        self.assertEqual(mail.drain_outbox()["sent"], 0)
+
+    def test_send_outside_transaction(self):
+        """Test emails are claimed as sending before the provider is called."""
+        email = mail.queue_email("user@example.com", "Hi", "<p>Hello</p>")
+        backend = RecordingBackend()
+        depth = len(connection.savepoint_ids)
+
+        self.assertEqual(mail.drain_outbox(backend)["sent"], 1)
+
+        [(claimed, send_depth)] = backend.sends
+        self.assertEqual(claimed.status, OutboundEmail.SENDING)
+        self.assertIsNotNone(claimed.claimed_at)
+        self.assertEqual(send_depth, depth)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+
+    def test_stale_claim(self):
+        """Test a claim left by a drain that died is retried after the timeout."""
+        email = mail.queue_email("user@example.com", "Hi", "<p>Hello</p>")
+        now = timezone.now()
+        OutboundEmail.objects.update(status=OutboundEmail.SENDING, claimed_at=now)
+
+        with mock.patch("core.mail.timezone.now", return_value=now):
+            self.assertEqual(mail.drain_outbox()["sent"], 0)
+        with mock.patch(
+            "core.mail.timezone.now", return_value=now + mail.CLAIM_TIMEOUT
+        ):
+            self.assertEqual(mail.drain_outbox()["sent"], 1)
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+
+    def test_retry_with_backoff(self):
+        """Test failed sends back off exponentially, then give up."""
+        email = mail.queue_email("user@example.com", "Hi", "<p>Hello</p>")
+        now = timezone.now()
+
+        for attempt in range(1, mail.MAX_ATTEMPTS + 1):
+            with mock.patch("core.mail.timezone.now", return_value=now):
+                mail.drain_outbox(FailingBackend())
+                # Not due again until the backoff has passed
+                self.assertEqual(mail.drain_outbox(FailingBackend())["retried"], 0)
+
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, attempt)
+            self.assertEqual(email.last_error, "provider down")
+            if attempt < mail.MAX_ATTEMPTS:
+                self.assertEqual(email.status, OutboundEmail.PENDING)
+                self.assertEqual(
+                    email.send_after - now,
+                    datetime.timedelta(minutes=2 ** (attempt - 1)),
+                )
+                now = email.send_after
+
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+
+    @override_settings(EMAIL_OUTBOX_ADMIN_DIGEST=True)
+    def test_admin_digest(self):
+        """Test admin notifications wait for the digest and go out as one."""
+        mail.queue_admin_email("Slip 1", "<p>First</p>")
+        mail.queue_admin_email("Slip 2", "<p>Second</p>")
+        mail.queue_email("user@example.com", "Results", "<p>Results</p>")
+
+        self.assertEqual(mail.drain_outbox()["sent"], 1)
+        self.assertEqual(mail.send_admin_digest(), 2)
+
+        self.assertEqual(len(django_mail.outbox), 2)
+        digest = django_mail.outbox[1]
+        self.assertEqual(digest.to, [mail.ADMIN_EMAIL])
+        self.assertIn("2 notifications", digest.subject)
+        self.assertIn("First", digest.body)
+        self.assertIn("Second", digest.body)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT))
+
+
+class ResultsEmailTestCase(BaseDataMixin, TestCase):
+    """send_results_emails test cases."""
+
+    def setUp(self):
+        """Create yesterday's game with a graded line and today's game."""
+        self.create_base_data()
+        self.points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 15, 19))
+        self.yesterday = self.create_subline(game, "Yesterday", self.points)
+        self.grade(self.yesterday, 20)
+        today = self.create_game(pst(2021, 6, 16, 19))
+        self.create_subline(today, "Today", self.points, projected_value=12.5)
+        self.client = mock.Mock()
+
+    def send(self):
+        """Send the results for June 15th and return the sent messages."""
+        mail.send_results_emails(datetime.date(2021, 6, 16), client=self.client)
+        return [call.args[0].get() for call in self.client.send.call_args_list]
+
+    def create_players(self, start, stop):
+        """Create users with a winning and a losing slip yesterday."""
+        for i in range(start, stop):
+            owner = self.create_user(email=f"user{i}@example.com", first_name=f"U{i}")
+            self.create_slip(owner, [(self.yesterday, False), (self.yesterday, False)])
+            self.create_slip(owner, [(self.yesterday, True), (self.yesterday, False)])
+
+    def test_results_emails(self):
+        """Test each player gets one personalization with their slips."""
+        self.create_players(0, 2)
+
+        [message] = self.send()
+
+        self.assertEqual(message["template_id"], mail.RESULTS_TEMPLATE_ID)
+        self.assertEqual(
+            [p["to"][0]["email"] for p in message["personalizations"]],
+            ["user0@example.com", "user1@example.com"],
+        )
+        data = message["personalizations"][0]["dynamic_template_data"]
+        self.assertEqual(data["subject"], "Underline Results for June 15th")
+        self.assertEqual(
+            data["slips"],
+            [
+                {"numPicks": 2, "payoutAmount": "$30", "outcome": "Won"},
+                {"numPicks": 2, "payoutAmount": "$30", "outcome": "Lost"},
+            ],
+        )
+        self.assertEqual(data["todayLines"][0]["projection"], "12.5 Points")
+
+    def test_batches_and_query_count(self):
+        """Test recipients are split across requests at a constant query cost."""
+        self.create_players(0, 1)
+        with CaptureQueriesContext(connection) as one:
+            self.send()
+
+        self.create_players(1, 6)
+        self.client.reset_mock()
+        with mock.patch.object(mail, "PERSONALIZATIONS_PER_REQUEST", 4):
+            with CaptureQueriesContext(connection) as many:
+                messages = self.send()
+
+        self.assertEqual(len(one), len(many))
+        self.assertEqual([len(m["personalizations"]) for m in messages], [4, 2])
+
+    def test_rejected_recipient(self):
+        """Test a rejected recipient is split out and logged, not the batch."""
+        self.create_players(0, 5)
+
+        def send(message):
+            emails = [p["to"][0]["email"] for p in message.get()["personalizations"]]
+            if "user2@example.com" in emails:
+                raise BadRequestsError(400, "Bad Request", b"", {})
+
+        self.client.send.side_effect = send
+        with mock.patch.object(mail, "PERSONALIZATIONS_PER_REQUEST", 4):
+            with self.assertLogs("core.mail", "ERROR") as logs:
+                report = mail.send_results_emails(
+                    datetime.date(2021, 6, 16), client=self.client
+                )
+
+        self.assertEqual(report["failed"], 1)
+        self.assertIn("user2@example.com", logs.output[0])
+        sent = [
+            [p["to"][0]["email"] for p in call.args[0].get()["personalizations"]]
+            for call in self.client.send.call_args_list
+        ]
+        self.assertEqual(
+            [emails for emails in sent if "user2@example.com" not in emails],
+            [
+                ["user0@example.com", "user1@example.com"],
+                ["user3@example.com"],
+                ["user4@example.com"],
+            ],
+        )
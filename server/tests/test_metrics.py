@@ -0,0 +1,118 @@
+"""GraphQL metrics tests."""
+
+import datetime
+import json
+
+from django.test import TestCase, override_settings
+
+from core.models import CurrentDate
+from underline.graphql import metrics
+
+
+class HistogramTestCase(TestCase):
+    """Histogram test cases."""
+
+    def test_render(self):
+        """Test buckets are cumulative and label values escaped."""
+        histogram = metrics.Histogram("h", "Help.", ["operation"], (1, 5))
+        for value in (0, 1, 3, 7):
+            histogram.observe(value, 'say "hi"')
+
+        self.assertEqual(
+            histogram.render().splitlines(),
+            [
+                "# HELP h Help.",
+                "# TYPE h histogram",
+                'h_bucket{operation="say \\"hi\\"",le="1"} 2',
+                'h_bucket{operation="say \\"hi\\"",le="5"} 3',
+                'h_bucket{operation="say \\"hi\\"",le="+Inf"} 4',
+                'h_sum{operation="say \\"hi\\""} 11',
+                'h_count{operation="say \\"hi\\""} 4',
+            ],
+        )
+
+
+class MetricsTestCase(TestCase):
+    """GraphQL operation metrics test cases."""
+
+    def setUp(self):
+        """Start from empty histograms."""
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def post(self, query, **extra):
+        """POST a query to /gql and return the decoded body."""
+        response = self.client.post(
+            "/gql",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            secure=True,
+            **extra,
+        )
+        return response.json()
+
+    def count(self, histogram, *labels):
+        """The number of observations `histogram` has for `labels`."""
+        return {
+            sample_labels: value
+            for suffix, sample_labels, value in histogram.samples()
+            if suffix == "_count"
+        }.get(labels, 0)
+
+    def test_operation_and_fields(self):
+        """Test operations are recorded by name and top-level field."""
+        self.post("query Today { currentDate }")
+        self.post("query Today { today: currentDate }")
+        self.post("{ currentDate }")
+
+        self.assertEqual(self.count(metrics.OPERATION_SECONDS, "Today"), 2)
+        self.assertEqual(self.count(metrics.OPERATION_QUERIES, "anonymous"), 1)
+        self.assertEqual(self.count(metrics.FIELD_QUERIES, "Today", "currentDate"), 2)
+        sample = ("_sum", ("Today", "currentDate"), 2)
+        self.assertIn(sample, list(metrics.FIELD_QUERIES.samples()))
+
+    @override_settings(DEBUG=True)
+    def test_metrics_endpoint(self):
+        """Test /metrics serves the histograms in the Prometheus format."""
+        self.post("query Today { currentDate }")
+        response = self.client.get("/metrics", secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn("# TYPE graphql_operation_duration_seconds histogram", body)
+        self.assertIn('graphql_operation_sql_queries_count{operation="Today"} 1', body)
+        self.assertIn(
+            'graphql_field_sql_queries_sum{operation="Today",field="currentDate"} 1',
+            body,
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        """Test /metrics requires the bearer token when one is set."""
+        self.assertEqual(self.client.get("/metrics", secure=True).status_code, 401)
+        response = self.client.get(
+            "/metrics", secure=True, HTTP_AUTHORIZATION="Bearer wrong"
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            "/metrics", secure=True, HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_metrics_without_token(self):
+        """Test /metrics is closed outside DEBUG when no token is set."""
+        self.assertEqual(self.client.get("/metrics", secure=True).status_code, 403)
+
+    @override_settings(GRAPHQL_QUERY_BUDGET=0)
+    def test_query_budget(self):
+        """Test an operation over the query budget is logged."""
+        with self.assertLogs("underline.graphql.metrics", "WARNING") as logs:
+            self.post("query Today { currentDate }")
+
+        report = json.loads(logs.records[0].args[0])
+        self.assertEqual(report["operation"], "Today")
+        self.assertEqual(report["budget"], 0)
+        self.assertEqual(report["queries"], 1)
+        self.assertEqual(report["fields"]["currentDate"]["queries"], 1)
@@ -0,0 +1,130 @@
+"""Persisted query and document cache tests."""
+
+import datetime
+import json
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core.models import CurrentDate
+from underline.graphql import persisted
+
+
+QUERY = "{ currentDate }"
+SHA256 = persisted.query_hash(QUERY)
+
+
+class PersistedQueryTestCase(TestCase):
+    """GraphQLView persisted query test cases."""
+
+    def setUp(self):
+        """Start from empty query and document caches."""
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        cache.clear()
+        patcher = mock.patch.object(persisted, "_backend", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        persisted.get_allowlist.cache_clear()
+
+    def post(self, query=None, sha256=SHA256):
+        """POST to /gql, optionally by hash, and return the decoded body."""
+        body = {}
+        if query:
+            body["query"] = query
+        if sha256:
+            body["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": sha256}
+            }
+        response = self.client.post(
+            "/gql", json.dumps(body), content_type="application/json", secure=True
+        )
+        return response.json()
+
+    def test_register_then_hash(self):
+        """Test a miss asks for the query, which registers the hash."""
+        self.assertEqual(
+            self.post(), {"errors": [{"message": persisted.PERSISTED_QUERY_NOT_FOUND}]}
+        )
+        self.assertEqual(self.post(QUERY), {"data": {"currentDate": "2021-06-16"}})
+        self.assertEqual(self.post(), {"data": {"currentDate": "2021-06-16"}})
+
+    def test_registered_queries_expire(self):
+        """Test a registered query is kept for the configured time."""
+        with mock.patch.object(persisted.cache, "set") as cache_set:
+            self.post(QUERY)
+        cache_set.assert_called_once_with(
+            persisted.PERSISTED_QUERY_KEY.format(SHA256), QUERY, 30 * 24 * 60 * 60
+        )
+
+    def test_only_valid_queries_register(self):
+        """Test invalid and oversized queries run but aren't registered."""
+        for query in ("{ noSuchField }", "{ currentDate ", QUERY + " " * 10000):
+            sha256 = persisted.query_hash(query)
+            self.post(query, sha256=sha256)
+            self.assertEqual(
+                self.post(sha256=sha256),
+                {"errors": [{"message": persisted.PERSISTED_QUERY_NOT_FOUND}]},
+            )
+
+    def test_hash_mismatch(self):
+        """Test a query that doesn't match its hash is rejected."""
+        result = self.post("{ currentDate me { id } }")
+        self.assertEqual(
+            result["errors"][0]["message"], "provided sha does not match query"
+        )
+
+    def test_documents_parsed_once(self):
+        """Test repeat queries skip parsing and validation."""
+        with mock.patch(
+            "underline.graphql.persisted.parse", wraps=persisted.parse
+        ) as parse, mock.patch(
+            "underline.graphql.persisted.validate", wraps=persisted.validate
+        ) as validate:
+            for i in range(3):
+                self.assertEqual(
+                    self.post(QUERY, sha256=None)["data"]["currentDate"], "2021-06-16"
+                )
+
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_invalid_documents_not_cached(self):
+        """Test validation errors are returned and not cached."""
+        for i in range(2):
+            result = self.post("{ noSuchField }", sha256=None)
+            self.assertIn("noSuchField", result["errors"][0]["message"])
+        self.assertEqual(len(persisted.get_backend().documents), 0)
+
+    def test_lru_eviction(self):
+        """Test the least recently used document is evicted first."""
+        lru = persisted.LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+    def test_allowlist(self):
+        """Test only manifest operations run in allow-list mode."""
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as manifest:
+            json.dump({SHA256: QUERY}, manifest)
+            manifest.flush()
+
+            with override_settings(GRAPHQL_QUERY_ALLOWLIST=manifest.name):
+                self.assertEqual(self.post(), {"data": {"currentDate": "2021-06-16"}})
+                self.assertEqual(
+                    self.post(QUERY, sha256=None),
+                    {"data": {"currentDate": "2021-06-16"}},
+                )
+
+                other = "{ currentDate  }"
+                for result in (
+                    self.post(other, sha256=None),
+                    self.post(other, sha256=persisted.query_hash(other)),
+                ):
+                    self.assertEqual(
+                        result["errors"][0]["message"],
+                        persisted.PERSISTED_QUERY_NOT_ALLOWED,
+                    )
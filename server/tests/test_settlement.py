@@ -0,0 +1,138 @@
+"""Settlement tests."""
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from core.models import LineCategory, Line, Slip, Pick
+from core.settlement import settle_lines
+from tests.utils import BaseDataMixin, pst
+
+
+class SettleLinesTestCase(BaseDataMixin, TestCase):
+    """settle_lines test cases."""
+
+    def setUp(self):
+        """Create a two pick slip."""
+        self.create_base_data()
+        self.user = self.create_user()
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.under = self.create_subline(game, "Under", points, projected_value=20)
+        self.over = self.create_subline(game, "Over", points, projected_value=5)
+        self.slip = self.create_slip(
+            self.user, [(self.under, True), (self.over, False)]
+        )
+        self.lines = [self.under.line_id, self.over.line_id]
+
+    def set_results(self, under_value, over_value):
+        """Write results without going through Line.save."""
+        Line.objects.filter(id=self.under.line_id).update(actual_value=under_value)
+        Line.objects.filter(id=self.over.line_id).update(actual_value=over_value)
+
+    def assertWallet(self, amount):
+        """Assert the user's wallet balance."""
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.wallet_balance, amount)
+
+    def test_credits_winnings(self):
+        """Test a won slip credits its payout."""
+        self.set_results(10, 10)
+        report = settle_lines(self.lines)
+
+        self.slip.refresh_from_db()
+        self.assertEqual(self.slip.status, Slip.WON)
+        self.assertEqual(self.slip.paid_out, 30)
+        self.assertEqual(report["credited"], 30)
+        self.assertWallet(30)
+
+    def test_idempotent(self):
+        """Test settling the same lines twice credits once."""
+        self.set_results(10, 10)
+        settle_lines(self.lines)
+        report = settle_lines(self.lines)
+
+        self.assertEqual(report["credited"], 0)
+        self.assertWallet(30)
+
+    def test_corrected_result_claws_back(self):
+        """Test a corrected result reverses the credit."""
+        self.set_results(10, 10)
+        settle_lines(self.lines)
+        self.set_results(10, 1)
+        settle_lines(self.lines)
+
+        self.slip.refresh_from_db()
+        self.assertEqual(self.slip.status, Slip.LOST)
+        self.assertWallet(0)
+
+    def test_line_save_settles(self):
+        """Test grading a line through the admin path settles slips."""
+        self.grade(self.under, 10)
+        self.grade(self.over, 10)
+        self.assertWallet(30)
+
+
+class SettleLinesBenchmark(BaseDataMixin, TestCase):
+    """A full slate should settle in a bounded number of queries."""
+
+    SLIPS = 10000
+
+    def test_slate(self):
+        """Test settling a 10k slip slate."""
+        self.create_base_data()
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        sublines = [
+            self.create_subline(game, f"Player {i}", points, projected_value=10)
+            for i in range(5)
+        ]
+        # Re-read after bulk_create, which doesn't set pks on every backend
+        User.objects.bulk_create(
+            User(email=f"user{i}@example.com") for i in range(self.SLIPS // 10)
+        )
+        users = list(User.objects.all())
+        # Every stake from 1 to 100, so payouts and wallet totals vary
+        Slip.objects.bulk_create(
+            Slip(owner=users[i % len(users)], entry_amount=1 + i % 100, num_picks=2)
+            for i in range(self.SLIPS)
+        )
+        slips = list(Slip.objects.order_by("id"))
+        Pick.objects.bulk_create(
+            Pick(slip=slip, subline=sublines[(i + j) % 5], under=bool(i % 2))
+            for i, slip in enumerate(slips)
+            for j in range(2)
+        )
+        Line.objects.filter(subline__in=sublines).update(actual_value=15)
+        line_ids = [s.line_id for s in sublines]
+
+        with CaptureQueriesContext(connection) as queries:
+            report = settle_lines(line_ids)
+
+        # Overs win: the even slips pay three times their stake
+        self.assertEqual(report["slips"], self.SLIPS)
+        self.assertEqual(
+            report["credited"],
+            sum(3 * (1 + i % 100) for i in range(0, self.SLIPS, 2)),
+        )
+        self.assertEqual(Slip.objects.filter(status=Slip.WON).count(), self.SLIPS // 2)
+        self.assertEqual(
+            User.objects.aggregate(total=Sum("wallet_balance"))["total"],
+            report["credited"],
+        )
+
+        # However varied the stakes, each batch of 1000 slips is read with
+        # two queries and written 500 rows a statement, or fewer for the
+        # ledger insert under SQLite's parameter limit
+        batches = self.SLIPS // 1000
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        self.assertLessEqual(len(statements), 1 + 10 * batches)
+
+        # Settling again writes nothing: one lookup of the affected slips,
+        # then a slip and a pick read per batch of 1000.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(settle_lines(line_ids)["credited"], 0)
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 1 + 2 * (self.SLIPS // 1000))
@@ -0,0 +1,225 @@
+"""Slip status and slip creation tests."""
+
+import datetime
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.models import (
+    CurrentDate,
+    DailyExposure,
+    LineCategory,
+    OutboundEmail,
+    Pick,
+    Slip,
+    WalletTransaction,
+)
+from tests.utils import BaseDataMixin, graphql_context, pst
+from underline.schema import schema
+
+
+SLIPS_QUERY = """
+    query {
+        activeSlips {
+            id
+        }
+        completeSlips {
+            id
+            payoutAmount
+            won
+            complete
+            invalidated
+        }
+    }
+"""
+
+
+CREATE_SLIP_MUTATION = """
+    mutation createSlip($picks: [PickType]!, $entryAmount: Int!) {
+        createSlip(picks: $picks, entryAmount: $entryAmount, creatorCode: "") {
+            success
+        }
+    }
+"""
+
+
+class SlipStatusTestCase(BaseDataMixin, TestCase):
+    """Denormalized slip status test cases."""
+
+    def setUp(self):
+        """Create a slip with an under pick and an over pick."""
+        self.create_base_data()
+        self.user = self.create_user()
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.ungraded = self.create_subline(game, "Ungraded", points)
+        self.under = self.create_subline(game, "Under", points, projected_value=20)
+        self.over = self.create_subline(game, "Over", points, projected_value=5)
+        self.slip = self.create_slip(
+            self.user, [(self.under, True), (self.over, False)]
+        )
+
+    def assertStatus(self, status, num_picks_won, payout):
+        """Assert the persisted status columns of the slip."""
+        self.slip.refresh_from_db()
+        self.assertEqual(self.slip.status, status)
+        self.assertEqual(self.slip.num_picks, 2)
+        self.assertEqual(self.slip.num_picks_won, num_picks_won)
+        self.assertEqual(self.slip.payout, payout)
+
+    def test_incomplete_until_every_line_graded(self):
+        """Test a partially graded slip stays incomplete."""
+        self.assertStatus(Slip.INCOMPLETE, 0, 0)
+        self.grade(self.under, 10)
+        self.assertStatus(Slip.INCOMPLETE, 1, 0)
+
+    def test_won(self):
+        """Test a slip with every pick right pays out."""
+        self.grade(self.under, 10)
+        self.grade(self.over, 10)
+        self.assertStatus(Slip.WON, 2, 30)
+
+    def test_lost(self):
+        """Test a slip with a wrong pick is lost."""
+        self.grade(self.under, 25)
+        self.grade(self.over, 10)
+        self.assertStatus(Slip.LOST, 1, 0)
+
+    def test_invalidated(self):
+        """Test an invalidated line invalidates the slip."""
+        self.grade(self.under, 10)
+        self.grade(self.over, invalidated=True)
+        self.assertStatus(Slip.INVALIDATED, 1, 0)
+
+    def test_regrade(self):
+        """Test correcting a result regrades the slip."""
+        self.grade(self.under, 10)
+        self.grade(self.over, 10)
+        self.grade(self.over, 1)
+        self.assertStatus(Slip.LOST, 1, 0)
+
+    def test_active_and_complete_slips(self):
+        """Test the slip lists filter on status without per-slip queries."""
+        for i in range(5):
+            self.create_slip(self.user, [(self.under, True), (self.over, True)])
+        self.grade(self.under, 10)
+        self.grade(self.over, 10)
+        active = self.create_slip(
+            self.user, [(self.under, True), (self.ungraded, True)]
+        )
+
+        with self.assertNumQueries(2):
+            result = schema.execute(SLIPS_QUERY, context=graphql_context(self.user))
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["activeSlips"], [{"id": str(active.id)}])
+        complete = result.data["completeSlips"]
+        self.assertEqual(len(complete), 6)
+        self.assertEqual(
+            [s for s in complete if s["won"]],
+            [
+                {
+                    "id": str(self.slip.id),
+                    "payoutAmount": 30,
+                    "won": True,
+                    "complete": True,
+                    "invalidated": False,
+                }
+            ],
+        )
+
+
+class CreateSlipTestCase(BaseDataMixin, TestCase):
+    """createSlip mutation test cases."""
+
+    def setUp(self):
+        """Create four sublines on a game that hasn't started."""
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.sublines = [
+            self.create_subline(game, f"Player {i}", points) for i in range(4)
+        ]
+        self.user = self.create_user(wallet_balance=100)
+
+        clock = mock.patch("core.models.tz.now", return_value=pst(2021, 6, 16, 12))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def create_slip_mutation(self, sublines, entry_amount=10):
+        """Submit a slip with an under pick on each subline."""
+        result = schema.execute(
+            CREATE_SLIP_MUTATION,
+            variables={
+                "picks": [{"id": s.id, "under": True} for s in sublines],
+                "entryAmount": entry_amount,
+            },
+            context=graphql_context(self.user),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["createSlip"]["success"]
+
+    def assertWalletBalance(self, balance):
+        """Assert the user's stored wallet balance."""
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.wallet_balance, balance)
+
+    def test_create_slip(self):
+        """Test the slip is created graded and the entry debited."""
+        self.assertTrue(self.create_slip_mutation(self.sublines[:2]))
+
+        slip = Slip.objects.get()
+        self.assertEqual(
+            (slip.status, slip.num_picks, slip.entry_amount),
+            (Slip.INCOMPLETE, 2, 10),
+        )
+        self.assertEqual(
+            set(Pick.objects.values_list("subline_id", flat=True)),
+            {s.id for s in self.sublines[:2]},
+        )
+        self.assertWalletBalance(90)
+        self.assertEqual(
+            list(WalletTransaction.objects.values_list("kind", "amount", "slip")),
+            [(WalletTransaction.ENTRY, -10, slip.id)],
+        )
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.PENDING)
+        self.assertTrue(email.digest)
+        self.assertIn("Wallet balance after: 90", email.html_content)
+
+    def test_insufficient_funds(self):
+        """Test a slip the wallet can't cover is rejected untouched."""
+        self.user.wallet_balance = 5
+        self.user.save()
+
+        self.assertFalse(self.create_slip_mutation(self.sublines[:2]))
+        self.assertFalse(Slip.objects.exists())
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertWalletBalance(5)
+        self.assertFalse(WalletTransaction.objects.exists())
+
+    def test_hidden_subline(self):
+        """Test a pick on a hidden subline rejects the slip without a debit."""
+        self.sublines[1].visible = False
+        self.sublines[1].save()
+
+        self.assertFalse(self.create_slip_mutation(self.sublines[:2]))
+        self.assertFalse(Slip.objects.exists())
+        self.assertWalletBalance(100)
+
+    def test_query_count_is_constant(self):
+        """Test a four pick slip costs the same queries as a two pick one."""
+        # The day's first slip also starts the user's exposure counter
+        DailyExposure.objects.create(user=self.user, date=datetime.date(2021, 6, 16))
+        counts = []
+        for sublines in (self.sublines[:2], self.sublines):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(self.create_slip_mutation(sublines))
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertWalletBalance(80)
@@ -0,0 +1,176 @@
+"""Player stat ingestion tests."""
+
+import datetime
+import decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.models import CurrentDate, LineCategory, Line, Player, Team
+from core.stats import ingest_player_stats
+from core.tasks import LAST_STATS_POLL_KEY, update_player_scores
+from tests.utils import BaseDataMixin, pst
+
+
+def record(
+    name, points=None, rebounds=None, assists=None, fantasy_points=None, final=True
+):
+    """Build a SportsData PlayerGameStatsByDate record."""
+    return {
+        "Name": name,
+        "Points": points,
+        "Rebounds": rebounds,
+        "Assists": assists,
+        "FantasyPoints": fantasy_points,
+        "IsGameOver": final,
+    }
+
+
+class IngestPlayerStatsTestCase(BaseDataMixin, TestCase):
+    """ingest_player_stats test cases."""
+
+    def setUp(self):
+        """Create lines in every category for two players."""
+        self.create_base_data()
+        self.day = datetime.date(2021, 6, 16)
+        game = self.create_game(pst(2021, 6, 16, 19))
+        self.categories = [
+            LineCategory.objects.create(league=self.nba, category=category)
+            for category in ("Points", "Rebounds", "Assists", "Fantasy Points")
+        ]
+        for name in ("LeBron James", "Anthony Davis"):
+            for category in self.categories:
+                self.create_subline(game, name, category)
+
+        # Same player name tomorrow shouldn't be touched
+        self.tomorrow = self.create_subline(
+            self.create_game(pst(2021, 6, 17, 19)), "LeBron James", self.categories[0]
+        )
+
+    def test_ingest(self):
+        """Test matched lines are written and unmatched records counted."""
+        idle = Team.objects.create(
+            name="Nets",
+            abbreviation="BKN",
+            location="Brooklyn",
+            logo_url="",
+            league=self.nba,
+        )
+        Player.objects.create(name="Not Playing", team=idle)
+
+        records = [
+            record("LeBron James", 25, 7, 8, 48.25),
+            record("Anthony Davis", 30),
+            record("Not Playing", 10),
+            record("Unknown Player", 10),
+        ]
+        with self.assertNumQueries(4):
+            line_ids, report = ingest_player_stats(records, self.day)
+
+        self.assertEqual(
+            report,
+            {
+                "records": 4,
+                "matched": 2,
+                "in_progress": 0,
+                "unmatched": 2,
+                "unchanged": 3,
+                "updated": 5,
+            },
+        )
+        values = dict(
+            Line.objects.filter(id__in=line_ids)
+            .values_list("category__category", "actual_value")
+            .filter(player__name="LeBron James")
+        )
+        self.assertEqual(
+            values,
+            {
+                "Points": 25,
+                "Rebounds": 7,
+                "Assists": 8,
+                "Fantasy Points": decimal.Decimal("48.25"),
+            },
+        )
+        self.assertIsNone(Line.objects.get(subline=self.tomorrow).actual_value)
+
+    def test_only_changed_lines_are_written(self):
+        """Test polling the same stats again writes nothing."""
+        ingest_player_stats([record("LeBron James", 25, 7, 8, 48.25)], self.day)
+
+        with self.assertNumQueries(3):
+            line_ids, report = ingest_player_stats(
+                [record("LeBron James", 25, 7, 8, 48.25)], self.day
+            )
+        self.assertEqual(line_ids, [])
+        self.assertEqual(report["unchanged"], 4)
+
+        line_ids, report = ingest_player_stats(
+            [record("LeBron James", 27, 7, 8, 50.25)], self.day
+        )
+        self.assertEqual(report["updated"], 2)
+        self.assertEqual(
+            set(
+                Line.objects.filter(id__in=line_ids).values_list(
+                    "category__category", flat=True
+                )
+            ),
+            {"Points", "Fantasy Points"},
+        )
+
+    def test_games_in_progress_are_not_graded(self):
+        """Test stats from a game still going are only kept as live values."""
+        lebron = Line.objects.filter(
+            player__name="LeBron James", game__datetime=pst(2021, 6, 16, 19)
+        )
+
+        line_ids, report = ingest_player_stats(
+            [record("LeBron James", 12, 3, 4, 20, final=False)], self.day
+        )
+        self.assertEqual((line_ids, report["in_progress"]), ([], 1))
+        self.assertEqual(
+            set(lebron.values_list("live_value", "actual_value")),
+            {(12, None), (3, None), (4, None), (20, None)},
+        )
+
+        line_ids, report = ingest_player_stats(
+            [record("LeBron James", 25, 3, 8, 40)], self.day
+        )
+        self.assertEqual(sorted(line_ids), sorted(lebron.values_list("id", flat=True)))
+        self.assertEqual(
+            set(lebron.values_list("live_value", "actual_value")),
+            {(25, 25), (3, 3), (8, 8), (40, 40)},
+        )
+
+
+class UpdatePlayerScoresTestCase(BaseDataMixin, TestCase):
+    """update_player_scores polling test cases."""
+
+    def setUp(self):
+        """Create tonight's game and clear the last poll time."""
+        cache.delete(LAST_STATS_POLL_KEY)
+        self.create_base_data()
+        CurrentDate.objects.create(date=datetime.date(2021, 6, 16))
+        self.create_game(pst(2021, 6, 16, 19))
+
+    def poll(self, now, **kwargs):
+        """Run the task at `now` and return whether it hit SportsData."""
+        with mock.patch("core.tasks.tz.now", return_value=now), mock.patch(
+            "core.tasks.requests.get"
+        ) as get:
+            get.return_value.json.return_value = []
+            update_player_scores(**kwargs)
+        return get.called
+
+    def test_polls_every_run_while_live(self):
+        """Test every run polls while a game is in progress."""
+        self.assertTrue(self.poll(pst(2021, 6, 16, 20)))
+        self.assertTrue(self.poll(pst(2021, 6, 16, 20, 2)))
+
+    def test_backs_off_when_idle(self):
+        """Test runs are skipped for an hour when nothing is live."""
+        self.assertTrue(self.poll(pst(2021, 6, 16, 12)))
+        self.assertFalse(self.poll(pst(2021, 6, 16, 12, 30)))
+        self.assertTrue(self.poll(pst(2021, 6, 16, 12, 30), force=True))
+        self.assertTrue(self.poll(pst(2021, 6, 16, 13, 31)))
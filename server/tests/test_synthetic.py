@@ -0,0 +1,116 @@
+"""Synthetic dataset and benchmark tests."""
+
+import datetime
+
+from django.test import TestCase
+
+from accounts.models import User
+from core import benchmarks
+from core.models import CurrentDate, Game, Line, Pick, Slip
+from core.synthetic import generate_dataset
+from tests.test_admin import PLAIN_STATIC
+from tests.utils import pst
+
+TODAY = datetime.date(2022, 1, 12)
+
+
+def generate():
+    """Generate a small dataset: one season, two players a team."""
+    return generate_dataset(
+        users=20, slips=300, players_per_team=2, games_per_team=12, today=TODAY
+    )
+
+
+class GenerateDatasetTestCase(TestCase):
+    """generate_dataset test cases."""
+
+    def test_generate(self):
+        """Test the counts asked for are generated around the system date."""
+        report = generate()
+
+        self.assertEqual(report["games"], 180)
+        self.assertEqual(report["lines"], 180 * 4 * 4)
+        self.assertEqual(report["users"], 20)
+        self.assertEqual(report["slips"], 300)
+        self.assertEqual(report["picks"], Pick.objects.count())
+        self.assertEqual(CurrentDate.objects.get().date, TODAY)
+        self.assertFalse(
+            Line.objects.filter(game__datetime__gte=pst(2022, 1, 12))
+            .exclude(actual_value=None)
+            .exists()
+        )
+        self.assertFalse(
+            Line.objects.filter(
+                game__datetime__lt=pst(2022, 1, 12), actual_value=None
+            ).exists()
+        )
+
+    def test_slips_settled(self):
+        """Test slips are stored as settlement would leave them."""
+        generate()
+        stored = list(
+            Slip.objects.order_by("id").values_list(*Slip.GRADED_FIELDS, "paid_out")
+        )
+        self.assertTrue(any(row[0] == Slip.WON for row in stored))
+        self.assertFalse(
+            Slip.objects.filter(
+                status=Slip.INCOMPLETE, datetime_created__lt=pst(2022, 1, 12)
+            ).exists()
+        )
+
+        Slip.objects.order_by("id").refresh_status()
+        self.assertEqual(
+            list(Slip.objects.order_by("id").values_list(*Slip.GRADED_FIELDS)),
+            [row[:-1] for row in stored],
+        )
+        self.assertTrue(all(row[-2] == row[-1] for row in stored))
+
+    def test_existing_data(self):
+        """Test a database that already has games is refused."""
+        generate()
+        with self.assertRaises(ValueError):
+            generate()
+
+
+@PLAIN_STATIC
+class BenchmarkTestCase(TestCase):
+    """Benchmark test cases."""
+
+    def test_run_benchmarks(self):
+        """Test every benchmark runs and leaves the dataset as it was."""
+        generate()
+        size = benchmarks.dataset_size()
+        balances = list(User.objects.order_by("id").values_list("wallet_balance"))
+        tip_offs = list(Game.objects.order_by("id").values_list("datetime"))
+
+        for benchmark in benchmarks.BENCHMARKS:
+            result = benchmarks.run_benchmark(benchmark(), repeat=1)
+            self.assertGreater(result["queries"], 0, benchmark.name)
+
+        self.assertEqual(benchmarks.dataset_size(), size)
+        self.assertEqual(
+            list(User.objects.order_by("id").values_list("wallet_balance")), balances
+        )
+        self.assertEqual(
+            list(Game.objects.order_by("id").values_list("datetime")), tip_offs
+        )
+
+    def test_regressions(self):
+        """Test slower and chattier results are flagged."""
+        baseline = {
+            "results": {
+                "fast": {"seconds": 1.0, "queries": 3},
+                "slow": {"seconds": 1.0, "queries": 3},
+                "chatty": {"seconds": 1.0, "queries": 3},
+            }
+        }
+        results = {
+            "fast": {"seconds": 1.2, "queries": 2},
+            "slow": {"seconds": 1.3, "queries": 3},
+            "chatty": {"seconds": 0.5, "queries": 4},
+            "new": {"seconds": 9.0, "queries": 9},
+        }
+        self.assertEqual(
+            benchmarks.regressions(results, baseline),
+            {"slow": ["1.0s -> 1.3s"], "chatty": ["3 -> 4 queries"]},
+        )
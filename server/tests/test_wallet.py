@@ -0,0 +1,204 @@
+"""Wallet ledger tests."""
+
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from core import tasks, wallet
+from core.models import Deposit, LineCategory, WalletCheckpoint, WalletTransaction
+from core.settlement import settle_lines
+from tests.test_admin import PLAIN_STATIC, AdminTestMixin
+from tests.utils import BaseDataMixin, graphql_context, pst
+from underline.schema import schema
+
+RECORD_DEPOSIT_MUTATION = """
+    mutation recordDeposit($amount: Float!) {
+        recordDeposit(amount: $amount, transactionDetails: "{}", orderDetails: "{}") {
+            success
+        }
+    }
+"""
+
+
+class WalletTestCase(BaseDataMixin, TestCase):
+    """Wallet ledger test cases."""
+
+    def setUp(self):
+        """Create a user with a $50 opening balance."""
+        self.user = self.create_user()
+        wallet.post(self.user.id, WalletTransaction.OPENING, 50)
+
+    def assertWallet(self, balance, *transactions):
+        """Assert the balance and the (kind, amount) ledger rows."""
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.wallet_balance, balance)
+        self.assertEqual(
+            list(
+                WalletTransaction.objects.filter(user=self.user)
+                .order_by("id")
+                .values_list("kind", "amount")
+            ),
+            [(WalletTransaction.OPENING, 50), *transactions],
+        )
+
+    def test_post(self):
+        """Test a posting moves the balance and is appended to the ledger."""
+        self.assertTrue(wallet.post(self.user.id, WalletTransaction.ADJUSTMENT, -20))
+        self.assertWallet(30, (WalletTransaction.ADJUSTMENT, -20))
+
+    def test_require_funds(self):
+        """Test a debit the balance can't cover is refused."""
+        self.assertFalse(
+            wallet.post(self.user.id, WalletTransaction.ENTRY, -60, require_funds=True)
+        )
+        self.assertWallet(50)
+
+    def test_me_reads_balance(self):
+        """Test me reads the balance without touching the ledger."""
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                "{ me { walletBalance } }",
+                context=graphql_context(User.objects.get(id=self.user.id)),
+            )
+        self.assertEqual(result.data, {"me": {"walletBalance": "50.00"}})
+        self.assertFalse(any("wallettransaction" in query["sql"] for query in queries))
+
+    def test_record_deposit(self):
+        """Test a deposit is posted against its Deposit row."""
+        result = schema.execute(
+            RECORD_DEPOSIT_MUTATION,
+            variables={"amount": 25.5},
+            context=graphql_context(self.user),
+        )
+        self.assertIsNone(result.errors)
+
+        deposit = Deposit.objects.get()
+        self.assertWallet(75.5, (WalletTransaction.DEPOSIT, 25.5))
+        self.assertEqual(WalletTransaction.objects.last().deposit, deposit)
+
+    def test_settlement_payouts(self):
+        """Test each change in a slip's payout is its own ledger row."""
+        self.create_base_data()
+        points = LineCategory.objects.create(league=self.nba, category="Points")
+        game = self.create_game(pst(2021, 6, 16, 19))
+        sublines = [self.create_subline(game, f"Player {i}", points) for i in (1, 2)]
+        slip = self.create_slip(self.user, [(sublines[0], True), (sublines[1], True)])
+
+        self.grade(sublines[0], 5)
+        self.grade(sublines[1], 5)
+        self.grade(sublines[1], 15)
+        settle_lines([s.line_id for s in sublines])
+
+        self.assertWallet(
+            50, (WalletTransaction.PAYOUT, 30), (WalletTransaction.PAYOUT, -30)
+        )
+        self.assertEqual(
+            set(WalletTransaction.objects.values_list("slip", flat=True)),
+            {None, slip.id},
+        )
+
+    def test_top_off(self):
+        """Test free to play wallets are topped up through the ledger."""
+        User.objects.filter(id=self.user.id).update(free_to_play=True)
+        full = self.create_user(email="full@example.com", free_to_play=True)
+        wallet.post(full.id, WalletTransaction.OPENING, 100)
+
+        self.assertEqual(tasks.top_off_free_to_play_user_balances(), 1)
+        self.assertWallet(100, (WalletTransaction.TOP_OFF, 50))
+        self.assertEqual(full.wallettransaction_set.count(), 1)
+
+
+class CheckpointTestCase(BaseDataMixin, TestCase):
+    """Wallet checkpoint and reconciliation test cases."""
+
+    def setUp(self):
+        """Create three users with opening balances."""
+        self.users = [self.create_user(email=f"user{i}@example.com") for i in range(3)]
+        for user in self.users:
+            wallet.post(user.id, WalletTransaction.OPENING, 100)
+
+    def checkpoint(self):
+        """Checkpoint as if every transaction so far were old enough."""
+        return wallet.checkpoint_wallets(
+            timezone.now() + wallet.CHECKPOINT_LAG + datetime.timedelta(seconds=1)
+        )
+
+    def test_checkpoint(self):
+        """Test each run covers just the users whose ledgers moved."""
+        self.assertEqual(self.checkpoint()["users"], 3)
+        self.assertEqual(self.checkpoint()["users"], 0)
+
+        wallet.post(self.users[0].id, WalletTransaction.ADJUSTMENT, -40)
+        report = self.checkpoint()
+        self.assertEqual(report["users"], 1)
+        self.assertEqual(
+            WalletCheckpoint.objects.get(
+                last_transaction_id=report["last_transaction_id"]
+            ).balance,
+            60,
+        )
+
+    def test_recent_transactions_wait(self):
+        """Test transactions newer than the lag are left for the next run."""
+        self.assertEqual(wallet.checkpoint_wallets()["users"], 0)
+        self.assertFalse(WalletCheckpoint.objects.exists())
+
+    def test_ledger_balances(self):
+        """Test ledger balances add the ledger since the checkpoint."""
+        self.checkpoint()
+        wallet.post(self.users[1].id, WalletTransaction.DEPOSIT, 25)
+
+        ids = [user.id for user in self.users]
+        self.assertEqual(
+            wallet.ledger_balances(ids), {ids[0]: 100, ids[1]: 125, ids[2]: 100}
+        )
+
+    def test_reconcile(self):
+        """Test a balance changed outside the ledger is reported."""
+        self.checkpoint()
+        wallet.post(self.users[1].id, WalletTransaction.DEPOSIT, 25)
+        self.assertEqual(wallet.reconcile_wallets()["mismatches"], {})
+
+        User.objects.filter(id=self.users[2].id).update(wallet_balance=1)
+        with self.assertLogs("core.wallet", "ERROR"):
+            report = wallet.reconcile_wallets()
+        self.assertEqual(report["mismatches"], {self.users[2].id: (1, 100)})
+
+
+@PLAIN_STATIC
+class UserAdminTestCase(AdminTestMixin, TestCase):
+    """User admin wallet test cases."""
+
+    def test_balance_edit_is_an_adjustment(self):
+        """Test editing a balance in the changelist posts an adjustment."""
+        self.login()
+        user = self.create_user()
+        wallet.post(user.id, WalletTransaction.OPENING, 40)
+
+        response = self.client.post(
+            reverse("admin:accounts_user_changelist"),
+            {
+                "form-TOTAL_FORMS": "2",
+                "form-INITIAL_FORMS": "2",
+                "form-0-id": str(user.id),
+                "form-0-wallet_balance": "75",
+                "form-1-id": str(self.admin.id),
+                "form-1-wallet_balance": "0",
+                "_save": "Save",
+            },
+            secure=True,
+        )
+
+        self.assertEqual(response.status_code, 302)
+        user.refresh_from_db()
+        self.assertEqual(user.wallet_balance, 75)
+        self.assertEqual(
+            list(user.wallettransaction_set.values_list("kind", "amount")),
+            [(WalletTransaction.OPENING, 40), (WalletTransaction.ADJUSTMENT, 35)],
+        )
+        self.assertFalse(self.admin.wallettransaction_set.exists())
@@ -0,0 +1,82 @@
+"""Shared helpers for building test data."""
+
+import datetime
+
+from django.test import RequestFactory
+from pytz import timezone
+
+from accounts.models import User
+from core.models import League, Team, Game, Player, Line, Subline, Slip, Pick
+
+
+PST = timezone("US/Pacific")
+
+
+def pst(year, month, day, hour=0, minute=0):
+    """Return an aware datetime for the given PST wall-clock time."""
+    return PST.localize(datetime.datetime(year, month, day, hour, minute))
+
+
+class BaseDataMixin:
+    """Creates a league with two teams and helpers to schedule games."""
+
+    def create_base_data(self):
+        """Create the NBA league and two of its teams."""
+        self.nba = League.objects.create(acronym="NBA", long_name="NBA")
+        self.lakers = Team.objects.create(
+            name="Lakers",
+            abbreviation="LAL",
+            location="Los Angeles",
+            logo_url="",
+            league=self.nba,
+        )
+        self.celtics = Team.objects.create(
+            name="Celtics",
+            abbreviation="BOS",
+            location="Boston",
+            logo_url="",
+            league=self.nba,
+        )
+
+    def create_game(self, dt):
+        """Schedule a Celtics @ Lakers game at `dt`."""
+        return Game.objects.create(
+            league=self.nba,
+            home_team=self.lakers,
+            away_team=self.celtics,
+            datetime=dt,
+        )
+
+    def create_subline(self, game, name, category, projected_value=10, premier=False):
+        """Create a line and visible subline for the named home team player."""
+        player, created = Player.objects.get_or_create(
+            name=name, defaults={"team": game.home_team, "premier": premier}
+        )
+        line = Line.objects.create(player=player, game=game, category=category)
+        return Subline.objects.create(line=line, projected_value=projected_value)
+
+    def create_user(self, email="player@example.com", **kwargs):
+        """Create a user."""
+        return User.objects.create_user(email=email, password="password", **kwargs)
+
+    def create_slip(self, owner, picks, entry_amount=10):
+        """Create a slip with a pick per (subline, under) pair."""
+        slip = Slip.objects.create(owner=owner, entry_amount=entry_amount)
+        for subline, under in picks:
+            Pick.objects.create(slip=slip, subline=subline, under=under)
+        slip.refresh_status()
+        return slip
+
+    def grade(self, subline, actual_value=None, invalidated=False):
+        """Save a result on the subline's line, going through Line.save."""
+        line = Line.objects.get(id=subline.line_id)
+        line.actual_value = actual_value
+        line.invalidated = invalidated
+        line.save()
+
+
+def graphql_context(user):
+    """Return a request to execute GraphQL operations as `user`."""
+    request = RequestFactory().post("/graphql/")
+    request.user = user
+    return request
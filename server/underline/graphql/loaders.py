@@ -0,0 +1,87 @@
+import collections
+
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+# Loads model instances by primary key, one IN (...) query per batch
+class ModelLoader(DataLoader):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        instances = self.model.objects.in_bulk(keys)
+        return Promise.resolve([instances.get(key) for key in keys])
+
+
+# Loads the rows pointing at each key through a foreign key (a reverse FK
+# such as a slip's picks), one IN (...) query per batch
+class RelatedListLoader(DataLoader):
+    def __init__(self, model, field_name):
+        super().__init__()
+        self.model = model
+        self.field_name = field_name
+
+    def batch_load_fn(self, keys):
+        attname = self.model._meta.get_field(self.field_name).attname
+        instances = self.model.objects.filter(**{f"{attname}__in": keys})
+
+        rows = collections.defaultdict(list)
+        for instance in instances.order_by("id"):
+            rows[getattr(instance, attname)].append(instance)
+        return Promise.resolve([rows[key] for key in keys])
+
+
+# Loaders for one request. Each loader memoizes what it has loaded, so an
+# entity is fetched at most once per request however many times it's
+# reached.
+class Loaders:
+    def __init__(self):
+        self._loaders = {}
+
+    def model(self, model):
+        key = (model, None)
+        if key not in self._loaders:
+            self._loaders[key] = ModelLoader(model)
+        return self._loaders[key]
+
+    def related(self, model, field_name):
+        key = (model, field_name)
+        if key not in self._loaders:
+            self._loaders[key] = RelatedListLoader(model, field_name)
+        return self._loaders[key]
+
+
+def get_loaders(info):
+    context = info.context
+    # Executed without a request (shell, scripts): nothing to share with
+    if context is None:
+        return Loaders()
+    if not hasattr(context, "loaders"):
+        context.loaders = Loaders()
+    return context.loaders
+
+
+# Resolve `instance.<field_name>` through the request's loaders. Relations
+# already fetched with select_related are used as-is and primed into the
+# loader for anything else that points at them.
+def load_related(info, instance, field_name):
+    field = instance._meta.get_field(field_name)
+    loader = get_loaders(info).model(field.related_model)
+
+    if field.is_cached(instance):
+        related = getattr(instance, field_name)
+        if related is not None:
+            loader.prime(related.pk, related)
+        return Promise.resolve(related)
+
+    key = getattr(instance, field.attname)
+    if key is None:
+        return Promise.resolve(None)
+    return loader.load(key)
+
+
+# Resolve the `model` rows whose `field_name` points at `instance`
+def load_reverse(info, instance, model, field_name):
+    return get_loaders(info).related(model, field_name).load(instance.pk)
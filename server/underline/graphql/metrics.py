@@ -0,0 +1,250 @@
+import bisect
+import contextlib
+import json
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Label value used once a histogram has MAX_SERIES distinct label sets, so
+# clients sending arbitrary operation names can't grow memory without bound
+OVERFLOW_LABEL = "other"
+MAX_SERIES = 500
+
+
+# A Prometheus-style cumulative histogram per label set, kept in process
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            if labels not in self._series and len(self._series) >= MAX_SERIES:
+                labels = (OVERFLOW_LABEL,) * len(labels)
+            series = self._series.get(labels)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+
+        for labels, values in sorted(series.items()):
+            counts, total = values[:-1], values[-1]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", labels + (format_bound(bound),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+    # The histogram in the Prometheus text exposition format
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for suffix, labels, value in self.samples():
+            names = (
+                self.labelnames + ("le",) if suffix == "_bucket" else self.labelnames
+            )
+            pairs = ",".join(
+                f'{name}="{escape(label)}"' for name, label in zip(names, labels)
+            )
+            lines.append(f"{self.name}{suffix}{{{pairs}}} {format_value(value)}")
+        return "\n".join(lines)
+
+
+def format_bound(bound):
+    return "+Inf" if bound == math.inf else format_value(bound)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+OPERATION_SECONDS = Histogram(
+    "graphql_operation_duration_seconds",
+    "Wall time of each GraphQL operation.",
+    ["operation"],
+    DURATION_BUCKETS,
+)
+OPERATION_QUERIES = Histogram(
+    "graphql_operation_sql_queries",
+    "SQL queries run by each GraphQL operation.",
+    ["operation"],
+    QUERY_BUCKETS,
+)
+OPERATION_SQL_SECONDS = Histogram(
+    "graphql_operation_sql_duration_seconds",
+    "Time spent in SQL by each GraphQL operation.",
+    ["operation"],
+    DURATION_BUCKETS,
+)
+FIELD_SECONDS = Histogram(
+    "graphql_field_duration_seconds",
+    "Time spent in the resolvers under each top-level field.",
+    ["operation", "field"],
+    DURATION_BUCKETS,
+)
+FIELD_QUERIES = Histogram(
+    "graphql_field_sql_queries",
+    "SQL queries run by the resolvers under each top-level field.",
+    ["operation", "field"],
+    QUERY_BUCKETS,
+)
+FIELD_SQL_SECONDS = Histogram(
+    "graphql_field_sql_duration_seconds",
+    "Time spent in SQL by the resolvers under each top-level field.",
+    ["operation", "field"],
+    DURATION_BUCKETS,
+)
+
+HISTOGRAMS = [
+    OPERATION_SECONDS,
+    OPERATION_QUERIES,
+    OPERATION_SQL_SECONDS,
+    FIELD_SECONDS,
+    FIELD_QUERIES,
+    FIELD_SQL_SECONDS,
+]
+
+
+def render():
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+
+
+# What one operation has cost so far. Time and queries are charged to the
+# top-level field whose subtree is resolving; queries issued outside any
+# resolver (DataLoader batches run when their promises are waited on) only
+# count towards the operation.
+class OperationMetrics:
+    def __init__(self, name=None):
+        self.name = name
+        self.queries = 0
+        self.sql_seconds = 0
+        self.fields = {}
+        self.current_field = None
+        # Response key -> top-level field name, so aliases report the field
+        self._field_names = {}
+
+    def field(self, info):
+        key = info.path[0]
+        if len(info.path) == 1:
+            self._field_names[key] = info.field_name
+        name = self._field_names.get(key, key)
+        if name not in self.fields:
+            self.fields[name] = {"seconds": 0, "queries": 0, "sql_seconds": 0}
+        return name
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if self.current_field is not None:
+                self.fields[self.current_field]["queries"] += 1
+                self.fields[self.current_field]["sql_seconds"] += elapsed
+
+    def report(self, seconds):
+        return {
+            "operation": self.name,
+            "seconds": round(seconds, 4),
+            "queries": self.queries,
+            "sql_seconds": round(self.sql_seconds, 4),
+            "fields": {
+                name: {
+                    "seconds": round(field["seconds"], 4),
+                    "queries": field["queries"],
+                    "sql_seconds": round(field["sql_seconds"], 4),
+                }
+                for name, field in self.fields.items()
+            },
+        }
+
+
+# Measure the operation executed inside the block. The metrics object is
+# put on `request` for MetricsMiddleware to charge resolvers to; when the
+# block exits the histograms are updated and an operation that ran more
+# than GRAPHQL_QUERY_BUDGET queries is logged.
+@contextlib.contextmanager
+def track_operation(request, operation_name=None):
+    metrics = request.graphql_metrics = OperationMetrics(operation_name)
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(metrics.execute_wrapper):
+            yield metrics
+    finally:
+        seconds = time.perf_counter() - started
+        del request.graphql_metrics
+        record(metrics, seconds)
+
+
+def record(metrics, seconds):
+    operation = metrics.name or "anonymous"
+    OPERATION_SECONDS.observe(seconds, operation)
+    OPERATION_QUERIES.observe(metrics.queries, operation)
+    OPERATION_SQL_SECONDS.observe(metrics.sql_seconds, operation)
+    for name, field in metrics.fields.items():
+        FIELD_SECONDS.observe(field["seconds"], operation, name)
+        FIELD_QUERIES.observe(field["queries"], operation, name)
+        FIELD_SQL_SECONDS.observe(field["sql_seconds"], operation, name)
+
+    if metrics.queries > settings.GRAPHQL_QUERY_BUDGET:
+        report = metrics.report(seconds)
+        report["operation"] = operation
+        report["budget"] = settings.GRAPHQL_QUERY_BUDGET
+        logger.warning(
+            "GraphQL operation over query budget: %s",
+            json.dumps(report, sort_keys=True),
+        )
+
+
+# Graphene middleware charging each resolver's time and queries to its
+# top-level field in the operation being tracked. Operations executed
+# without track_operation (the shell, schema.execute in tests) pass straight
+# through.
+class MetricsMiddleware:
+    def resolve(self, next, root, info, **args):
+        metrics = getattr(info.context, "graphql_metrics", None)
+        if metrics is None:
+            return next(root, info, **args)
+
+        if metrics.name is None and info.operation.name is not None:
+            metrics.name = info.operation.name.value
+
+        field = metrics.field(info)
+        outer_field, metrics.current_field = metrics.current_field, field
+        started = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            metrics.fields[field]["seconds"] += time.perf_counter() - started
+            metrics.current_field = outer_field
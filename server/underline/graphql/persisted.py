@@ -0,0 +1,170 @@
+import collections
+import functools
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+PERSISTED_QUERY_KEY = "graphql:query:{}"
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+PERSISTED_QUERY_NOT_ALLOWED = "PersistedQueryNotAllowed"
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+# A thread-safe LRU map
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Parses and validates each distinct query document once and keeps the
+# result in an LRU keyed by the query's SHA-256, so the handful of
+# operations the app sends over and over skip both steps. Documents that
+# fail validation aren't cached.
+class CachedDocumentBackend(GraphQLCoreBackend):
+    def __init__(self, maxsize=256, executor=None):
+        super().__init__(executor=executor)
+        self.documents = LRUCache(maxsize)
+
+    def document_from_string(self, schema, document_string):
+        key = (id(schema), query_hash(document_string))
+        document = self.documents.get(key)
+        if document is not None:
+            return document
+
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+        if errors:
+            return GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=lambda *args, **kwargs: ExecutionResult(
+                    errors=errors, invalid=True
+                ),
+            )
+
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=functools.partial(
+                execute, schema, document_ast, **self.execute_params
+            ),
+        )
+        self.documents.set(key, document)
+        return document
+
+    # Whether the document parses and validates against the schema. Valid
+    # ones are cached along the way, so running them next costs nothing more.
+    def is_valid(self, schema, document_string):
+        try:
+            self.document_from_string(schema, document_string)
+        except GraphQLError:
+            return False
+        return self.documents.get((id(schema), query_hash(document_string))) is not None
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = CachedDocumentBackend(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+    return _backend
+
+
+# {sha256: query} from the manifest named by GRAPHQL_QUERY_ALLOWLIST, or None
+# when any query may run
+@functools.lru_cache(maxsize=None)
+def get_allowlist(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Resolve the query for an Apollo-style persisted query request, where
+# extensions.persistedQuery.sha256Hash stands in for (or accompanies) the
+# query text. Returns the query, or raises PersistedQueryError with the
+# message the client expects.
+#
+# Without an allow-list, a hash we haven't seen is answered with
+# PersistedQueryNotFound and the client retries with the full query, which
+# registers it for GRAPHQL_PERSISTED_QUERY_TTL if it's no longer than
+# GRAPHQL_PERSISTED_QUERY_MAX_LENGTH and valid against `schema`, so clients
+# can't fill the cache with junk. With an allow-list, only the operations
+# in the manifest run, whether they're sent by hash or in full.
+def resolve_query(query, extensions, schema):
+    allowlist = get_allowlist(settings.GRAPHQL_QUERY_ALLOWLIST)
+    persisted = (extensions or {}).get("persistedQuery")
+
+    if not persisted:
+        if allowlist is not None and query and query_hash(query) not in allowlist:
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_ALLOWED)
+        return query
+
+    sha256 = persisted.get("sha256Hash")
+    if query:
+        if query_hash(query) != sha256:
+            raise PersistedQueryError("provided sha does not match query")
+        if allowlist is not None and sha256 not in allowlist:
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_ALLOWED)
+        if allowlist is None:
+            register_query(schema, sha256, query)
+        return query
+
+    if allowlist is not None:
+        query = allowlist.get(sha256)
+    else:
+        query = cache.get(PERSISTED_QUERY_KEY.format(sha256))
+    if query is None:
+        raise PersistedQueryError(PERSISTED_QUERY_NOT_FOUND)
+    return query
+
+
+def register_query(schema, sha256, query):
+    if len(query) > settings.GRAPHQL_PERSISTED_QUERY_MAX_LENGTH:
+        return
+    if not get_backend().is_valid(schema, query):
+        return
+    cache.set(
+        PERSISTED_QUERY_KEY.format(sha256),
+        query,
+        settings.GRAPHQL_PERSISTED_QUERY_TTL.total_seconds(),
+    )
+
+
+class PersistedQueryError(Exception):
+    pass
@@ -3,7 +3,6 @@ import json
 
 from django.db.models import Q
 import decimal
-import requests
 from graphene_django import DjangoObjectType
 from pytz import timezone, utc
 from core.models import (
@@ -20,7 +19,15 @@ from core.models import (
     League,
     Movement,
     SubMovement,
+    WalletTransaction,
+    grade_pick,
 )
+from core import exposure, wallet
+from core.lobby import get_lobby
+from core.wallet import FREE_TO_PLAY_BALANCE
+from core.geolocation import PAY_TO_PLAY, client_ip, get_geolocator
+from core.mail import queue_admin_email
+from underline.graphql.loaders import load_related, load_reverse
 from accounts.models import User
 from graphql_jwt.decorators import login_required
 
@@ -28,11 +35,7 @@ from turfpy.measurement import boolean_point_in_polygon
 from geojson import Point, Polygon, Feature
 from django.conf import settings
 from graphql_jwt.utils import jwt_payload
-from sendgrid.helpers.mail import Mail
-from sendgrid import SendGridAPIClient
-import pytz
-import datetime
-from django.db.models import Sum
+from django.db import transaction
 
 
 class TeamType(DjangoObjectType):
@@ -53,6 +56,12 @@ class GameType(DjangoObjectType):
     class Meta:
         model = Game
 
+    def resolve_home_team(parent, info):
+        return load_related(info, parent, "home_team")
+
+    def resolve_away_team(parent, info):
+        return load_related(info, parent, "away_team")
+
 
 class PlayerType(DjangoObjectType):
     team = graphene.Field(TeamType)
@@ -60,6 +69,9 @@ class PlayerType(DjangoObjectType):
     class Meta:
         model = Player
 
+    def resolve_team(parent, info):
+        return load_related(info, parent, "team")
+
 
 class LeagueType(DjangoObjectType):
     class Meta:
@@ -72,6 +84,9 @@ class LineCategoryType(DjangoObjectType):
     class Meta:
         model = LineCategory
 
+    def resolve_league(parent, info):
+        return load_related(info, parent, "league")
+
 
 class LineType(DjangoObjectType):
     player = graphene.Field(PlayerType)
@@ -81,6 +96,15 @@ class LineType(DjangoObjectType):
     class Meta:
         model = Line
 
+    def resolve_player(parent, info):
+        return load_related(info, parent, "player")
+
+    def resolve_game(parent, info):
+        return load_related(info, parent, "game")
+
+    def resolve_category(parent, info):
+        return load_related(info, parent, "category")
+
 
 class SubMovementType(DjangoObjectType):
     class Meta:
@@ -99,6 +123,9 @@ class SublineType(DjangoObjectType):
     class Meta:
         model = Subline
 
+    def resolve_line(parent, info):
+        return load_related(info, parent, "line")
+
 
 class MyPickType(DjangoObjectType):
     subline = graphene.Field(SublineType)
@@ -107,8 +134,21 @@ class MyPickType(DjangoObjectType):
     class Meta:
         model = Pick
 
+    def resolve_subline(parent, info):
+        return load_related(info, parent, "subline")
+
+    # Graded from the batched subline and line loads
     def resolve_won(parent, info):
-        return parent.won
+        return load_related(info, parent, "subline").then(
+            lambda subline: load_related(info, subline, "line").then(
+                lambda line: grade_pick(
+                    parent.under,
+                    subline.projected_value,
+                    line.actual_value,
+                    line.invalidated,
+                )
+            )
+        )
 
 
 class MySlipType(DjangoObjectType):
@@ -119,7 +159,7 @@ class MySlipType(DjangoObjectType):
     invalidated = graphene.Boolean()
 
     def resolve_picks(parent, info):
-        return Pick.objects.filter(slip=parent)
+        return load_reverse(info, parent, Pick, "slip")
 
     def resolve_pay_amount(parent, info):
         return parent.payout_amount
@@ -153,38 +193,12 @@ class Query(graphene.ObjectType):
     user = graphene.Field(UserType, username=graphene.String(required=True))
 
     # Get today's date. Find all the games that lie on today's
-    # date. Get all the lines that roll up to these dates. Get all the sublines
-    # that these lines roll up to.
+    # date. Get all the sublines that roll up to those games, premier
+    # players first, in a single query. Served from the versioned lobby
+    # cache when nothing has changed since the last read.
     def resolve_todays_sublines(self, info, **kwargs):
         cd = CurrentDate.objects.first()
-        todays_games = []
-
-        for game in Game.objects.all():
-            if game.pst_gametime.date() == cd.date:
-                todays_games.append(game)
-
-        # Hacky way to append two pre-sorted querysets
-        # Might be better way
-        # https://stackoverflow.com/questions/18235419/how-to-chain-django-querysets-preserving-individual-order
-        q1 = Subline.objects.filter(
-            line__in=Line.objects.filter(game__in=todays_games, invalidated=False)
-            .filter(player__premier=True)
-            .order_by("game__datetime")
-        ).filter(visible=True)
-
-        # Needed to fill reset_cache below
-        len(q1)
-
-        q2 = Subline.objects.filter(
-            line__in=Line.objects.filter(game__in=todays_games, invalidated=False)
-            .filter(player__premier=False)
-            .order_by("game__datetime")
-        ).filter(visible=True)
-
-        for line in q2:
-            q1._result_cache.append(line)
-
-        return q1
+        return get_lobby(cd.date)
 
     def resolve_my_picks_for_today(self, info, **kwargs):
         u = User.objects.get(username=kwargs.get("username"))
@@ -216,23 +230,15 @@ class Query(graphene.ObjectType):
 
     @login_required
     def resolve_active_slips(self, info, **kawargs):
-        return [
-            slip
-            for slip in Slip.objects.filter(owner=info.context.user).order_by(
-                "-datetime_created"
-            )
-            if slip.complete == False and slip.invalidated == False
-        ]
+        return Slip.objects.filter(
+            owner=info.context.user, status=Slip.INCOMPLETE
+        ).order_by("-datetime_created")
 
     @login_required
     def resolve_complete_slips(self, info, **kawargs):
-        return [
-            slip
-            for slip in Slip.objects.filter(owner=info.context.user).order_by(
-                "-datetime_created"
-            )
-            if slip.complete == True or slip.invalidated == True
-        ]
+        return Slip.objects.filter(
+            owner=info.context.user, status__in=Slip.SETTLED_STATUSES
+        ).order_by("-datetime_created")
 
     def resolve_current_date(self, info, **kawargs):
         return CurrentDate.objects.first().date
@@ -282,6 +288,8 @@ class CreateCreatorSlip(graphene.Mutation):
             subline.save()
 
             Pick.objects.create(subline=subline, slip=slip, under=p["under"])
+
+        slip.refresh_status()
         return CreateCreatorSlip(success=True)
 
 
@@ -297,61 +305,79 @@ class CreateSlip(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, picks, entry_amount, creator_code):
-        # Check - $80 cap
-        # Get today's slips for this user and sum their entry amounts
-        tz = pytz.timezone("America/Los_Angeles")
-        start = datetime.datetime.now().replace(
-            tzinfo=tz, hour=7, minute=0, second=0
-        ) - datetime.timedelta(days=0)
-        end = datetime.datetime.now().replace(
-            tzinfo=tz, hour=23, minute=0, second=0
-        ) - datetime.timedelta(days=0)
-
-        total = (
-            Slip.objects.filter(
-                datetime_created__lte=end,
-                datetime_created__gte=start,
-                owner=info.context.user,
-            )
-            .aggregate(Sum("entry_amount"))
-            .get("entry_amount__sum", 0)
-        )
-
-        if total == None:
-            total = 0
-
-        if total + entry_amount > 80:
-            return CreateSlip(success=False)
-
-        # Create the slip
-        slip = Slip.objects.create(
-            owner=info.context.user,
-            entry_amount=entry_amount,
-            free_to_play=info.context.user.free_to_play,
-            creator_code=creator_code,
-        )
-
-        for p in picks:
-            subline = Subline.objects.get(id=int(p["id"]))
-            Pick.objects.create(subline=subline, slip=slip, under=p["under"])
-
         u = info.context.user
-        previous_wallet_balance = u.wallet_balance
-        u.wallet_balance -= entry_amount
-        u.save()
 
-        if not settings.DEBUG:
-            ftp_text = (
-                "free to play" if info.context.user.free_to_play else "pay to play"
+        with transaction.atomic():
+            # Every picked subline must still be in the lobby and its game
+            # not yet started
+            subline_ids = {int(p["id"]) for p in picks}
+            sublines = (
+                Subline.objects.filter(visible=True)
+                .exclude(line__game__datetime__lte=CurrentDate.now())
+                .select_related("line")
+                .in_bulk(subline_ids)
+            )
+            if len(sublines) != len(subline_ids):
+                return CreateSlip(success=False)
+
+            # Check the daily cap against the user's exposure counter. If the
+            # slip is rolled back below, so is its exposure.
+            if not exposure.reserve(u.id, entry_amount):
+                return CreateSlip(success=False)
+
+            # Create the slip, graded up front from the sublines we already
+            # have so it's inserted with its status
+            slip = Slip(
+                owner=u,
+                entry_amount=entry_amount,
+                free_to_play=u.free_to_play,
+                creator_code=creator_code,
             )
-            message = Mail(
-                from_email="support@underlinesports.com",
-                to_emails="support@underlinesports.com",
-                subject=f"[AUTOMATED EMAIL] {info.context.user.first_name} {info.context.user.last_name} created a slip",
-                html_content=f"Type of slip: {ftp_text}<br/><br/>Entry amount: {entry_amount}<br/><br/>Wallet balance before: {previous_wallet_balance}<br/><br/>Wallet balance after: {u.wallet_balance}<br/><br/>Check out it <a href='{settings.DOMAIN}/admin/core/slip/{slip.id}/change/'>here.</a>",
+            picks = [
+                Pick(subline=sublines[int(p["id"])], under=p["under"]) for p in picks
+            ]
+            slip.grade(
+                [
+                    (
+                        pick.subline.line.invalidated,
+                        grade_pick(
+                            pick.under,
+                            pick.subline.projected_value,
+                            pick.subline.line.actual_value,
+                            pick.subline.line.invalidated,
+                        ),
+                    )
+                    for pick in picks
+                ]
             )
-            sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            response = sg.send(message)
+            slip.save()
+
+            for pick in picks:
+                pick.slip = slip
+            Pick.objects.bulk_create(picks)
+
+            # Debit the entry with a conditional UPDATE so concurrent slips
+            # can't overdraw the wallet or overwrite each other's debits
+            if not wallet.post(
+                u.id,
+                WalletTransaction.ENTRY,
+                -entry_amount,
+                slip=slip,
+                require_funds=True,
+            ):
+                transaction.set_rollback(True)
+                return CreateSlip(success=False)
+
+            u.refresh_from_db(fields=["wallet_balance"])
+            previous_wallet_balance = u.wallet_balance + entry_amount
+
+            # Queued in the slip's transaction and sent by the outbox drain
+            if not settings.DEBUG:
+                ftp_text = "free to play" if u.free_to_play else "pay to play"
+                queue_admin_email(
+                    subject=f"[AUTOMATED EMAIL] {u.first_name} {u.last_name} created a slip",
+                    html_content=f"Type of slip: {ftp_text}<br/><br/>Entry amount: {entry_amount}<br/><br/>Wallet balance before: {previous_wallet_balance}<br/><br/>Wallet balance after: {u.wallet_balance}<br/><br/>Check out it <a href='{settings.DOMAIN}/admin/core/slip/{slip.id}/change/'>here.</a>",
+                )
 
         return CreateSlip(success=True, free_to_play=info.context.user.free_to_play)
 
@@ -384,47 +410,22 @@ class CreateUser(graphene.Mutation):
         password,
     ):
         # If user is from PTP eligible state, set slip to that. Else slip is FTP
-        ip = info.context.META.get("HTTP_X_FORWARDED_FOR").split(",")[-1].strip()
-        r = requests.get(
-            f"http://api.ipstack.com/{ip}?access_key=1317f58b9d36a89840ecf6edb5af41be&format=1"
-        )
-
-        country_code = r.json()["country_code"]
-        region_name = r.json()["region_name"]
-        approved_states = [
-            "Arkansas",
-            "California",
-            "District of Columbia",
-            "Florida",
-            "Georgia",
-            "Kansas",
-            "New Mexico",
-            "North Dakota",
-            "Oklahoma",
-            "Oregon",
-            "Rhode Island",
-            "South Carolina",
-            "South Dakota",
-            "Texas",
-            "Utah",
-            "West Virginia",
-            "Wyoming",
-            "Colorado",
-        ]
-
-        free_to_play = region_name not in approved_states
-
-        user = User.objects.create_user(
-            email=email_address.lower(),
-            password=password,
-            username=username,
-            first_name=first_name,
-            last_name=last_name,
-            phone_number=phone_number,
-            birth_date=birth_date,
-            free_to_play=free_to_play,
-            wallet_balance=100 if free_to_play else 0,
-        )
+        location = get_geolocator().lookup(client_ip(info.context))
+        free_to_play = not PAY_TO_PLAY.allows(location)
+
+        with transaction.atomic():
+            user = User.objects.create_user(
+                email=email_address.lower(),
+                password=password,
+                username=username,
+                first_name=first_name,
+                last_name=last_name,
+                phone_number=phone_number,
+                birth_date=birth_date,
+                free_to_play=free_to_play,
+            )
+            if free_to_play:
+                wallet.post(user.id, WalletTransaction.TOP_OFF, FREE_TO_PLAY_BALANCE)
 
         return CreateUser(success=True, free_to_play=free_to_play)
 
@@ -440,16 +441,17 @@ class RecordDeposit(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, amount, transaction_details, order_details):
-        Deposit.objects.create(
-            user=info.context.user,
-            amount=amount,
-            transaction_details=json.loads(transaction_details),
-            order_details=json.loads(order_details),
-        )
-
-        u = info.context.user
-        u.wallet_balance += decimal.Decimal(amount)
-        u.save()
+        amount = decimal.Decimal(str(amount)).quantize(decimal.Decimal("0.01"))
+        with transaction.atomic():
+            deposit = Deposit.objects.create(
+                user=info.context.user,
+                amount=amount,
+                transaction_details=json.loads(transaction_details),
+                order_details=json.loads(order_details),
+            )
+            wallet.post(
+                info.context.user.id, WalletTransaction.DEPOSIT, amount, deposit=deposit
+            )
 
         return RecordDeposit(success=True)
 
@@ -0,0 +1,67 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the lobby, slip lists, slip creation, score updates, results "
+        "emails and slip admin against the current database and compares "
+        "them with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--baseline",
+            default=os.path.join(settings.BASE_DIR, "benchmarks", "baseline.json"),
+        )
+        parser.add_argument(
+            "--save", action="store_true", help="Store the results as the baseline"
+        )
+        parser.add_argument("--tolerance", type=float, default=benchmarks.TOLERANCE)
+        parser.add_argument("benchmarks", nargs="*", help="Names to run (default all)")
+
+    def handle(self, *args, **options):
+        selected = [
+            benchmark()
+            for benchmark in benchmarks.BENCHMARKS
+            if not options["benchmarks"] or benchmark.name in options["benchmarks"]
+        ]
+        baseline = benchmarks.load_baseline(options["baseline"])
+        if baseline and baseline["dataset"] != benchmarks.dataset_size():
+            self.stderr.write(
+                f"Baseline was recorded against {baseline['dataset']}, timings "
+                "won't compare"
+            )
+
+        results = {}
+        for benchmark in selected:
+            results[benchmark.name] = result = benchmarks.run_benchmark(
+                benchmark, options["repeat"]
+            )
+            self.stdout.write(
+                f"{benchmark.name:<24} {result['seconds']:>8.4f}s "
+                f"(fastest {result['fastest']:.4f}s) {result['queries']:>5} queries"
+            )
+
+        if options["save"]:
+            # Keep the baseline of any benchmark that wasn't run
+            if baseline:
+                results = {**baseline["results"], **results}
+            benchmarks.save_baseline(options["baseline"], results)
+            self.stdout.write(f"Saved baseline to {options['baseline']}")
+            return
+
+        if baseline is None:
+            self.stdout.write("No baseline to compare with, run with --save")
+            return
+
+        regressed = benchmarks.regressions(results, baseline, options["tolerance"])
+        for name, reasons in regressed.items():
+            self.stderr.write(f"REGRESSION {name}: {', '.join(reasons)}")
+        if regressed:
+            raise CommandError(f"{len(regressed)} benchmark(s) regressed")
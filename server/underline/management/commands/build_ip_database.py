@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.geolocation import build_database
+
+
+class Command(BaseCommand):
+    help = "Compiles an IP2Location-style CSV into the signup IP range database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "csv", help="ip_from,ip_to,country_code,country_name,region_name,... rows"
+        )
+        parser.add_argument("--output", default=settings.GEOIP_DATABASE)
+
+    def handle(self, *args, **options):
+        with open(options["csv"], newline="") as f:
+            count = build_database(f, options["output"])
+        self.stdout.write(f"Wrote {count} ranges to {options['output']}")
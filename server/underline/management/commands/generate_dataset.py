@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synthetic import generate_dataset
+
+
+class Command(BaseCommand):
+    help = "Fills an empty database with a season-scale synthetic dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seasons", type=int, default=1)
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--slips", type=int, default=1_000_000)
+        parser.add_argument("--players-per-team", type=int, default=13)
+        parser.add_argument("--games-per-team", type=int, default=82)
+        parser.add_argument(
+            "--today",
+            type=datetime.date.fromisoformat,
+            help="System date, YYYY-MM-DD (default: the middle of the last season)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            report = generate_dataset(
+                seasons=options["seasons"],
+                users=options["users"],
+                slips=options["slips"],
+                players_per_team=options["players_per_team"],
+                games_per_team=options["games_per_team"],
+                today=options["today"],
+                seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        for key, value in report.items():
+            self.stdout.write(f"{key}: {value}")
@@ -161,6 +161,7 @@ GRAPHENE = {
     "RELAY_CONNECTION_MAX_LIMIT": 50,
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        "underline.graphql.metrics.MetricsMiddleware",
     ],
 }
 
@@ -169,6 +170,32 @@ GRAPHQL_JWT = {
 }
 
 GRAPHQL_DEBUG = env("GRAPHQL_DEBUG", default=DEBUG)
+# Parsed and validated GraphQL documents kept per process, keyed by SHA-256
+GRAPHQL_DOCUMENT_CACHE_SIZE = env.int("GRAPHQL_DOCUMENT_CACHE_SIZE", default=256)
+# JSON manifest of {sha256: query}. When set, only those operations run and
+# clients can't register new persisted queries.
+GRAPHQL_QUERY_ALLOWLIST = env.str("GRAPHQL_QUERY_ALLOWLIST", default="")
+# How long, and up to what length, queries clients register by hash are kept
+GRAPHQL_PERSISTED_QUERY_TTL = timedelta(
+    days=env.int("GRAPHQL_PERSISTED_QUERY_TTL_DAYS", default=30)
+)
+GRAPHQL_PERSISTED_QUERY_MAX_LENGTH = env.int(
+    "GRAPHQL_PERSISTED_QUERY_MAX_LENGTH", default=10000
+)
+# Operations running more SQL queries than this are logged with a breakdown
+# by top-level field
+GRAPHQL_QUERY_BUDGET = env.int("GRAPHQL_QUERY_BUDGET", default=25)
+# Bearer token /metrics requires. Without one, /metrics is only served
+# under DEBUG.
+METRICS_TOKEN = env.str("METRICS_TOKEN", default="")
+
+# Cache (lobby snapshots). Local memory unless CACHE_URL or REDIS_URL
+# points at Redis, e.g. CACHE_URL=redis://redis:6379/1
+CACHES = {
+    "default": env.cache(
+        "CACHE_URL", default=os.environ.get("REDIS_URL", "locmemcache://")
+    ),
+}
 
 if not DEBUG:
     django_heroku.settings(locals())
@@ -184,6 +211,21 @@ SENDGRID_API_KEY = (
 )
 FANTASY_DATA_API_KEY = "5027edf53fce4983bc2db1733e760b9a"
 
+# Compiled IP range database for signup geolocation (see the
+# build_ip_database command) and how many lookups to keep cached
+GEOIP_DATABASE = env.str(
+    "GEOIP_DATABASE", default=os.path.join(BASE_DIR, "data", "ip-regions.bin")
+)
+GEOIP_CACHE_SIZE = env.int("GEOIP_CACHE_SIZE", default=4096)
+
+# Provider the email outbox sends through: core.mail.SendGridBackend, or
+# core.mail.DjangoMailBackend to go through EMAIL_BACKEND (SMTP, file...)
+EMAIL_OUTBOX_BACKEND = env.str(
+    "EMAIL_OUTBOX_BACKEND", default="core.mail.SendGridBackend"
+)
+# Roll admin notifications up into an hourly digest instead of one email each
+EMAIL_OUTBOX_ADMIN_DIGEST = env.bool("EMAIL_OUTBOX_ADMIN_DIGEST", default=False)
+
 # Environmental
 if DEBUG:
     DOMAIN = "http://127.0.0.1:5000"
@@ -201,10 +243,18 @@ CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = "US/Pacific"
 CELERY_RESULT_SERIALIZER = "json"
+# Redis that lobby diffs are published through to every web process. Without
+# it, diffs only reach clients streaming from the process that made them.
+LOBBY_EVENTS_REDIS_URL = "redis://redis:6379" if DEBUG else os.environ.get("REDIS_URL")
+# Lobby event streams a web process serves at once. Each holds a thread, so
+# keep this well under gunicorn's --threads.
+LOBBY_MAX_STREAMS = env.int("LOBBY_MAX_STREAMS", default=16)
+# Run tasks inline instead of through the broker (e.g. tests without Redis)
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER", default=False)
 CELERY_BEAT_SCHEDULE = {
     "remove_lines_when_game_starts": {
         "task": "core.tasks.remove_lines_when_game_starts",
-        "schedule": crontab(minute="*/30"),
+        "schedule": crontab(minute="*/5"),
     },
     "top_off_free_to_play_user_balances": {
         "task": "core.tasks.top_off_free_to_play_user_balances",
@@ -212,10 +262,30 @@ CELERY_BEAT_SCHEDULE = {
     },
     "update_player_scores": {
         "task": "core.tasks.update_player_scores",
+        "schedule": crontab(minute="*/2"),
+    },
+    "drain_outbox": {
+        "task": "core.tasks.drain_outbox",
+        "schedule": crontab(minute="*"),
+    },
+    "send_admin_digest": {
+        "task": "core.tasks.send_admin_digest",
         "schedule": crontab(minute=0),
     },
     "send_slip_emails": {
         "task": "core.tasks.send_slip_emails",
         "schedule": crontab(minute=0, hour=8),
     },
+    "checkpoint_wallets": {
+        "task": "core.tasks.checkpoint_wallets",
+        "schedule": crontab(minute=30),
+    },
+    "reconcile_wallets": {
+        "task": "core.tasks.reconcile_wallets",
+        "schedule": crontab(minute=45, hour=9),
+    },
+    "reconcile_daily_exposure": {
+        "task": "core.tasks.reconcile_daily_exposure",
+        "schedule": crontab(minute=15),
+    },
 }
@@ -1,13 +1,25 @@
-from django.http import HttpResponse, HttpResponseNotAllowed
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    StreamingHttpResponse,
+)
 from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
 
+import hmac
+import json
 import logging
 import os
+import threading
+import time
 
 from django.views.generic import View
 from django.http import HttpResponse
 from django.conf import settings
 
+from core import lobby_events
+from .graphql import metrics, persisted
+
 
 class FrontendAppView(View):
     """
@@ -45,3 +57,136 @@ class GraphQLView(BaseGraphQLView):
             return HttpResponse(status=200, content="", content_type="application/json")
 
         return super().dispatch(request, *args, **kwargs)
+
+    # Parsed and validated documents are shared by every view in the process
+    def get_backend(self, request):
+        return persisted.get_backend()
+
+    # Swap a persisted query's hash for its query text
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+
+        try:
+            query = persisted.resolve_query(query, extensions, self.schema)
+        except persisted.PersistedQueryError as e:
+            # Answered like a GraphQL error so clients can retry with the
+            # full query
+            raise HttpError(HttpResponse(status=200), str(e))
+
+        return query, variables, operation_name, id
+
+    # Time the operation and count its queries, per operation and per
+    # top-level field (see MetricsMiddleware)
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        args = (request, data, query, variables, operation_name, show_graphiql)
+        if not query:
+            return super().execute_graphql_request(*args)
+
+        with metrics.track_operation(request, operation_name):
+            return super().execute_graphql_request(*args)
+
+
+# GraphQL histograms in the Prometheus text format. Scrapers must send
+# METRICS_TOKEN as a bearer token; without one configured, the metrics are
+# only served under DEBUG.
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse(status=403)
+    elif not hmac.compare_digest(
+        request.META.get("HTTP_AUTHORIZATION", "").encode(),
+        f"Bearer {token}".encode(),
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# Server-sent events with a lobby diff for every change to todaysSublines.
+# Clients should fetch the lobby once the stream opens and apply the diffs
+# to it, and refetch on a `reset` event, which means diffs were missed.
+# Streams end after LOBBY_STREAM_SECONDS for EventSource to reconnect, so
+# a worker's threads aren't held by the same clients forever; comments are
+# sent while idle so proxies don't time the connection out.
+#
+# Each open stream holds one of the worker's threads, so a worker serves at
+# most LOBBY_MAX_STREAMS at once and answers 503 past that, leaving the
+# rest of its threads for /graphql. Clients turned away should refetch
+# todaysSublines now and then, and retry the stream later.
+LOBBY_STREAM_SECONDS = 5 * 60
+LOBBY_KEEPALIVE_SECONDS = 15
+LOBBY_RETRY_MILLISECONDS = 3000
+
+_lobby_stream_slots = None
+
+
+def lobby_stream_slots():
+    global _lobby_stream_slots
+    if _lobby_stream_slots is None:
+        _lobby_stream_slots = threading.BoundedSemaphore(settings.LOBBY_MAX_STREAMS)
+    return _lobby_stream_slots
+
+
+def lobby_events_view(request):
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    slots = lobby_stream_slots()
+    if not slots.acquire(blocking=False):
+        response = HttpResponse(status=503)
+        response["Retry-After"] = LOBBY_RETRY_MILLISECONDS // 1000
+        return response
+
+    response = StreamingHttpResponse(
+        LobbyStream(lobby_events.get_hub(), slots.release),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Don't let nginx-style proxies buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def lobby_event_stream(hub):
+    deadline = time.monotonic() + LOBBY_STREAM_SECONDS
+    with hub.listen() as listener:
+        yield f"retry: {LOBBY_RETRY_MILLISECONDS}\n\n"
+        while time.monotonic() < deadline:
+            data = listener.get(timeout=LOBBY_KEEPALIVE_SECONDS)
+            if listener.dropped:
+                yield "event: reset\ndata: {}\n\n"
+                return
+            if data is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: lobby\ndata: {data}\n\n"
+
+
+# The events of one stream. Closing it, which Django does once the response
+# is finished with whether or not it was ever iterated, frees its slot.
+class LobbyStream:
+    def __init__(self, hub, release):
+        self._events = lobby_event_stream(hub)
+        self._release = release
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        try:
+            self._events.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
@@ -13,3 +13,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'underline.settings')
 
 application = get_wsgi_application()
+
+# Fail at boot, not on the first signup, if the IP range database is missing
+from core.geolocation import get_geolocator  # noqa: E402
+
+get_geolocator()